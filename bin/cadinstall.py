@@ -18,6 +18,14 @@ from lib.tool_defs import *
 from lib.utils import *
 from lib.install import *
 from lib.executor import initialize_executor
+from lib.scheduler import StageScheduler
+from lib.ssh_pool import start_ssh_pool
+from lib.precheck import run_install_prechecks
+from lib.verify import verify_install
+from lib.dedupe import dedupe_site
+from lib.update import update_install
+from lib.journal import InstallJournal
+from lib.replication import measure_site_bandwidth, plan_replication, log_replication_plan
 
 ## define the full path to this script
 script = os.path.realpath(__file__)
@@ -79,6 +87,24 @@ Examples:
 
   # Dry run (pretend mode)
   cadinstall.py --pretend install --vendor synopsys --tool vcs --version 2023.12 --src /tmp/vcs_install
+
+  # Install and check every installed file against the source afterwards
+  cadinstall.py install --vendor synopsys --tool vcs --version 2023.12 --src /tmp/vcs_install --verify
+
+  # Carry on with an install that was interrupted or failed, skipping the work already done
+  cadinstall.py install --vendor synopsys --tool vcs --version 2023.12 --src /tmp/vcs_install --resume
+
+  # Install a new release, hard linking files unchanged since the last installed version
+  cadinstall.py install --vendor synopsys --tool vcs --version 2023.12-SP1 --src /tmp/vcs_install --link-previous
+
+  # Apply a vendor hotfix to an installed version in place, removing files the hotfix deleted
+  cadinstall.py update --vendor synopsys --tool vcs --version 2023.12 --src /tmp/vcs_hotfix --delete
+
+  # Check an existing installation against its source on all sites
+  cadinstall.py verify --vendor synopsys --tool vcs --version 2023.12 --src /tmp/vcs_install
+
+  # Deduplicate existing installs for at most an hour per site (e.g. nightly from cron)
+  cadinstall.py dedupe --time-limit 60 --prune
 """
 if 'addlink' not in disabled_subcommands:
     epilog_text += """
@@ -120,6 +146,12 @@ install_parser.add_argument('--addlink', dest="link", required=False, help='The
 install_parser.add_argument('--sites', type=str, required=False, help='Comma-separated list of sites to install the tool to. Valid values: aus, yyz. If not specified, installs to all sites')
 install_parser.add_argument('--group', dest="group", default=dest_group, help='The group to own the destination directory, replacing the default from tool_defs (default: %s). Quote names that contain spaces, e.g. --group "domain users"' % dest_group)
 install_parser.add_argument('--skip-modules', dest="skip_modules", action='store_true', help='Skip module file installation (useful when permissions are insufficient)')
+install_parser.add_argument('--seed-fanout', dest="seed_fanout", type=int, default=seed_fanout, help='Number of other sites that each installed site may seed at the same time. Seeding sources are chosen by link bandwidth. 0 copies every site from --src (default: %d)' % seed_fanout)
+install_parser.add_argument('--verify', dest="verify", action='store_true', help='After copying, hash every installed file and compare it with the source')
+install_parser.add_argument('--dedupe', dest="dedupe", action='store_true', help='After copying, hard link installed files to identical files already in the site\'s deduplication store')
+install_parser.add_argument('--link-previous', dest="link_previous", action='store_true', help='Hard link files that are unchanged since the most recently installed version of the same vendor/tool on each site instead of copying them')
+install_parser.add_argument('--resume', dest="resume", action='store_true', help='Continue an install that was interrupted or failed from its journal: sites and stages already finished are skipped, and files already copied are not sent again')
+install_parser.add_argument('--site-jobs', dest="site_jobs", type=int, default=site_stage_concurrency, help='Maximum number of install stages to run at the same time on each site. All sites install concurrently (default: %d)' % site_stage_concurrency)
 
 # --- addlink subcommand (gated by disabled_subcommands in tool_defs.py) ---
 if 'addlink' not in disabled_subcommands:
@@ -140,6 +172,36 @@ if 'delete' not in disabled_subcommands:
     delete_required.add_argument('--version', '-ver', dest="version", required=True, help='The version of the tool to delete (e.g., 2023.12)')
     delete_parser.add_argument('--sites', type=str, required=False, help='Comma-separated list of sites to delete the tool from. Valid values: aus, yyz. If not specified, deletes from all sites')
 
+# --- verify subcommand ---
+verify_parser = subparsers.add_parser('verify', help='Check that an installed vendor/tool/version matches its source')
+verify_required = verify_parser.add_argument_group('required arguments')
+verify_required.add_argument('--vendor', dest="vendor", required=True, help='The vendor of the tool (e.g., synopsys, cadence)')
+verify_required.add_argument('--tool', '-t', dest="tool", required=True, help='The tool to verify (e.g., vcs, icc2)')
+verify_required.add_argument('--version', '-ver', dest="version", required=True, help='The installed version to verify (e.g., 2023.12)')
+verify_required.add_argument('--src', dest="src", required=True, help='The source directory the version was installed from')
+verify_parser.add_argument('--sites', type=str, required=False, help='Comma-separated list of sites to verify. Valid values: aus, yyz. If not specified, verifies all sites')
+
+# --- update subcommand ---
+update_parser = subparsers.add_parser('update', help='Patch an installed vendor/tool/version in place from a new source, copying only what changed')
+update_required = update_parser.add_argument_group('required arguments')
+update_required.add_argument('--vendor', dest="vendor", required=True, help='The vendor of the tool (e.g., synopsys, cadence)')
+update_required.add_argument('--tool', '-t', dest="tool", required=True, help='The tool to update (e.g., vcs, icc2)')
+update_required.add_argument('--version', '-ver', dest="version", required=True, help='The installed version to update (e.g., 2023.12)')
+update_required.add_argument('--src', dest="src", required=True, help='The source directory with the new contents of the version')
+update_parser.add_argument('--sites', type=str, required=False, help='Comma-separated list of sites to update. Valid values: aus, yyz. If not specified, updates all sites')
+update_parser.add_argument('--group', dest="group", default=dest_group, help='The group to own the updated entries (default: %s)' % dest_group)
+update_parser.add_argument('--delete', dest="delete", action='store_true', help='Also remove installed files and directories that are no longer in the source. Only the user who made the install may do this, on a completed install: the entries are listed first and must be confirmed by typing DELETE')
+update_parser.add_argument('--verify', dest="verify", action='store_true', help='After updating, hash every installed file and compare it with the source')
+
+# --- dedupe subcommand ---
+dedupe_parser = subparsers.add_parser('dedupe', help='Hard link identical files across installed tools to a per-site content-addressed store')
+dedupe_parser.add_argument('--vendor', dest="vendor", help='Only process installs of this vendor')
+dedupe_parser.add_argument('--tool', '-t', dest="tool", help='Only process installs of this tool (requires --vendor)')
+dedupe_parser.add_argument('--version', '-ver', dest="version", help='Only process this version (requires --vendor and --tool)')
+dedupe_parser.add_argument('--sites', type=str, required=False, help='Comma-separated list of sites to process. Valid values: aus, yyz. If not specified, processes all sites')
+dedupe_parser.add_argument('--time-limit', dest="time_limit", type=float, default=dedupe_time_limit, help='Stop after this many minutes per site; the next run carries on from there (default: %s)' % ('no limit' if dedupe_time_limit is None else dedupe_time_limit))
+dedupe_parser.add_argument('--prune', dest="prune", action='store_true', help='Afterwards, remove store entries that no installed file links to any more')
+
 args = parser.parse_args()
 
 # Check if no subcommand was provided
@@ -151,6 +213,9 @@ if not args.subcommand:
         print("  addlink    Create or update a symlink for a previously installed version")
     if 'delete' not in disabled_subcommands:
         print("  delete     Delete a previously installed vendor/tool/version")
+    print("  update     Patch an installed version in place from a new source")
+    print("  verify     Check that an installed version matches its source")
+    print("  dedupe     Hard link identical files across installs to a per-site store")
     print("\nFor detailed help on a specific subcommand, use:")
     print("  cadinstall.py <subcommand> --help")
     print("\nFor general help, use:")
@@ -183,6 +248,19 @@ if args.force:
 # Initialize sitesList - this will be populated in the main() function based on subcommand
 sitesList = []
 
+def check_path_components(values):
+    """
+    Exit unless every (label, value) pair is a plain directory name, the
+    same rule addlink and delete apply, so that a value such as '..' or an
+    absolute path cannot point a subcommand outside the tool directory tree.
+    """
+    path_component_re = re.compile(r'^(?!\.+$)[A-Za-z0-9][A-Za-z0-9._-]*$')
+    for label, value in values:
+        if not value or not path_component_re.match(value):
+            logger.error("Invalid %s value: '%s'. Must be a plain directory name "
+                         "(no slashes, no dots-only, no whitespace)." % (label, value))
+            sys.exit(1)
+
 def main():
     global sitesList
     
@@ -234,6 +312,10 @@ def main():
                 # now make sure to push the local site to the front of the list. this ensures that the localsite
                 # gets updated first which is probably what the user wants
                 sitesList.insert(0, domain)
+
+        # Open the pooled ssh connections to every site host in the background
+        # while the remaining arguments are validated.
+        start_ssh_pool([siteHash[site] for site in sitesList])
         
         # --group replaces dest_group from tool_defs.py (e.g. "domain users").
         if hasattr(args, 'group') and args.group:
@@ -248,62 +330,80 @@ def main():
             install_parser.print_help()
             sys.exit(1)
 
-        # Perform disk space precheck before starting installation
-        from lib.utils import check_disk_space_precheck
-        success, sites_with_space, sites_without_space = check_disk_space_precheck(
-            src, sitesList, vendor, tool, version, dest)
-        
-        if not success:
-            logger.error("Disk space precheck failed!")
-            if sites_with_space and sites_without_space:
-                # Some sites have space, some don't - suggest using --sites switch
-                logger.error("Insufficient disk space on sites: %s" % ', '.join(sites_without_space))
-                logger.error("Sites with sufficient space: %s" % ', '.join(sites_with_space))
-                logger.error("")
-                logger.error("To install only to sites with sufficient space, use:")
-                logger.error("  --sites %s" % ','.join(sites_with_space))
-                sys.exit(1)
-            elif sites_without_space:
-                # No sites have sufficient space
-                logger.error("Insufficient disk space on all target sites: %s" % ', '.join(sites_without_space))
-                logger.error("Please free up disk space or choose a different installation location.")
+        final_dest = "%s/%s/%s/%s" % (dest, vendor, tool, version)
+
+        # Every site gets an install journal so an interrupted install can be
+        # resumed. With --resume the journals of the previous run are used:
+        # sites it finished are skipped, the others carry on where they stopped.
+        journals = {}
+        resume_sites = []
+        finished_sites = []
+        for site in sitesList:
+            journal = InstallJournal.load(final_dest, site) if args.resume else None
+            if journal is None:
+                journals[site] = InstallJournal(final_dest, site, src)
+                continue
+            if os.path.realpath(journal.src) != os.path.realpath(src):
+                logger.error("The interrupted install of %s on %s was from %s, not %s"
+                             % (final_dest, site, journal.src, src))
+                logger.error("Rerun with --src %s, or delete %s and install again without --resume."
+                             % (journal.src, final_dest))
                 sys.exit(1)
+            journals[site] = journal
+            if journal.complete():
+                logger.info("%s was already installed on %s by the previous run, skipping this site"
+                            % (final_dest, site))
+                finished_sites.append(site)
             else:
-                # No sites in either list - likely an error checking source directory or other critical failure
-                logger.error("Critical error during disk space precheck. Cannot proceed.")
-                sys.exit(1)
-        else:
-            logger.info("Disk space precheck passed for all sites: %s" % ', '.join(sites_with_space))
+                logger.info("Resuming the install of %s on %s" % (final_dest, site))
+                resume_sites.append(site)
+        if args.resume and not resume_sites and not finished_sites:
+            logger.warning("No interrupted install of %s to resume, installing as usual" % final_dest)
+        sitesList = [site for site in sitesList if site not in finished_sites]
+        if not sitesList:
+            logger.info("%s is already installed on every site" % final_dest)
+            for journal in journals.values():
+                journal.remove()
+            sys.exit(0)
 
         # Pre-validate ALL sites before starting any installation.
         # This prevents partial installations where one site succeeds and another fails.
-        final_dest = "%s/%s/%s/%s" % (dest, vendor, tool, version)
-        for site in sitesList:
-            dest_host = siteHash[site]
-            other_sites = [s for s in sitesList if s != site]
-
-            # Check that the destination does not already exist
-            if check_dest(final_dest, dest_host):
-                logger.error("Aborting installation to ALL sites. No changes have been made.")
-                if other_sites:
-                    logger.error("To install only to the other site(s), rerun with: --sites %s" % ','.join(other_sites))
+        # Every check for every site runs at the same time.
+        skip_modules = hasattr(args, 'skip_modules') and args.skip_modules
+        # Once a site has its copy it can seed other sites, which ensures
+        # all sites are equivalent and spreads the load off the staging
+        # host. But don't do this if the final_dest is on tmp because that
+        # won't be accessible from the other sites.
+        can_seed = not re.search("^/tmp", final_dest)
+        fanout = args.seed_fanout
+        seeding = can_seed and fanout > 0 and len(sitesList) > 1
+        report = run_install_prechecks(src, sitesList, vendor, tool, version, dest, skip_modules=skip_modules,
+                                       resume_sites=resume_sites, check_seeding=seeding)
+        report.log()
+
+        if not report.ok():
+            if report.errors:
+                # Likely an error checking the source directory or other critical failure
+                logger.error("Critical error during prechecks. Cannot proceed.")
+                if report.source_problems:
+                    logger.error("Make the entries listed above readable to %s (or remove them from the source) and rerun." % cadtools_user)
                 sys.exit(1)
 
-            if not check_install_permissions(final_dest, dest_host):
-                logger.error("Insufficient permissions to install %s on %s." % (final_dest, site))
-                logger.error("Aborting installation to ALL sites. No changes have been made.")
-                if other_sites:
-                    logger.error("To install only to the other site(s), rerun with: --sites %s" % ','.join(other_sites))
-                sys.exit(1)
-
-            if not (hasattr(args, 'skip_modules') and args.skip_modules):
-                if not check_module_permissions(vendor, tool, dest_host):
-                    logger.error("Insufficient permissions for module file installation on %s." % site)
-                    logger.error("Aborting installation to ALL sites. No changes have been made.")
-                    if other_sites:
-                        logger.error("To install only to the other site(s), rerun with: --sites %s" % ','.join(other_sites))
-                    logger.error("Or use --skip-modules flag to skip module installation and continue.")
-                    sys.exit(1)
+            failed_sites = report.failed_sites()
+            passed_sites = report.passed_sites()
+            logger.error("Prechecks failed on site(s): %s" % ', '.join(failed_sites))
+            logger.error("Aborting installation to ALL sites. No changes have been made.")
+            if not args.resume and any(InstallJournal.load(final_dest, site) for site in failed_sites):
+                logger.error("An earlier install of %s was interrupted; rerun with --resume to continue it." % final_dest)
+            if passed_sites:
+                logger.error("To install only to the other site(s), rerun with: --sites %s" % ','.join(passed_sites))
+            if 'disk space' in report.failed_checks():
+                logger.error("Please free up disk space or choose a different installation location.")
+            if 'module permissions' in report.failed_checks():
+                logger.error("Or use --skip-modules flag to skip module installation and continue.")
+            if 'destination' in report.failed_checks():
+                logger.error("To patch an existing install in place, use the update subcommand.")
+            sys.exit(1)
 
         logger.info("Prechecks passed for all sites: %s" % ', '.join(sitesList))
 
@@ -314,40 +414,35 @@ def main():
             logger.info("To perform the actual installation, rerun without the '--pretend' switch.")
             logger.info("="*80)
         else:
-            for idx, site in enumerate(sitesList):
-                dest_host = siteHash[site]
-
-                # Establish the deletion metadata BEFORE anything is copied in.
-                # If the install is interrupted (network drop, ctrl-c, etc.) the
-                # metadata file still exists so the delete subcommand can act on
-                # it. The completion time is added once the install finishes.
-                install_started_on = datetime.now().astimezone()
-                write_metadata(final_dest, dest_host, install_started_on)
-
-                logger.info("Installing %s to %s ..." %(final_dest,site))
-                install_tool(vendor, tool, version, src, group, dest_host, final_dest)
-
-                if hasattr(args, 'link') and args.link:
-                    create_link(dest, vendor, tool, version, args.link, dest_host)
-
-                # Install module files unless --skip-modules was specified
-                if not (hasattr(args, 'skip_modules') and args.skip_modules):
-                    module_status = install_module_files(vendor, tool, version, dest_host)
-                    if module_status != 0:
-                        logger.error("Module file installation failed for %s. Use --skip-modules to bypass." % site)
-                        sys.exit(1)
-                else:
-                    logger.info("Skipping module file installation (--skip-modules specified)")
-
-                # Installation finished for this site - record the completion
-                # time so the deletion policy uses "Install completed on".
-                write_metadata(final_dest, dest_host, install_started_on, completed_on=datetime.now().astimezone())
-
-                # Now that one site is done, change the source to the installed site so that we are ensuring all sites are equivalent
-                # But don't do this if the final_dest is on tmp because that won't be accessible
-                if not re.search("^/tmp", final_dest):
-                    src = final_dest
-            
+            # Sites whose hosts have no ssh trust between them are not
+            # paired; they copy from the origin instead.
+            site_hosts = dict((site, siteHash[site]) for site in sitesList)
+            if len(sitesList) > 1 and fanout > 0:
+                bandwidth = measure_site_bandwidth(sitesList, site_hosts, can_seed=can_seed,
+                                                   links=report.seed_links)
+            else:
+                bandwidth = {}
+            plan = plan_replication(sitesList, bandwidth, fanout=fanout, can_seed=can_seed,
+                                    links=report.seed_links)
+            log_replication_plan(plan)
+
+            scheduler = StageScheduler(site_concurrency=args.site_jobs)
+            add_replication_stages(
+                scheduler, plan, site_hosts, vendor, tool, version, src, group, final_dest,
+                journals=journals,
+                link=args.link if hasattr(args, 'link') else None,
+                skip_modules=skip_modules,
+                verify_src=src if args.verify else None,
+                link_previous=args.link_previous,
+                dedupe=args.dedupe)
+
+            if not scheduler.run():
+                logger.error("Installation failed on site(s): %s" % ', '.join(scheduler.failed_sites()))
+                logger.error("Fix the problem and rerun with --resume to carry on where this install stopped.")
+                sys.exit(1)
+            for journal in journals.values():
+                journal.remove()
+
             # Check if installation was only to yyz2-nfspublish (Pure filesystem replication)
             unique_hosts = set([siteHash[site] for site in sitesList])
             if len(unique_hosts) == 1 and 'yyz2-nfspublish.yyz2.tenstorrent.com' in unique_hosts:
@@ -404,6 +499,10 @@ def main():
             if domain in siteHash:
                 sitesList.insert(0, domain)
 
+        # Open the pooled ssh connections to every site host in the background
+        # while the remaining arguments are validated.
+        start_ssh_pool([siteHash[site] for site in sitesList])
+
         if link == version:
             logger.error("The --link name '%s' is the same as --version. "
                          "The symlink cannot point to itself." % link)
@@ -413,48 +512,39 @@ def main():
             dest_host = siteHash[site]
             version_dir = "%s/%s/%s/%s" % (dest, vendor, tool, version)
             link_path = "%s/%s/%s/%s" % (dest, vendor, tool, link)
-            is_local = (check_same_host(dest_host) == 0)
 
+            # Verify the version directory exists, verify the link name does
+            # not collide with an existing real directory (an existing symlink
+            # is fine — we'll overwrite it) and read the current link target,
+            # all in one round trip to the host. In pretend mode only the
+            # read-only readlink runs.
+            readlink_step = batch_step("/bin/readlink %s" % link_path, ignore_failure=True)
             if lib.my_globals.get_pretend():
                 logger.info("Pretend mode: would verify version directory exists: %s on %s" % (version_dir, dest_host))
                 logger.info("Pretend mode: would verify link name is not an existing directory: %s on %s" % (link_path, dest_host))
+                rl_result, = run_batch(dest_host, [readlink_step], force_run=True)
             else:
-                # Verify the version directory exists on the target host
-                if is_local:
-                    test_command = "/bin/test -d %s" % version_dir
-                else:
-                    test_command = "/usr/bin/ssh %s /bin/test -d %s" % (dest_host, version_dir)
-
-                test_status = run_command(test_command)
-                if test_status != 0:
+                version_result, collision_result, rl_result = run_batch(dest_host, [
+                    batch_step("/bin/test -d %s" % version_dir),
+                    # True unless the link name is a real directory
+                    batch_step("/bin/test ! -d %s -o -L %s" % (link_path, link_path)),
+                    readlink_step,
+                ], force_run=True)
+
+                if version_result['status'] != 0:
                     logger.error("Version directory does not exist: %s on %s" % (version_dir, dest_host))
                     logger.error("The --version must refer to an already-installed version.")
                     sys.exit(1)
 
-                # Verify the link name does not collide with an existing real
-                # directory (an existing symlink is fine — we'll overwrite it).
-                # "test -d X && ! test -L X" is true only for real directories.
-                if is_local:
-                    collision_command = "/bin/test -d %s && ! /bin/test -L %s" % (link_path, link_path)
-                else:
-                    collision_command = "/usr/bin/ssh %s '/bin/test -d %s && ! /bin/test -L %s'" % (dest_host, link_path, link_path)
-
-                collision_status = run_command(collision_command)
-                if collision_status == 0:
+                if collision_result['status'] != 0:
                     logger.error("The link name '%s' conflicts with an existing installed version directory: %s on %s" % (link, link_path, dest_host))
                     logger.error("A symlink cannot overwrite a real installation directory.")
                     sys.exit(1)
 
-            # Check if the link already exists as a symlink so we can report
-            # whether this is a create or an update (and from which version).
+            # Report whether this is a create or an update (and from which version).
             old_target = None
-            if is_local:
-                readlink_command = "/bin/readlink %s" % link_path
-            else:
-                readlink_command = "/usr/bin/ssh %s /bin/readlink %s" % (dest_host, link_path)
-            rl_status, rl_output = run_command_with_output(readlink_command, force_run=True)
-            if rl_status == 0 and rl_output.strip():
-                old_target = rl_output.strip().lstrip('./')
+            if rl_result['status'] == 0 and rl_result['output'].strip():
+                old_target = rl_result['output'].strip().lstrip('./')
 
             if old_target and old_target != version:
                 logger.info("Updating symlink '%s' from version '%s' to '%s' in %s/%s/%s on %s ..." % (link, old_target, version, dest, vendor, tool, site))
@@ -502,12 +592,130 @@ def main():
             if domain in siteHash:
                 sitesList.insert(0, domain)
 
+        # Open the pooled ssh connections to every site host in the background
+        # while the remaining arguments are validated.
+        start_ssh_pool([siteHash[site] for site in sitesList])
+
         for site in sitesList:
             dest_host = siteHash[site]
             final_dest = "%s/%s/%s/%s" % (dest, vendor, tool, version)
 
             logger.info("Deleting %s from %s ..." % (final_dest, site))
             delete_tool(vendor, tool, version, dest_host, final_dest)
+            # An interrupted install of the deleted tree cannot be resumed
+            InstallJournal(final_dest, site, None).remove()
+
+    elif args.subcommand == 'verify':
+        vendor = args.vendor
+        tool = args.tool
+        version = args.version
+        src = args.src
+
+        check_path_components([('vendor', vendor), ('tool', tool), ('version', version)])
+
+        # Handle sites argument
+        if hasattr(args, 'sites') and args.sites:
+            sitesList = args.sites.split(",")
+
+            invalid_sites = [site for site in sitesList if site not in siteHash]
+            if invalid_sites:
+                valid_sites = ', '.join(sorted(siteHash.keys()))
+                logger.error("Invalid site(s) specified: %s" % ', '.join(invalid_sites))
+                logger.error("Valid sites are: %s" % valid_sites)
+                sys.exit(1)
+        else:
+            sitesList = list(siteHash)
+
+        start_ssh_pool([siteHash[site] for site in sitesList])
+        check_src(src)
+
+        final_dest = "%s/%s/%s/%s" % (dest, vendor, tool, version)
+        failed_sites = []
+        for site in sitesList:
+            if verify_install(src, final_dest, siteHash[site]) != 0:
+                failed_sites.append(site)
+
+        if failed_sites:
+            logger.error("Verification failed on site(s): %s" % ', '.join(failed_sites))
+            sys.exit(1)
+        logger.info("%s matches %s on all sites: %s" % (final_dest, src, ', '.join(sitesList)))
+
+    elif args.subcommand == 'update':
+        vendor = args.vendor
+        tool = args.tool
+        version = args.version
+        src = args.src
+
+        check_path_components([('vendor', vendor), ('tool', tool), ('version', version)])
+
+        # Handle sites argument
+        if hasattr(args, 'sites') and args.sites:
+            sitesList = args.sites.split(",")
+
+            invalid_sites = [site for site in sitesList if site not in siteHash]
+            if invalid_sites:
+                valid_sites = ', '.join(sorted(siteHash.keys()))
+                logger.error("Invalid site(s) specified: %s" % ', '.join(invalid_sites))
+                logger.error("Valid sites are: %s" % valid_sites)
+                sys.exit(1)
+        else:
+            sitesList = list(siteHash)
+
+        start_ssh_pool([siteHash[site] for site in sitesList])
+        check_src(src)
+
+        final_dest = "%s/%s/%s/%s" % (dest, vendor, tool, version)
+        failed_sites = []
+        for site in sitesList:
+            dest_host = siteHash[site]
+            logger.info("Updating %s on %s from %s ..." % (final_dest, site, src))
+            status = update_install(src, final_dest, dest_host, args.group, delete=args.delete)
+            if status == 0 and args.verify and not lib.my_globals.get_pretend():
+                status = verify_install(src, final_dest, dest_host)
+            if status != 0:
+                failed_sites.append(site)
+
+        if failed_sites:
+            logger.error("Update failed on site(s): %s" % ', '.join(failed_sites))
+            sys.exit(1)
+        logger.info("Updated %s from %s on all sites: %s" % (final_dest, src, ', '.join(sitesList)))
+
+    elif args.subcommand == 'dedupe':
+        if (args.tool and not args.vendor) or (args.version and not args.tool):
+            logger.error("--tool requires --vendor, and --version requires --tool")
+            sys.exit(1)
+        # The walk runs as cadtools and hard links what it finds, so it must stay below dest
+        check_path_components([(label, value) for label, value in
+                               [('vendor', args.vendor), ('tool', args.tool), ('version', args.version)]
+                               if value is not None])
+
+        # Handle sites argument
+        if hasattr(args, 'sites') and args.sites:
+            sitesList = args.sites.split(",")
+
+            invalid_sites = [site for site in sitesList if site not in siteHash]
+            if invalid_sites:
+                valid_sites = ', '.join(sorted(siteHash.keys()))
+                logger.error("Invalid site(s) specified: %s" % ', '.join(invalid_sites))
+                logger.error("Valid sites are: %s" % valid_sites)
+                sys.exit(1)
+        else:
+            sitesList = list(siteHash)
+
+        start_ssh_pool([siteHash[site] for site in sitesList])
+
+        # The global --force processes installs that were already deduplicated again
+        root = os.path.join(dest, *[part for part in (args.vendor, args.tool, args.version) if part])
+        time_limit = args.time_limit * 60 if args.time_limit else None
+        failed_sites = []
+        for site in sitesList:
+            if dedupe_site(siteHash[site], root, time_limit=time_limit, prune=args.prune,
+                            force=args.force) != 0:
+                failed_sites.append(site)
+
+        if failed_sites:
+            logger.error("Deduplication failed on site(s): %s" % ', '.join(failed_sites))
+            sys.exit(1)
 
     else:
         logger.error("Unknown subcommand: %s" % args.subcommand)
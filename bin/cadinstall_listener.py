@@ -79,6 +79,12 @@ with open(ALLOWED_COMMANDS_FILE, 'r') as f:
 
 logger.info("Loaded %d allowed commands from %s" % (len(allowed_commands), ALLOWED_COMMANDS_FILE))
 
+# Longest output line read from a command in one piece
+MAX_LINE_LENGTH = 64 * 1024
+
+# ssh options that reuse one master connection per originating host
+SSH_POOL_OPTIONS = "-o ControlMaster=auto -o ControlPath=/tmp/cadinstall_listener.%d.%%C -o ControlPersist=600" % os.getuid()
+
 def is_command_allowed(command):
     """Check if the command is in the allowed commands list"""
     # Extract the base command (first part before any arguments)
@@ -97,8 +103,10 @@ def execute_command(command, hostname, client_socket):
     Returns exit code.
     """
     # Wrap command with SSH to the originating hostname
-    # This ensures commands run in the context where local filesystems are accessible
-    ssh_command = "/usr/bin/ssh %s '%s'" % (hostname, command.replace("'", "'\\''"))
+    # This ensures commands run in the context where local filesystems are accessible.
+    # Connections are multiplexed over one master per host so that each
+    # command does not pay for a fresh handshake.
+    ssh_command = "/usr/bin/ssh %s %s '%s'" % (SSH_POOL_OPTIONS, hostname, command.replace("'", "'\\''"))
     
     logger.info("Executing command on %s: %s" % (hostname, command))
     
@@ -113,21 +121,30 @@ def execute_command(command, hostname, client_socket):
             universal_newlines=False
         )
         
-        # Read stdout and stderr in real-time
+        # Read stdout and stderr in real-time. Both readers share the client
+        # socket, so sends are serialized to keep each JSON message intact.
+        send_lock = threading.Lock()
+
         def read_stream(stream, stream_type):
             """Read from a stream and send to client"""
+            client_gone = False
             try:
-                for line in iter(stream.readline, b''):
-                    if line:
-                        response = {
-                            'type': stream_type,
-                            'data': line.decode('utf-8', errors='replace').rstrip()
-                        }
-                        try:
+                # Bounded reads so a huge line cannot exhaust memory; longer
+                # lines are sent in pieces.
+                for line in iter(lambda: stream.readline(MAX_LINE_LENGTH), b''):
+                    if client_gone:
+                        # Keep draining so the command never blocks on a full pipe
+                        continue
+                    response = {
+                        'type': stream_type,
+                        'data': line.decode('utf-8', errors='replace').rstrip()
+                    }
+                    try:
+                        with send_lock:
                             client_socket.sendall(json.dumps(response).encode('utf-8') + b'\n')
-                        except Exception as e:
-                            logger.error("Failed to send %s to client: %s" % (stream_type, str(e)))
-                            break
+                    except Exception as e:
+                        logger.error("Failed to send %s to client: %s" % (stream_type, str(e)))
+                        client_gone = True
             except Exception as e:
                 logger.error("Error reading %s: %s" % (stream_type, str(e)))
         
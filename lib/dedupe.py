@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Content-addressed deduplication for cadinstall
+
+Vendors ship the same JREs, Qt libraries, Tcl runtimes and PDK files in
+many tools. Each site keeps a store (tool_defs.dedupe_store) holding one
+hard link per distinct file, named by its BLAKE2b hash, mode, owner and
+mtime.
+Installed files with the same contents are hard linked to it, so every
+copy after the first takes no space.
+
+The work runs in the remote helper on the site's write host, as cadtools.
+A dbm index kept in the store maps each inode seen to its hash, so a file
+is hashed once, and looking a file up in the store is one index read and
+one lstat. A deduplicated file keeps its contents, mode, owner and mtime,
+so update and install --link-previous still see it as unchanged.
+
+install --dedupe runs this on the new install after its copy. The dedupe
+subcommand works through the existing installs, skipping the ones already
+done, and can stop after a time limit to carry on in the next run.
+"""
+
+import os
+import time
+import logging
+
+import lib.tool_defs
+import lib.my_globals
+from lib.utils import format_bytes
+from lib.remote_agent import get_agent, AgentError
+
+logger = logging.getLogger('cadinstall')
+
+# Directory levels from dest down to an install: vendor/tool/version
+INSTALL_DEPTH = 3
+
+
+def _get_agent(dest_host, action):
+    agent = get_agent(dest_host, same_host=True)
+    if agent is None:
+        logger.error("Cannot %s on %s: deduplication needs the remote helper "
+                     "(setuid mode with tool_defs.remote_python set)" % (action, dest_host))
+    return agent
+
+
+def _log_errors(result):
+    for message in result['errors']:
+        logger.warning("Could not deduplicate %s" % message)
+    if result['failed'] > len(result['errors']):
+        logger.warning("... and %d more files" % (result['failed'] - len(result['errors'])))
+
+
+def dedupe_tree(path, dest_host, time_limit=None, nice=0, force=False, agent=None):
+    """
+    Link the files of the install at path on dest_host to the site's store.
+
+    Returns (status, result), result being the helper's counts (None if it
+    could not run). A tree already deduplicated is skipped unless force.
+    """
+    agent = agent or _get_agent(dest_host, "deduplicate %s" % path)
+    if agent is None:
+        return 1, None
+    try:
+        result = agent.call('dedupe', root=path, store=lib.tool_defs.dedupe_store,
+                            min_bytes=lib.tool_defs.dedupe_min_bytes, time_limit=time_limit,
+                            workers=lib.tool_defs.verify_workers, nice=nice, force=force)
+    except AgentError as e:
+        logger.error("Deduplication of %s on %s failed: %s" % (path, dest_host, e))
+        return 1, None
+
+    _log_errors(result)
+    if result['skipped']:
+        logger.debug("%s on %s is already deduplicated" % (path, dest_host))
+    else:
+        logger.info("Deduplicated %s on %s: %d files checked (%d hashed), %d linked to the store, "
+                    "%d added to it, %s saved%s"
+                    % (path, dest_host, result['checked'], result['hashed'], result['linked'], result['stored'],
+                       format_bytes(result['bytes_saved']), '' if result['complete'] else ' (stopped at time limit)'))
+    return (0 if not result['failed'] else 1), result
+
+
+def dedupe_site(dest_host, root, time_limit=None, prune=False, force=False):
+    """
+    Deduplicate every completed install under root (dest or a vendor/tool
+    directory in it) on dest_host, with low priority.
+
+    time_limit is in seconds for the whole site; installs not reached are
+    left for the next run. With prune, store entries that no install links
+    to any more are removed afterwards. Returns 0 on success, 1 otherwise.
+    """
+    agent = _get_agent(dest_host, "deduplicate %s" % root)
+    if agent is None:
+        return 1
+
+    rel = os.path.relpath(root, lib.tool_defs.dest)
+    depth = INSTALL_DEPTH if rel == '.' else INSTALL_DEPTH - len(rel.split(os.sep))
+    try:
+        installs = agent.call('find_installs', root=root, max_depth=max(depth, 0),
+                              skip=[lib.tool_defs.dedupe_store])
+    except AgentError as e:
+        logger.error("Could not list the installs under %s on %s: %s" % (root, dest_host, e))
+        return 1
+    logger.info("Found %d installs under %s on %s" % (len(installs), root, dest_host))
+
+    if lib.my_globals.get_pretend():
+        for path in installs:
+            logger.info("Pretend mode: would deduplicate %s on %s" % (path, dest_host))
+        return 0
+
+    deadline = time.time() + time_limit if time_limit else None
+    status = 0
+    totals = {'installs': 0, 'linked': 0, 'stored': 0, 'bytes_saved': 0}
+    left = 0
+    for index, path in enumerate(installs):
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                left = len(installs) - index
+                break
+        tree_status, result = dedupe_tree(path, dest_host, time_limit=remaining, nice=10, force=force, agent=agent)
+        status = status or tree_status
+        if result is None:
+            continue
+        if not result['skipped']:
+            totals['installs'] += 1
+        for key in ('linked', 'stored', 'bytes_saved'):
+            totals[key] += result[key]
+        if not result['complete']:
+            left = len(installs) - index
+            break
+
+    logger.info("Deduplicated %d installs on %s: %d files linked to the store, %d added to it, %s saved"
+                % (totals['installs'], dest_host, totals['linked'], totals['stored'],
+                   format_bytes(totals['bytes_saved'])))
+    if left:
+        logger.info("Time limit reached; %d installs on %s are left for the next run" % (left, dest_host))
+
+    if prune and not left:
+        try:
+            blobs, size = agent.call('dedupe_prune', store=lib.tool_defs.dedupe_store)
+        except AgentError as e:
+            logger.error("Could not prune the store on %s: %s" % (dest_host, e))
+            return 1
+        logger.info("Removed %d unused store entries (%s) on %s" % (blobs, format_bytes(size), dest_host))
+    return status
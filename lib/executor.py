@@ -14,6 +14,8 @@ import json
 import socket
 import logging
 
+from lib.probe_cache import current_host
+
 logger = logging.getLogger('cadinstall')
 
 # Global execution mode
@@ -200,10 +202,31 @@ def get_sudo_path():
         return None
     return _sudo_path
 
-def send_command_to_listener(command):
+ALLOWED_COMMANDS_FILE = os.path.realpath(os.path.dirname(os.path.realpath(__file__)) + '/../etc/allowed_commands')
+
+_allowed_commands = None
+_allowed_commands_mtime = None
+
+def get_allowed_commands():
+    """
+    Return the commands from etc/allowed_commands, in file order.
+    The file is parsed once per process and only re-read when its mtime changes.
+    """
+    global _allowed_commands, _allowed_commands_mtime
+
+    mtime = os.stat(ALLOWED_COMMANDS_FILE).st_mtime
+    if _allowed_commands is None or mtime != _allowed_commands_mtime:
+        with open(ALLOWED_COMMANDS_FILE, 'r') as f:
+            _allowed_commands = tuple(line.strip() for line in f if line.strip())
+        _allowed_commands_mtime = mtime
+        logger.debug("Loaded %d allowed commands from %s" % (len(_allowed_commands), ALLOWED_COMMANDS_FILE))
+    return _allowed_commands
+
+def send_command_to_listener(command, on_stdout=None):
     """
     Send a command to the listener and receive results in real-time.
-    Returns (exit_code, stdout_lines)
+    Each stdout line is passed to on_stdout as it arrives, if given, instead
+    of being logged. Returns (exit_code, stdout_lines)
     """
     if _execution_mode != 'listener':
         logger.error("Cannot send command to listener - not in listener mode")
@@ -214,8 +237,7 @@ def send_command_to_listener(command):
     
     try:
         # Get the current hostname to pass to listener (so it can SSH back to us)
-        import socket as socket_module
-        current_hostname = socket_module.getfqdn()
+        current_hostname = current_host()
         
         # Connect to listener
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -253,7 +275,10 @@ def send_command_to_listener(command):
                     data = response.get('data')
                     
                     if response_type == 'stdout':
-                        logger.info(data)
+                        if on_stdout is not None:
+                            on_stdout(data)
+                        else:
+                            logger.info(data)
                         stdout_lines.append(data)
                     elif response_type == 'stderr':
                         logger.error(data)
@@ -285,3 +310,69 @@ def send_command_to_listener(command):
         logger.error("Error communicating with listener: %s" % str(e))
         return 1, []
 
+
+async def send_command_to_listener_async(command, log_stdout=True, log_stderr=True, on_stdout=None):
+    """
+    Asyncio version of send_command_to_listener().
+    Returns (exit_code, stdout_lines). Cancelling the task closes the connection.
+    """
+    import asyncio
+
+    if _execution_mode != 'listener':
+        logger.error("Cannot send command to listener - not in listener mode")
+        return 1, []
+
+    host = _listener_config.get('host', 'localhost')
+    port = _listener_config.get('port', 9876)
+
+    stdout_lines = []
+    writer = None
+    try:
+        # Connect to listener; the hostname lets it SSH back to us
+        reader, writer = await asyncio.open_connection(host, port, limit=1024 * 1024)
+        request = {
+            'command': command,
+            'hostname': current_host()
+        }
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await writer.drain()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                return 0, stdout_lines
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                response = json.loads(line.decode('utf-8'))
+            except json.JSONDecodeError as e:
+                logger.error("Failed to parse listener response: %s" % str(e))
+                continue
+
+            response_type = response.get('type')
+            data = response.get('data')
+            if response_type == 'stdout':
+                if on_stdout is not None:
+                    on_stdout(data)
+                elif log_stdout:
+                    logger.info(data)
+                stdout_lines.append(data)
+            elif response_type == 'stderr':
+                if log_stderr:
+                    logger.error(data)
+            elif response_type == 'exit_code':
+                if data != 0:
+                    logger.info("Return code: %d" % data)
+                return data, stdout_lines
+            elif response_type == 'error':
+                logger.error("Listener error: %s" % data)
+                return 1, []
+
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+        logger.error("Error communicating with listener: %s" % str(e))
+        return 1, []
+    finally:
+        if writer is not None:
+            writer.close()
@@ -3,6 +3,16 @@
 
 from lib.utils import *
 from lib.tool_defs import *
+from lib.remote_agent import get_agent, AgentError
+from lib.probe_cache import current_host, invalidate_probes
+from lib.verify import verify_install
+from lib.dedupe import dedupe_tree
+from lib.manifest import get_manifest
+from lib.transfer_profiles import transfer_rsync_options
+from lib.progress import TransferProgress, progress_rsync_options, transfer_summary
+from lib.replication import ORIGIN
+from lib.transfer import (sharded_transfer, use_sharded_transfer, tar_stream_transfer, use_tar_stream,
+                          destination_is_empty, link_dest_options, parse_rsync_stats, log_link_savings)
 import lib.my_globals
 import getpass
 import socket
@@ -23,6 +33,9 @@ logger = logging.getLogger('cadinstall')
 # makes them unambiguous and the trailing name (e.g. EDT) is for readability.
 METADATA_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f %z (%Z)"
 
+# Entries per find command when fixing the permissions of a list of paths
+FIX_PERMISSIONS_PATHS = 500
+
 
 def _format_metadata_time(dt):
     """Format a timezone-aware datetime for the metadata file."""
@@ -75,10 +88,11 @@ def ensure_dest_directory(path, dest_host):
         mkdir_command = "%s -p %s" % (mkdir, path)
         chmod_command = "/usr/bin/chmod %s %s" % (mode, path)
     else:
-        mkdir_command = "/usr/bin/ssh %s %s -p %s" % (dest_host, mkdir, path)
-        chmod_command = "/usr/bin/ssh %s /usr/bin/chmod %s %s" % (dest_host, mode, path)
+        mkdir_command = "%s %s -p %s" % (ssh_prefix(dest_host), mkdir, path)
+        chmod_command = "%s /usr/bin/chmod %s %s" % (ssh_prefix(dest_host), mode, path)
 
     mkdir_status = run_command(mkdir_command)
+    invalidate_probes(dest_host, path)
     if mkdir_status != 0:
         logger.error("Failed to create directory: %s" % path)
         sys.exit(1)
@@ -91,39 +105,120 @@ def ensure_dest_directory(path, dest_host):
         )
 
 
-def apply_install_permissions(dest, dest_host, group):
+def fix_permissions_command(dest, group, paths=None):
+    """
+    One find over dest that applies the install policy only where it is not
+    already met, printing each entry it changes: directories dest_mode,
+    files a=rX,u+w (755 with any execute bit, else 644) and everything
+    cadtools:<group>. With paths (relative to dest) only those entries are
+    checked.
+    """
+    mode = dest_mode_octal()
+    owner_group = shell_owner_group(cadtools_user, group)
+    if paths is not None:
+        dest = ' '.join(shlex.quote(os.path.join(dest, rel)) for rel in paths) + ' -maxdepth 0'
+    return (
+        "/usr/bin/find %s "
+        "\\( \\( ! -user %s -o ! -group %s \\) -printf '%%p\\n' -exec /usr/bin/chown -h %s {} + \\) , "
+        "\\( -type d ! -perm %s -printf '%%p\\n' -exec /usr/bin/chmod %s {} + "
+        "-o -type f -perm /111 ! -perm 755 -printf '%%p\\n' -exec /usr/bin/chmod 755 {} + "
+        "-o -type f ! -perm /111 ! -perm 644 -printf '%%p\\n' -exec /usr/bin/chmod 644 {} + \\)"
+        % (dest, cadtools_user, shlex.quote(group), owner_group, mode, mode)
+    )
+
+
+def apply_install_permissions(dest, dest_host, group, paths=None):
     """
     Force installed tree to dest_mode directories, non-group-writable files,
     and cadtools:<group> ownership. rsync --chmod is the main control;
     this pass covers mkdir-created dirs and any bits rsync left behind.
+
+    It is one walk of the tree on the write host that only touches entries
+    that differ from the policy, which after rsync is usually none. With
+    paths (relative to dest, e.g. the entries an update copied) only those
+    entries are checked.
     """
-    mode = dest_mode_octal()
-    owner_group = shell_owner_group(cadtools_user, group)
-    if check_same_host(dest_host) == 0:
-        chmod_files = "/usr/bin/chmod -R a=rX,u+w %s" % dest
-        chmod_dirs = "/usr/bin/find %s -type d -exec /usr/bin/chmod %s {} +" % (dest, mode)
-        chown_cmd = "/usr/bin/chown -R %s %s" % (owner_group, dest)
+    agent = get_agent(dest_host)
+    if agent is not None and not lib.my_globals.get_pretend():
+        try:
+            result = agent.call('fixperms', path=dest, owner=cadtools_user, group=group, dir_mode=dest_mode,
+                                paths=paths)
+            invalidate_probes(dest_host, dest)
+            for error in result['errors']:
+                logger.warning("Could not apply install permissions: %s" % error)
+            if result['failed'] > len(result['errors']):
+                logger.warning("... and %d more entries" % (result['failed'] - len(result['errors'])))
+            logger.info("Install permissions: changed %d of %d entries in %s on %s"
+                        % (result['changed'], result['checked'], dest, dest_host))
+            return
+        except AgentError as e:
+            logger.debug("Remote helper failed, using find: %s" % e)
+
+    if paths is None:
+        commands = [fix_permissions_command(dest, group)]
     else:
-        chmod_files = "/usr/bin/ssh %s /usr/bin/chmod -R a=rX,u+w %s" % (dest_host, dest)
-        chmod_dirs = "/usr/bin/ssh %s /usr/bin/find %s -type d -exec /usr/bin/chmod %s {} +" % (
-            dest_host, dest, mode)
-        # Quote the remote command so a group with spaces survives ssh's
-        # remote-shell parsing after the local shell strips one quote layer.
-        remote_chown = "/usr/bin/chown -R %s %s" % (owner_group, dest)
-        chown_cmd = "/usr/bin/ssh %s %s" % (dest_host, shlex.quote(remote_chown))
-
-    for command in (chmod_files, chmod_dirs, chown_cmd):
-        status = run_command(command)
+        commands = [fix_permissions_command(dest, group, paths[start:start + FIX_PERMISSIONS_PATHS])
+                    for start in range(0, len(paths), FIX_PERMISSIONS_PATHS)]
+    changed = set()
+    for command in commands:
+        if check_same_host(dest_host) != 0:
+            # Quote the remote command so a group with spaces survives ssh's
+            # remote-shell parsing after the local shell strips one quote layer.
+            command = "%s %s" % (ssh_prefix(dest_host), shlex.quote(command))
+
+        status, output = run_command_with_output(command, log_stdout=False)
         if status != 0:
             logger.warning("Could not fully apply install permissions with: %s" % command)
+        changed.update(line for line in output.splitlines() if line)
+    invalidate_probes(dest_host, dest)
+    logger.info("Install permissions: changed %d entries in %s on %s" % (len(changed), dest, dest_host))
 
 
-def install_tool(vendor, tool, version, src, group, dest_host, dest):
+def find_previous_version(dest, dest_host):
+    """
+    Return the most recently completed install next to dest on dest_host
+    (another version of the same vendor/tool), or None.
+
+    Only version directories whose .cadinstall.metadata records a
+    completed install count; symlinks such as "latest" are skipped.
+    """
+    tool_dir = os.path.dirname(dest.rstrip('/'))
+    command = ("/usr/bin/find %s -mindepth 2 -maxdepth 2 -name .cadinstall.metadata "
+               "-exec /bin/grep -q '^Install completed on' {} \\; -printf '%%T@ %%h\\n'"
+               % shlex.quote(tool_dir))
+    if check_same_host(dest_host) != 0:
+        command = "%s %s" % (ssh_prefix(dest_host), shlex.quote(command))
+    status, output = run_command_with_output(command, log_stderr=False, log_stdout=False, force_run=True)
+
+    candidates = []
+    for line in output.splitlines():
+        completed, _, path = line.partition(' ')
+        try:
+            completed = float(completed)
+        except ValueError:
+            continue
+        if path.rstrip('/') != dest.rstrip('/'):
+            candidates.append((completed, path))
+    if not candidates:
+        return None
+    return max(candidates)[1]
+
+
+def install_tool(vendor, tool, version, src, group, dest_host, dest, src_host=None, link_previous=False,
+                 journal=None):
     """
     Install a tool to the specified destination.
     
     Args:
         dest_host: The host with write access to /tools_vendor (from siteHash)
+        src_host:  When set, src is an already-installed copy on this host (a
+                   site seeding another site) and rsync runs there instead of
+                   on the host running cadinstall.
+        link_previous: Hard link files that are unchanged since the previous
+                   install of the tool on dest_host instead of copying them.
+        journal:   The site's install journal (lib/journal.py). A sharded copy
+                   records its progress there and skips what an earlier run
+                   already copied.
 
     Note:
         The caller (install subcommand) validates that the destination does not
@@ -132,6 +227,18 @@ def install_tool(vendor, tool, version, src, group, dest_host, dest):
         deletion metadata is in place before anything is copied in, so this
         function intentionally does not re-run check_dest here.
     """
+    link_dest = None
+    if link_previous:
+        link_dest = find_previous_version(dest, dest_host)
+        if link_dest:
+            logger.info("Linking unchanged files in %s on %s to %s" % (dest, dest_host, link_dest))
+        else:
+            logger.info("No previous install of %s/%s on %s to link to, copying everything"
+                        % (vendor, tool, dest_host))
+
+    if src_host and check_same_host(src_host) != 0:
+        return seed_tool(vendor, tool, version, src, group, src_host, dest_host, dest, link_dest=link_dest)
+
     check_src(src)
 
     logger.info("Copying %s/%s/%s to %s ..." % (vendor,tool,version,dest_host))
@@ -140,26 +247,52 @@ def install_tool(vendor, tool, version, src, group, dest_host, dest):
     # leave the version directory group-writable (775).
     ensure_dest_directory(dest, dest_host)
 
-    # Use local rsync if same host, SSH rsync if different host
-    # Since /tools_vendor is only writable on specific hosts (siteHash), we must check the actual host
     # --chown sets owner and group. Do not also pass --groupmap: rsync 3.1.3
     # rejects that combination ("--groupmap conflicts with prior --chown").
     # Quote user:group so --group values like "domain users" stay one argument.
     owner_group = shell_owner_group(cadtools_user, group)
+
+    # New installs of small-file trees and large trees have their own
+    # transfer backends (lib/transfer.py); anything else is one rsync. A tar
+    # stream copies every file, so it is not used when linking.
+    manifest = get_manifest(src)
+    progress = TransferProgress(dest, dest_host, manifest.totals.apparent_bytes,
+                                manifest.totals.files + manifest.totals.symlinks + manifest.totals.others)
+    status = None
+    if not link_dest and use_tar_stream(manifest) and destination_is_empty(dest, dest_host):
+        status = tar_stream_transfer(manifest, src, dest, dest_host, progress=progress)
+    elif use_sharded_transfer(manifest):
+        status = sharded_transfer(manifest, src, dest, dest_host, owner_group, link_dest=link_dest,
+                                  journal=journal, progress=progress)
+    if status is not None:
+        if status != 0:
+            logger.error("Something failed during the installation. Exiting ...")
+            sys.exit(1)
+        progress.finish()
+        apply_install_permissions(dest, dest_host, group)
+        return(status)
+
+    # Use local rsync if same host, SSH rsync if different host
+    # Since /tools_vendor is only writable on specific hosts (siteHash), we must check the actual host
     if check_same_host(dest_host) == 0:
         command = (
-            "%s %s --chown=%s %s/ %s/"
-            % (rsync, rsync_options, owner_group, src, dest)
+            "%s %s %s %s %s --chown=%s %s/ %s/"
+            % (rsync, rsync_options, transfer_rsync_options(dest_host, remote=False), link_dest_options(link_dest),
+               progress_rsync_options(), owner_group, src, dest)
         )
     else:
-        # Different host - use SSH rsync. chmod the dest dir that mkdir creates
-        # so it is 2755 rather than umask 775.
+        # Different host - use SSH rsync with the site's transfer profile. chmod
+        # the dest dir that mkdir creates so it is 2755 rather than umask 775.
         command = (
-            "%s %s --chown=%s "
+            "%s %s %s %s %s %s --chown=%s "
             "--rsync-path=\'%s -p %s && /usr/bin/chmod %s %s && %s\' %s/ %s:%s/"
             % (
                 rsync,
                 rsync_options,
+                transfer_rsync_options(dest_host),
+                link_dest_options(link_dest),
+                progress_rsync_options(),
+                rsync_rsh_option(dest_host),
                 owner_group,
                 mkdir,
                 dest,
@@ -172,32 +305,99 @@ def install_tool(vendor, tool, version, src, group, dest_host, dest):
             )
         )
     
-    status = run_command(command)
+    status = run_rsync(command, link_dest, dest_host, progress)
 
     if status != 0:
         logger.error("Something failed during the installation. Exiting ...")
         sys.exit(1)
+    progress.finish()
+
+    apply_install_permissions(dest, dest_host, group)
+
+    return(status)
+
+def run_rsync(command, link_dest, dest_host, progress=None):
+    """
+    Run an rsync command; when it links to link_dest, log what that saved.
+    With progress (a TransferProgress) its output is read as progress
+    instead of being logged line by line.
+    """
+    on_stdout = progress.rsync_output('rsync') if progress is not None else None
+    if not link_dest:
+        return run_command(command, on_stdout=on_stdout)
+    status, output = run_command_with_output(command, on_stdout=on_stdout)
+    if status == 0:
+        log_link_savings(parse_rsync_stats(output), link_dest, dest_host)
+    return status
+
+def seed_tool(vendor, tool, version, src, group, src_host, dest_host, dest, link_dest=None):
+    """
+    Copy an installed tree from one site's write host to another's.
+
+    rsync runs on src_host, next to the installed copy, and pushes to
+    dest_host. The installed tree was already filtered by the exclude list,
+    and the source site's .cadinstall.metadata is left behind so each site
+    keeps its own.
+    """
+    logger.info("Seeding %s/%s/%s from %s to %s ..." % (vendor, tool, version, src_host, dest_host))
+
+    if src_host.lower() == dest_host.lower() and src == dest:
+        logger.info("%s is already in place on %s" % (dest, dest_host))
+        return 0
+
+    owner_group = shell_owner_group(cadtools_user, group)
+    # --link-dest is resolved on the receiving side, so link_dest is a path
+    # on dest_host
+    link_options = link_dest_options(link_dest)
+    # rsync runs on src_host, so its version there decides the progress output
+    link_options += " " + progress_rsync_options(src_host)
+    if src_host.lower() == dest_host.lower():
+        remote_rsync = (
+            "%s -av --chmod=%s --chown=%s --exclude=/.cadinstall.metadata %s %s/ %s/"
+            % (rsync, rsync_chmod, owner_group, link_options, src, dest)
+        )
+    else:
+        remote_rsync = (
+            "%s -av --chmod=%s --chown=%s --exclude=/.cadinstall.metadata %s "
+            "--rsync-path=\'%s -p %s && /usr/bin/chmod %s %s && %s\' %s/ %s:%s/"
+            % (rsync, rsync_chmod, owner_group, link_options, mkdir, dest, dest_mode_octal(), dest,
+               rsync, src, dest_host, dest)
+        )
+    command = "%s %s" % (ssh_prefix(src_host), shlex.quote(remote_rsync))
+
+    # The installed copy on src_host has no manifest here, so percent and
+    # ETA come from rsync itself
+    progress = TransferProgress(dest, dest_host)
+    status = run_rsync(command, link_dest, dest_host, progress)
+
+    if status != 0:
+        logger.error("Something failed while seeding %s from %s. Exiting ..." % (dest_host, src_host))
+        sys.exit(1)
+    progress.finish()
 
     apply_install_permissions(dest, dest_host, group)
 
     return(status)
 
-def _build_metadata_lines(user, started_on, completed_on=None):
+def _build_metadata_lines(user, started_on, completed_on=None, transfer=None):
     """
     Build the list of text lines that make up a .cadinstall.metadata file.
 
     "Install started on" is recorded at the very beginning of an installation so
     that even an interrupted install (network drop, ctrl-c, etc.) leaves behind a
     metadata file the delete subcommand can act on. "Install completed on" is only
-    added once the installation has finished successfully.
+    added once the installation has finished successfully, along with the
+    throughput summary of the copy (transfer) when there is one.
     """
     lines = []
     lines.append("Installed by: %s\n" % user)
     lines.append("Install started on: %s\n" % _format_metadata_time(started_on))
     if completed_on is not None:
         lines.append("Install completed on: %s\n" % _format_metadata_time(completed_on))
+    if transfer:
+        lines.append("Transfer: %s\n" % transfer)
     ## get fully qualified hostname
-    lines.append("Installed from: %s\n" % socket.getfqdn())
+    lines.append("Installed from: %s\n" % current_host())
     ## get the logfile location
     log_file = lib.my_globals.get_log_file()
     if log_file:
@@ -209,7 +409,7 @@ def _build_metadata_lines(user, started_on, completed_on=None):
     return lines
 
 
-def write_metadata(dest, dest_host, started_on, completed_on=None):
+def write_metadata(dest, dest_host, started_on, completed_on=None, transfer=None):
     """
     Write installation metadata to the destination directory.
 
@@ -228,44 +428,94 @@ def write_metadata(dest, dest_host, started_on, completed_on=None):
                       preserved across the initial and completion writes.
         completed_on: The datetime the install completed, or None for the
                       initial write.
+        transfer:     Throughput summary of the copy (lib/progress.py), written
+                      with the completion time.
     """
+    user = getpass.getuser()
+    phase = "completion" if completed_on is not None else "initial"
+
+    # Make sure the destination directory exists. On the initial write nothing
+    # has been copied in yet, so the directory will not exist. rsync of a single
+    # file will not create the parent directory for us.
+    ensure_dest_directory(dest, dest_host)
+
+    status, dest_metadata = _copy_metadata_file(_build_metadata_lines(user, started_on, completed_on, transfer),
+                                                dest, dest_host)
+    if status == 0:
+        logger.info("Wrote %s metadata file: %s on %s" % (phase, dest_metadata, dest_host))
+    else:
+        logger.warning("Failed to write %s metadata file: %s on %s" % (phase, dest_metadata, dest_host))
+
+
+def _copy_metadata_file(lines, dest, dest_host):
+    """Write lines to dest/.cadinstall.metadata on dest_host. Returns (status, metadata path)."""
     pid = os.getpid()
     user = getpass.getuser()
     metadata = ".cadinstall.metadata"
-    tmp_metadata = "/tmp/%s.%s.%d" % (metadata, user, pid)
+    # Sites install concurrently, so the temp file is per destination host.
+    tmp_metadata = "/tmp/%s.%s.%d.%s" % (metadata, user, pid, dest_host)
     dest_metadata = dest + "/" + metadata
 
-    phase = "completion" if completed_on is not None else "initial"
-
     # Always create the temp file locally
     f = open(tmp_metadata, 'w')
-    for line in _build_metadata_lines(user, started_on, completed_on):
+    for line in lines:
         f.write(line)
     f.close()
 
     os.system("/usr/bin/chmod 755 %s" % (tmp_metadata))
 
-    # Make sure the destination directory exists. On the initial write nothing
-    # has been copied in yet, so the directory will not exist. rsync of a single
-    # file will not create the parent directory for us.
-    ensure_dest_directory(dest, dest_host)
-
     # Copy to destination - use local rsync if same host, SSH rsync if different host
     if check_same_host(dest_host) == 0:
         # Same host - use local rsync
         command = "/usr/bin/rsync -avp %s %s" % (tmp_metadata, dest_metadata)
     else:
         # Different host - use SSH rsync
-        command = "/usr/bin/rsync -avp %s %s:%s" % (tmp_metadata, dest_host, dest_metadata)
+        command = "/usr/bin/rsync -avp %s %s %s:%s" % (rsync_rsh_option(), tmp_metadata, dest_host, dest_metadata)
     
     status = run_command(command)
 
     os.remove(tmp_metadata)
-    
+    return status, dest_metadata
+
+
+def read_metadata(dest, dest_host):
+    """The contents of dest/.cadinstall.metadata on dest_host, or None if it cannot be read."""
+    metadata_file = dest + "/.cadinstall.metadata"
+    if check_same_host(dest_host) == 0:
+        cat_command = "/bin/cat %s" % metadata_file
+    else:
+        cat_command = "%s /bin/cat %s" % (ssh_prefix(dest_host), metadata_file)
+    status, output = run_command_with_output(cat_command, force_run=True, log_stdout=False)
+    if status != 0 or not output.strip():
+        return None
+    return output
+
+
+def append_update_record(dest, dest_host, metadata, src, updated_on, summary):
+    """
+    Add a record of an in-place update (lib/update.py) to the end of the
+    metadata file, whose current contents are metadata. The install's own
+    lines are kept, so the delete subcommand still reads the original
+    installing user and install time.
+    """
+    lines = [line + "\n" for line in metadata.rstrip("\n").splitlines()]
+    lines.append("Updated by: %s\n" % getpass.getuser())
+    lines.append("Updated on: %s\n" % _format_metadata_time(updated_on))
+    lines.append("Updated from: %s:%s\n" % (current_host(), src))
+    lines.append("Update: %s\n" % summary)
+    log_file = lib.my_globals.get_log_file()
+    if log_file:
+        lines.append("Update logfile: %s\n" % log_file)
+    full_command = lib.my_globals.get_full_command()
+    if full_command:
+        lines.append("Update command: %s\n" % full_command)
+
+    status, dest_metadata = _copy_metadata_file(lines, dest, dest_host)
     if status == 0:
-        logger.info("Wrote %s metadata file: %s on %s" % (phase, dest_metadata, dest_host))
+        logger.info("Recorded the update in %s on %s" % (dest_metadata, dest_host))
     else:
-        logger.warning("Failed to write %s metadata file: %s on %s" % (phase, dest_metadata, dest_host))
+        logger.warning("Failed to record the update in %s on %s" % (dest_metadata, dest_host))
+    return status
 
 def delete_tool(vendor, tool, version, dest_host, dest):
     """
@@ -324,7 +574,7 @@ def delete_tool(vendor, tool, version, dest_host, dest):
         if is_local:
             test_command = "/bin/test -d %s" % dest
         else:
-            test_command = "/usr/bin/ssh %s /bin/test -d %s" % (dest_host, dest)
+            test_command = "%s /bin/test -d %s" % (ssh_prefix(dest_host), dest)
 
         test_status = run_command(test_command)
         if test_status != 0:
@@ -343,7 +593,7 @@ def delete_tool(vendor, tool, version, dest_host, dest):
         if is_local:
             cat_command = "/bin/cat %s" % metadata_file
         else:
-            cat_command = "/usr/bin/ssh %s /bin/cat %s" % (dest_host, metadata_file)
+            cat_command = "%s /bin/cat %s" % (ssh_prefix(dest_host), metadata_file)
 
         status, output = run_command_with_output(cat_command, force_run=False)
         if status != 0 or not output.strip():
@@ -358,7 +608,7 @@ def delete_tool(vendor, tool, version, dest_host, dest):
         if is_local:
             cat_command = "/bin/cat %s" % metadata_file
         else:
-            cat_command = "/usr/bin/ssh %s /bin/cat %s" % (dest_host, metadata_file)
+            cat_command = "%s /bin/cat %s" % (ssh_prefix(dest_host), metadata_file)
 
         status, output = run_command_with_output(cat_command, force_run=True)
         if status != 0 or not output.strip():
@@ -492,9 +742,10 @@ def delete_tool(vendor, tool, version, dest_host, dest):
     if is_local:
         rm_command = "/usr/bin/rm -rf %s" % dest
     else:
-        rm_command = "/usr/bin/ssh %s /usr/bin/rm -rf %s" % (dest_host, dest)
+        rm_command = "%s /usr/bin/rm -rf %s" % (ssh_prefix(dest_host), dest)
 
     status = run_command(rm_command)
+    invalidate_probes(dest_host, dest)
 
     if status != 0:
         logger.error("Something failed during the deletion. Exiting ...")
@@ -519,12 +770,25 @@ def create_link(dest, vendor, tool, version, link, dest_host):
         command = "/usr/bin/ln -sfT ./%s %s/%s/%s/%s" % (version,dest,vendor,tool,link)
     else:
         # Different host - use SSH
-        command = "/usr/bin/ssh %s /usr/bin/ln -sfT ./%s %s/%s/%s/%s" % (dest_host, version,dest,vendor,tool,link)
+        command = "%s /usr/bin/ln -sfT ./%s %s/%s/%s/%s" % (ssh_prefix(dest_host), version,dest,vendor,tool,link)
     
     status = run_command(command)
+    invalidate_probes(dest_host, "%s/%s/%s/%s" % (dest, vendor, tool, link))
 
     return(status)
 
+def find_existing_parent(path, dest_host):
+    """
+    Return (existing_path, writable) for the deepest existing directory at
+    or above path on dest_host; existing_path is None if only / exists.
+    Shares the cached resolve_existing_ancestor() round trip with the disk
+    space check.
+    """
+    resolved = resolve_existing_ancestor(path, dest_host)
+    if resolved['path'] in (None, '/'):
+        return None, False
+    return resolved['path'], resolved['writable']
+
 def check_install_permissions(dest, dest_host):
     """
     Check if we have write permissions to create the tool installation directory.
@@ -540,34 +804,15 @@ def check_install_permissions(dest, dest_host):
     """
     logger.info("Checking install directory permissions for %s on %s ..." % (dest, dest_host))
 
-    path_to_check = dest
-    while path_to_check != "/" and path_to_check != "":
-        if check_same_host(dest_host) == 0:
-            exists_command = "/bin/test -d %s" % path_to_check
-        else:
-            exists_command = "/usr/bin/ssh %s /bin/test -d %s" % (dest_host, path_to_check)
-
-        exists_status, _ = run_command_with_output(exists_command, force_run=True)
-
-        if exists_status == 0:
-            if check_same_host(dest_host) == 0:
-                write_command = "/bin/test -w %s" % path_to_check
-            else:
-                write_command = "/usr/bin/ssh %s /bin/test -w %s" % (dest_host, path_to_check)
-
-            write_status, _ = run_command_with_output(write_command, force_run=True)
-
-            if write_status != 0:
-                logger.error("No write permission to create install directory. Cannot write to: %s on %s" % (path_to_check, dest_host))
-                return False
-            else:
-                logger.info("Install directory permissions check passed - can write to: %s on %s" % (path_to_check, dest_host))
-                return True
-
-        path_to_check = os.path.dirname(path_to_check)
-
-    logger.error("Could not find any existing parent directory for install path: %s on %s" % (dest, dest_host))
-    return False
+    existing, writable = find_existing_parent(dest, dest_host)
+    if existing is None:
+        logger.error("Could not find any existing parent directory for install path: %s on %s" % (dest, dest_host))
+        return False
+    if not writable:
+        logger.error("No write permission to create install directory. Cannot write to: %s on %s" % (existing, dest_host))
+        return False
+    logger.info("Install directory permissions check passed - can write to: %s on %s" % (existing, dest_host))
+    return True
 
 def check_module_permissions(vendor, tool, dest_host):
     """
@@ -585,40 +830,40 @@ def check_module_permissions(vendor, tool, dest_host):
     
     # Build the full path that needs to be created
     vendor_tool_path = "%s/%s/%s" % (module_path, vendor, tool)
-    
-    # Find the first existing parent directory by walking up the path
-    path_to_check = vendor_tool_path
-    while path_to_check != "/" and path_to_check != "":
-        # Check if this directory exists
-        if check_same_host(dest_host) == 0:
-            exists_command = "/bin/test -d %s" % path_to_check
-        else:
-            exists_command = "/usr/bin/ssh %s /bin/test -d %s" % (dest_host, path_to_check)
-        
-        exists_status, _ = run_command_with_output(exists_command, force_run=True)
-        
-        if exists_status == 0:
-            # This directory exists, check if it's writable
-            if check_same_host(dest_host) == 0:
-                write_command = "/bin/test -w %s" % path_to_check
-            else:
-                write_command = "/usr/bin/ssh %s /bin/test -w %s" % (dest_host, path_to_check)
-            
-            write_status, _ = run_command_with_output(write_command, force_run=True)
-            
-            if write_status != 0:
-                logger.error("No write permission to create module directory structure. Cannot write to: %s on %s" % (path_to_check, dest_host))
-                return False
-            else:
-                logger.info("Module directory permissions check passed - can write to: %s" % path_to_check)
-                return True
-        
-        # Move up one directory level
-        path_to_check = os.path.dirname(path_to_check)
-    
-    # If we got here, we couldn't find any existing parent directory
-    logger.error("Could not find any existing parent directory for module path: %s on %s" % (vendor_tool_path, dest_host))
-    return False
+
+    # Find the first existing parent directory of the path
+    existing, writable = find_existing_parent(vendor_tool_path, dest_host)
+    if existing is None:
+        logger.error("Could not find any existing parent directory for module path: %s on %s" % (vendor_tool_path, dest_host))
+        return False
+    if not writable:
+        logger.error("No write permission to create module directory structure. Cannot write to: %s on %s" % (existing, dest_host))
+        return False
+    logger.info("Module directory permissions check passed - can write to: %s" % existing)
+    return True
+
+def _install_module_files_with_agent(agent, module_dir, module_file):
+    """install_module_files() through the remote helper: no ssh per step."""
+    if lib.my_globals.get_pretend():
+        logger.debug("Because the '-p' switch was thrown, not creating %s -> commonModuleFile on %s" % (module_file, agent.host))
+        return 0
+
+    agent.call('mkdir', path=module_dir, mode=0o755, parents=True)
+    invalidate_probes(agent.host, module_dir)
+
+    existing = agent.call('stat', path=module_file)
+    agent.call('symlink', target='commonModuleFile', path=module_file, replace=True)
+    if existing is not None:
+        logger.info("Replaced existing module file: %s" % module_file)
+
+    # Verify the symlink was actually created
+    created = agent.call('stat', path=module_file)
+    if created is None or created['type'] != 'link':
+        logger.error("Module symlink creation failed - symlink does not exist: %s" % module_file)
+        return 1
+
+    logger.info("Created module symlink: %s -> commonModuleFile" % module_file)
+    return 0
 
 def install_module_files(vendor, tool, version, dest_host):
     """
@@ -636,63 +881,201 @@ def install_module_files(vendor, tool, version, dest_host):
     
     # Determine if we're working locally or remotely (must check actual host, not just domain)
     is_local = (check_same_host(dest_host) == 0)
+
+    agent = get_agent(dest_host)
+    if agent is not None:
+        try:
+            return _install_module_files_with_agent(agent, module_dir, module_file)
+        except AgentError as e:
+            logger.debug("Remote helper failed, using individual commands: %s" % e)
     
-    # Create directory structure if it doesn't exist - use setuid binary through run_command
-    if is_local:
-        mkdir_command = "/usr/bin/mkdir -p %s" % module_dir
-    else:
-        mkdir_command = "/usr/bin/ssh %s /usr/bin/mkdir -p %s" % (dest_host, module_dir)
-    
-    mkdir_status = run_command(mkdir_command)
-    if mkdir_status != 0:
+    if lib.my_globals.get_pretend():
+        logger.debug("Because the '-p' switch was thrown, not creating %s -> commonModuleFile on %s" % (module_file, dest_host))
+        return 0
+
+    # Create the directory, replace any existing module file with the symlink
+    # and verify it - in one round trip to the host.
+    results = run_batch(dest_host, [
+        batch_step("/usr/bin/mkdir -p %s" % module_dir),
+        batch_step("/bin/test -f %s" % module_file, ignore_failure=True),
+        batch_step("/usr/bin/rm -f %s" % module_file),
+        batch_step("/usr/bin/ln -sf commonModuleFile %s" % module_file),
+        batch_step("/bin/test -L %s" % module_file),
+    ])
+    invalidate_probes(dest_host, module_dir)
+    mkdir_result, exists_result, rm_result, ln_result, verify_result = results
+
+    if mkdir_result['status'] != 0:
         logger.error("Failed to create module directory: %s" % module_dir)
-        return mkdir_status
-    
-    # Check if existing symlink exists before trying to remove it
-    if not lib.my_globals.get_pretend():
-        if is_local:
-            test_command = "/bin/test -f %s" % module_file
-        else:
-            test_command = "/usr/bin/ssh %s /bin/test -f %s" % (dest_host, module_file)
-        
-        test_status = run_command(test_command)
-        if test_status == 0:
-            # File exists, remove it - use setuid binary through run_command  
-            if is_local:
-                rm_command = "/usr/bin/rm -f %s" % module_file
-            else:
-                rm_command = "/usr/bin/ssh %s /usr/bin/rm -f %s" % (dest_host, module_file)
-            
-            rm_status = run_command(rm_command)
-            if rm_status != 0:
-                logger.warning("Failed to remove existing module file: %s" % module_file)
-            else:
-                logger.info("Removed existing module file: %s" % module_file)
-    
-    # Create symlink to commonModuleFile - use setuid binary through run_command
-    if is_local:
-        ln_command = "/usr/bin/ln -sf commonModuleFile %s" % module_file
-    else:
-        ln_command = "/usr/bin/ssh %s /usr/bin/ln -sf commonModuleFile %s" % (dest_host, module_file)
-    
-    ln_status = run_command(ln_command)
-    if ln_status != 0:
+        return mkdir_result['status'] if mkdir_result['status'] is not None else 1
+
+    if rm_result['status'] != 0:
+        logger.warning("Failed to remove existing module file: %s" % module_file)
+    elif exists_result['status'] == 0:
+        logger.info("Removed existing module file: %s" % module_file)
+
+    if ln_result['status'] != 0:
         logger.error("Failed to create module symlink: %s" % module_file)
-        return ln_status
-    
-    # Verify the symlink was actually created (skip in pretend mode)
-    if not lib.my_globals.get_pretend():
-        if is_local:
-            verify_command = "/bin/test -L %s" % module_file
-        else:
-            verify_command = "/usr/bin/ssh %s /bin/test -L %s" % (dest_host, module_file)
-        
-        verify_status = run_command(verify_command)
-        if verify_status != 0:
-            logger.error("Module symlink creation failed - symlink does not exist: %s" % module_file)
-            return verify_status
-        
-        logger.info("Created module symlink: %s -> commonModuleFile" % module_file)
-    
+        return ln_result['status'] if ln_result['status'] is not None else 1
+
+    if verify_result['status'] != 0:
+        logger.error("Module symlink creation failed - symlink does not exist: %s" % module_file)
+        return verify_result['status'] if verify_result['status'] is not None else 1
+
+    logger.info("Created module symlink: %s -> commonModuleFile" % module_file)
     return 0
 
+
+
+def add_site_install_stages(scheduler, site, dest_host, vendor, tool, version, src, group,
+                            final_dest, link=None, skip_modules=False, deps=(),
+                            src_host=None, copy_deps=(), copy_after=(), verify_src=None, link_previous=False,
+                            dedupe=False, journal=None):
+    """
+    Add the install stages for one site to a StageScheduler.
+
+    The stages form a small graph:
+
+        metadata (started) -> copy -> link             -> metadata (completed)
+                                   -> modules          /
+                                   -> verify -> dedupe /
+
+    Symlink and module file creation only need the copied tree, so they can
+    run at the same time. ``deps`` lets the caller order this site after
+    stages from another site (e.g. two sites served by the same host).
+    When the site is seeded from another site, ``src`` is that site's
+    installed copy, ``src_host`` its write host and ``copy_deps`` holds its
+    copy stage. The copy also waits for the stages in ``copy_after``, done
+    or not (see add_replication_stages()). With ``verify_src`` set, a verify stage compares the
+    installed tree with it (the original source, even for a seeded site).
+    ``link_previous`` links unchanged files to the previous install of the
+    tool on the site (see install_tool()). With ``dedupe`` a dedupe stage
+    links the installed files to the site's content-addressed store, after
+    the verify stage if there is one.
+
+    With a ``journal`` (lib/journal.py) every stage that finishes is
+    recorded, and stages an earlier run finished are skipped; the copy
+    stage resumes from the journal too.
+
+    Returns the list of stages added, first to last.
+    """
+    started = {'on': journal.started_on if journal else None}
+
+    def add_stage(name, func, *args, deps=(), after=()):
+        if journal is None:
+            return scheduler.add_stage(site, name, func, *args, deps=deps, after=after)
+
+        def run():
+            if journal.stage_done(name):
+                logger.info("Skipping stage '%s' on %s: finished by the previous run" % (name, site))
+                return 0
+            status = func(*args)
+            if not status:
+                journal.mark_stage(name)
+            return status
+        return scheduler.add_stage(site, name, run, deps=deps, after=after)
+
+    def write_started():
+        # Establish the deletion metadata BEFORE anything is copied in.
+        # If the install is interrupted (network drop, ctrl-c, etc.) the
+        # metadata file still exists so the delete subcommand can act on
+        # it. The completion time is added once the install finishes.
+        started['on'] = datetime.now().astimezone()
+        if journal is not None:
+            journal.set_started_on(started['on'])
+        write_metadata(final_dest, dest_host, started['on'])
+
+    def copy():
+        logger.info("Installing %s to %s ..." % (final_dest, site))
+        return install_tool(vendor, tool, version, src, group, dest_host, final_dest, src_host=src_host,
+                            link_previous=link_previous, journal=journal)
+
+    def modules():
+        status = install_module_files(vendor, tool, version, dest_host)
+        if status != 0:
+            logger.error("Module file installation failed for %s. Use --skip-modules to bypass." % site)
+        return status
+
+    def verify():
+        status = verify_install(verify_src, final_dest, dest_host)
+        if status != 0:
+            logger.error("Verification of %s failed on %s" % (final_dest, site))
+        return status
+
+    def dedupe_files():
+        status, _ = dedupe_tree(final_dest, dest_host)
+        if status != 0:
+            logger.error("Deduplication of %s failed on %s" % (final_dest, site))
+        return status
+
+    def write_completed():
+        # Installation finished for this site - record the completion
+        # time so the deletion policy uses "Install completed on".
+        write_metadata(final_dest, dest_host, started['on'], completed_on=datetime.now().astimezone(),
+                       transfer=transfer_summary(final_dest, dest_host))
+
+    stages = []
+    stages.append(add_stage('metadata', write_started, deps=deps))
+    copy_stage = add_stage('copy', copy, deps=[stages[-1]] + list(copy_deps), after=copy_after)
+    stages.append(copy_stage)
+
+    final_deps = [copy_stage]
+    if link:
+        stages.append(add_stage('link', create_link, dest, vendor, tool, version, link, dest_host,
+                                deps=[copy_stage]))
+        final_deps.append(stages[-1])
+
+    if not skip_modules:
+        stages.append(add_stage('modules', modules, deps=[copy_stage]))
+        final_deps.append(stages[-1])
+    else:
+        logger.info("Skipping module file installation for %s (--skip-modules specified)" % site)
+
+    tree_ready = copy_stage
+    if verify_src:
+        stages.append(add_stage('verify', verify, deps=[copy_stage]))
+        final_deps.append(stages[-1])
+        tree_ready = stages[-1]
+
+    if dedupe:
+        stages.append(add_stage('dedupe', dedupe_files, deps=[tree_ready]))
+        final_deps.append(stages[-1])
+
+    stages.append(add_stage('metadata-complete', write_completed, deps=final_deps))
+    return stages
+
+
+def add_replication_stages(scheduler, plan, site_hosts, vendor, tool, version, src, group, final_dest,
+                           journals=None, **options):
+    """
+    Add the install stages for every site of a plan_replication() plan.
+
+    Sites install concurrently as soon as their seed has its copy. A copy
+    that reuses one of its source's transfer slots also waits for the copy
+    that held the slot before it, so no source serves more than its fanout
+    at a time; a failed earlier copy frees the slot without stopping this
+    site. Sites that share a write host are chained so they never copy
+    into the same directory concurrently.
+
+    ``options`` are passed on to add_site_install_stages(). Returns a dict
+    mapping each site to its list of stages.
+    """
+    last_stage_on_host = {}
+    copy_stage = {}
+    site_stages = {}
+    for site, source, after in plan:
+        dest_host = site_hosts[site]
+        deps = [last_stage_on_host[dest_host]] if dest_host in last_stage_on_host else []
+        if source == ORIGIN:
+            site_src, src_host, copy_deps = src, None, []
+        else:
+            site_src, src_host, copy_deps = final_dest, site_hosts[source], [copy_stage[source]]
+        copy_after = [copy_stage[after]] if after is not None else []
+        stages = add_site_install_stages(
+            scheduler, site, dest_host, vendor, tool, version, site_src, group, final_dest,
+            deps=deps, src_host=src_host, copy_deps=copy_deps, copy_after=copy_after,
+            journal=journals[site] if journals else None, **options)
+        copy_stage[site] = [stage for stage in stages if stage.name == 'copy'][0]
+        last_stage_on_host[dest_host] = stages[-1]
+        site_stages[site] = stages
+    return site_stages
@@ -0,0 +1,165 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Install journals for cadinstall
+
+Every install keeps one journal per site on the host running cadinstall
+(tool_defs.journal_dir): which stages finished, which transfer shards and
+big files were copied, and which byte ranges of a big file already made it
+into its temporary file. The shard plan of a sharded copy is kept next to
+the journal, so a resumed copy uses the same shards. A run that is
+interrupted or fails leaves its journals behind, and install --resume uses
+them to carry on: finished sites and stages are skipped, copied shards and
+ranges are not sent again, and partial files are kept.
+
+Journals are JSON files rewritten atomically after every change. They are
+removed once the install has finished on every site.
+"""
+
+import os
+import glob
+import json
+import logging
+import threading
+from datetime import datetime
+
+import lib.tool_defs
+import lib.my_globals
+
+logger = logging.getLogger('cadinstall')
+
+
+def journal_path(final_dest, site):
+    name = final_dest.strip('/').replace('/', '__')
+    return os.path.join(lib.tool_defs.journal_dir, "%s.%s.json" % (name, site))
+
+
+class InstallJournal:
+    """Progress of one install on one site."""
+
+    def __init__(self, final_dest, site, src, data=None):
+        self.final_dest = final_dest
+        self.site = site
+        self.path = journal_path(final_dest, site)
+        # Shard lists of a sharded copy: <plan_prefix>.<n> and .dirs
+        self.plan_prefix = self.path[:-len('.json')] + '.files'
+        self._lock = threading.Lock()
+        self.data = data or {
+            'dest': final_dest,
+            'site': site,
+            'src': src,
+            'started_on': None,
+            'stages': [],
+            'shards': [],
+            'files': [],
+            'ranges': {},
+            'plan': None,
+        }
+
+    @classmethod
+    def load(cls, final_dest, site):
+        """The journal left by an earlier run, or None."""
+        try:
+            with open(journal_path(final_dest, site)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable install journal %s: %s" % (journal_path(final_dest, site), e))
+            return None
+        return cls(final_dest, site, data.get('src'), data)
+
+    @property
+    def src(self):
+        return self.data['src']
+
+    @property
+    def started_on(self):
+        value = self.data['started_on']
+        return datetime.fromisoformat(value) if value else None
+
+    def _save(self):
+        if lib.my_globals.get_pretend():
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = "%s.%d" % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def set_started_on(self, started_on):
+        with self._lock:
+            self.data['started_on'] = started_on.isoformat()
+            self._save()
+
+    def _mark(self, field, key):
+        with self._lock:
+            if key not in self.data[field]:
+                self.data[field].append(key)
+                self._save()
+
+    def stage_done(self, name):
+        return name in self.data['stages']
+
+    def mark_stage(self, name):
+        self._mark('stages', name)
+
+    def complete(self):
+        return self.stage_done('metadata-complete')
+
+    def saved_plan(self, signature):
+        """The shard plan saved for a manifest with this signature, or None."""
+        plan = self.data.get('plan')
+        if plan and plan['signature'] == signature:
+            return plan
+        return None
+
+    def save_plan(self, signature, shards, ranged):
+        """Keep a new shard plan ([index, files, bytes] per shard, big file paths). Forgets copied shards."""
+        with self._lock:
+            self.data['plan'] = {'signature': signature, 'shards': shards, 'ranged': ranged}
+            self.data['shards'] = []
+            self._save()
+
+    def shard_done(self, index):
+        return index in self.data['shards']
+
+    def mark_shard(self, index):
+        self._mark('shards', index)
+
+    def file_done(self, key):
+        return key in self.data['files']
+
+    def mark_file(self, key):
+        with self._lock:
+            if key not in self.data['files']:
+                self.data['files'].append(key)
+            self.data['ranges'].pop(key, None)
+            self._save()
+
+    def ranges_done(self, key):
+        return set(self.data['ranges'].get(key, ()))
+
+    def mark_range(self, key, offset):
+        with self._lock:
+            self.data['ranges'].setdefault(key, []).append(offset)
+            self._save()
+
+    def reset_ranges(self, key):
+        with self._lock:
+            if self.data['ranges'].pop(key, None) is not None:
+                self._save()
+
+    def remove(self):
+        if lib.my_globals.get_pretend():
+            return
+        for path in [self.path] + glob.glob(glob.escape(self.plan_prefix) + '.*'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
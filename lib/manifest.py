@@ -0,0 +1,212 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Source manifest for cadinstall
+
+The source tree is walked once per run (with lib/treescan.py) and every
+entry rsync will copy is written to a compact gzip file: one line per entry
+with its type, size, blocks, mode, mtime, device, inode, link count, an
+optional content hash and its path relative to the source. Later stages
+(sizing, sharded transfers, verification, ...) read the manifest instead of
+walking the tree again.
+
+File format (tab separated, paths escaped so they stay on one line):
+
+    # cadinstall manifest 1 <escaped source path>
+    <type> <size> <blocks> <mode> <mtime_ns> <dev> <ino> <nlink> <hash|-> <path>
+    ...
+    # totals {"files": ..., "apparent_bytes": ..., ...}
+
+type is f (file), d (directory), l (symlink) or o (anything else).
+"""
+
+import os
+import gzip
+import json
+import stat
+import atexit
+import getpass
+import logging
+import threading
+from collections import namedtuple
+
+from lib.treescan import TreeScan, scan_tree
+
+logger = logging.getLogger('cadinstall')
+
+MANIFEST_VERSION = 1
+
+ManifestEntry = namedtuple('ManifestEntry', 'path type size blocks mode mtime dev ino nlink hash')
+
+_TOTAL_FIELDS = ('files', 'dirs', 'symlinks', 'others', 'hardlinks', 'excluded',
+                 'apparent_bytes', 'allocated_bytes')
+
+
+def _escape(path):
+    return path.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def _unescape(text):
+    out = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and i + 1 < len(text):
+            out.append({'t': '\t', 'n': '\n'}.get(text[i + 1], text[i + 1]))
+            i += 2
+            continue
+        out.append(char)
+        i += 1
+    return ''.join(out)
+
+
+def _entry_type(mode):
+    if stat.S_ISREG(mode):
+        return 'f'
+    if stat.S_ISDIR(mode):
+        return 'd'
+    if stat.S_ISLNK(mode):
+        return 'l'
+    return 'o'
+
+
+def format_entry(entry):
+    return "%s\t%d\t%d\t%o\t%d\t%d\t%d\t%d\t%s\t%s\n" % (
+        entry.type, entry.size, entry.blocks, entry.mode, entry.mtime, entry.dev,
+        entry.ino, entry.nlink, entry.hash or '-', _escape(entry.path))
+
+
+def parse_entry(line):
+    fields = line.rstrip('\n').split('\t', 9)
+    return ManifestEntry(
+        path=_unescape(fields[9]), type=fields[0], size=int(fields[1]), blocks=int(fields[2]),
+        mode=int(fields[3], 8), mtime=int(fields[4]), dev=int(fields[5]), ino=int(fields[6]),
+        nlink=int(fields[7]), hash=None if fields[8] == '-' else fields[8])
+
+
+class Manifest:
+    """A manifest file on disk plus the totals of the scan that produced it."""
+
+    def __init__(self, root, path, totals):
+        self.root = root
+        self.path = path
+        self.totals = totals
+
+    @property
+    def size(self):
+        """Bytes the tree needs at the destination (see TreeScan.size)."""
+        return self.totals.size
+
+    @property
+    def errors(self):
+        return self.totals.errors
+
+    def entries(self):
+        """Yield every ManifestEntry, streamed from the file."""
+        with gzip.open(self.path, 'rt', encoding='utf-8', errors='surrogateescape') as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                yield parse_entry(line)
+
+    def files(self):
+        return (entry for entry in self.entries() if entry.type == 'f')
+
+    def write_entries(self, entries, path=None):
+        """Rewrite the manifest (e.g. with hashes filled in) from an iterable of entries."""
+        path = path or self.path
+        # Unique per writer, so concurrent rewrites never share a file
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with gzip.open(tmp, 'wt', encoding='utf-8', errors='surrogateescape', compresslevel=1) as f:
+            f.write("# cadinstall manifest %d %s\n" % (MANIFEST_VERSION, _escape(self.root)))
+            for entry in entries:
+                f.write(format_entry(entry))
+            f.write("# totals %s\n" % json.dumps(_totals_dict(self.totals)))
+        os.rename(tmp, path)
+        self.path = path
+
+
+def _totals_dict(totals):
+    return dict((field, getattr(totals, field)) for field in _TOTAL_FIELDS)
+
+
+def build_manifest(src, path, rules=None, workers=None):
+    """
+    Walk src once and write its manifest to path.
+
+    Returns a Manifest. Entries excluded by the rsync exclude list are left
+    out, since they are never copied.
+    """
+    logger.info("Building source manifest for %s ..." % src)
+    tmp = "%s.tmp" % path
+    with gzip.open(tmp, 'wt', encoding='utf-8', errors='surrogateescape', compresslevel=1) as f:
+        f.write("# cadinstall manifest %d %s\n" % (MANIFEST_VERSION, _escape(src)))
+
+        def write(entries):
+            for rel, st in entries:
+                f.write(format_entry(ManifestEntry(
+                    path=rel, type=_entry_type(st.st_mode), size=st.st_size, blocks=st.st_blocks,
+                    mode=stat.S_IMODE(st.st_mode), mtime=st.st_mtime_ns, dev=st.st_dev,
+                    ino=st.st_ino, nlink=st.st_nlink, hash=None)))
+
+        totals = scan_tree(src, rules=rules, workers=workers, on_entries=write)
+        f.write("# totals %s\n" % json.dumps(_totals_dict(totals)))
+    os.rename(tmp, path)
+
+    logger.info("Source manifest: %d files, %d directories, %d symlinks in %s"
+                % (totals.files, totals.dirs, totals.symlinks, src))
+    return Manifest(src, path, totals)
+
+
+def load_manifest(path):
+    """Read a manifest written by build_manifest(). Returns a Manifest."""
+    root = None
+    totals = TreeScan()
+    with gzip.open(path, 'rt', encoding='utf-8', errors='surrogateescape') as f:
+        for line in f:
+            if line.startswith('# cadinstall manifest '):
+                version, escaped_root = line.rstrip('\n')[len('# cadinstall manifest '):].split(' ', 1)
+                if int(version) != MANIFEST_VERSION:
+                    raise ValueError("unsupported manifest version %s in %s" % (version, path))
+                root = _unescape(escaped_root)
+            elif line.startswith('# totals '):
+                for field, value in json.loads(line[len('# totals '):]).items():
+                    setattr(totals, field, value)
+    if root is None:
+        raise ValueError("%s is not a cadinstall manifest" % path)
+    totals.root = root
+    return Manifest(root, path, totals)
+
+
+_manifests = {}  # realpath of src -> Manifest built in this run
+_lock = threading.Lock()
+
+
+def get_manifest(src):
+    """
+    Return this run's manifest for src, building it on first use.
+
+    The file lives in /tmp for the life of the process and is removed at
+    exit.
+    """
+    key = os.path.realpath(src)
+    with _lock:
+        if key in _manifests:
+            return _manifests[key]
+        if not _manifests:
+            atexit.register(remove_manifests)
+        path = "/tmp/.cadinstall.manifest.%s.%d.%d.gz" % (getpass.getuser(), os.getpid(), len(_manifests))
+        manifest = build_manifest(src, path)
+        _manifests[key] = manifest
+        return manifest
+
+
+def remove_manifests():
+    with _lock:
+        for manifest in _manifests.values():
+            try:
+                os.remove(manifest.path)
+            except OSError:
+                pass
+        _manifests.clear()
@@ -0,0 +1,166 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Install prechecks for cadinstall
+
+Runs every pre-install check (source readability, destination, install
+permissions, module permissions and disk space) for every site at the same
+time and collects
+the outcomes in a single PrecheckReport, so that the precheck phase costs
+about one round trip per site instead of one per check per site.
+
+When sites may seed each other, the ssh trust between their write hosts is
+checked too. A missing link does not fail a site: the site copies from the
+origin instead.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.tool_defs import siteHash, cadtools_user
+from lib.utils import check_dest, get_directory_size, get_available_space, format_bytes, find_unreadable_entries
+from lib.install import check_install_permissions, check_module_permissions
+from lib.replication import check_seed_links
+
+logger = logging.getLogger('cadinstall')
+
+# Extra space required on top of the source size
+DISK_SPACE_MARGIN = 1.2
+
+
+class PrecheckReport:
+    """
+    Outcome of every precheck for every site.
+
+    ``results`` maps site -> check name -> (passed, detail). Sites are kept
+    in the order they were checked so reports read the same way the
+    installs will run.
+    """
+
+    def __init__(self, sites):
+        self.sites = list(sites)
+        self.results = dict((site, {}) for site in self.sites)
+        self.src_size = None
+        self.required_space = None
+        self.source_problems = []  # (problem, path) that cadtools cannot copy
+        self.seed_links = None  # (source, site) pairs that may seed, None if not checked
+        self.unreachable_links = []  # (source, site) pairs without ssh trust
+        self.site_hosts = {}
+        self.errors = []
+
+    def add(self, site, check, passed, detail=''):
+        self.results[site][check] = (bool(passed), detail)
+
+    def failures(self, site):
+        return [(check, detail) for check, (passed, detail) in self.results[site].items() if not passed]
+
+    def failed_sites(self):
+        return [site for site in self.sites if self.failures(site)]
+
+    def passed_sites(self):
+        return [site for site in self.sites if not self.failures(site)]
+
+    def failed_checks(self):
+        checks = set()
+        for site in self.sites:
+            checks.update(check for check, _ in self.failures(site))
+        return checks
+
+    def ok(self):
+        return not self.errors and not self.failed_sites()
+
+    def log(self):
+        logger.info("Precheck report:")
+        if self.src_size is not None:
+            logger.info("  Source size: %s (needs %s per site)" % (format_bytes(self.src_size), format_bytes(self.required_space)))
+        for error in self.errors:
+            logger.error("  %s" % error)
+        for problem, path in self.source_problems:
+            logger.error("    %-15s %s" % (problem, path))
+        for site in self.sites:
+            for check, (passed, detail) in self.results[site].items():
+                if passed:
+                    logger.info("  %-4s %-20s PASS %s" % (site, check, detail))
+                else:
+                    logger.error("  %-4s %-20s FAIL %s" % (site, check, detail))
+        for source, site in self.unreachable_links:
+            logger.warning("  %-4s %-20s WARN %s cannot ssh to %s as %s; %s will not be seeded from %s"
+                           % (site, 'seeding from ' + source, self.site_hosts[source], self.site_hosts[site],
+                              cadtools_user, site, source))
+
+
+def run_install_prechecks(src, sites_list, vendor, tool, version, dest_base, skip_modules=False,
+                          resume_sites=(), check_seeding=False):
+    """
+    Run all install prechecks concurrently across sites and check types.
+
+    On resume_sites an interrupted install is being resumed, so the
+    destination is expected to exist there. With check_seeding, the site
+    pairs that can seed each other are stored in report.seed_links.
+
+    Returns a PrecheckReport. Nothing is modified on any site.
+    """
+    final_dest = "%s/%s/%s/%s" % (dest_base, vendor, tool, version)
+    report = PrecheckReport(sites_list)
+    report.site_hosts = dict((site, siteHash[site]) for site in sites_list)
+
+    logger.info("Running prechecks for %s on sites: %s ..." % (final_dest, ', '.join(sites_list)))
+
+    def dest_check(site):
+        exists = check_dest(final_dest, siteHash[site])
+        if site in resume_sites:
+            return 'destination', True, "%s exists, resuming" % final_dest if exists else "%s is free" % final_dest
+        return 'destination', not exists, "%s already exists" % final_dest if exists else "%s is free" % final_dest
+
+    def install_permissions(site):
+        ok = check_install_permissions(final_dest, siteHash[site])
+        return 'install permissions', ok, "" if ok else "cannot create %s" % final_dest
+
+    def module_permissions(site):
+        ok = check_module_permissions(vendor, tool, siteHash[site])
+        return 'module permissions', ok, "" if ok else "cannot create module files for %s/%s" % (vendor, tool)
+
+    def available_space(site):
+        # Resolves to the nearest existing parent of final_dest, the same
+        # (cached) lookup the install permissions check uses.
+        return get_available_space(final_dest, siteHash[site])
+
+    checks = [dest_check, install_permissions]
+    if not skip_modules:
+        checks.append(module_permissions)
+
+    workers = len(sites_list) * (len(checks) + 1) + 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        size_future = pool.submit(get_directory_size, src)
+        readable_future = pool.submit(find_unreadable_entries, src)
+        check_futures = [(site, pool.submit(check, site)) for site in sites_list for check in checks]
+        space_futures = [(site, pool.submit(available_space, site)) for site in sites_list]
+        seed_future = pool.submit(check_seed_links, sites_list, report.site_hosts) if check_seeding else None
+
+        for site, future in check_futures:
+            check, passed, detail = future.result()
+            report.add(site, check, passed, detail)
+
+        if seed_future is not None:
+            report.seed_links, report.unreachable_links = seed_future.result()
+
+        problems = readable_future.result()
+        if problems is None:
+            report.errors.append("Could not check that %s is readable to %s" % (src, cadtools_user))
+        elif problems:
+            report.source_problems = problems
+            report.errors.append("%d entries in %s cannot be copied by %s" % (len(problems), src, cadtools_user))
+
+        report.src_size = size_future.result()
+        if report.src_size == 0:
+            report.errors.append("Could not determine source directory size for %s" % src)
+            return report
+
+        report.required_space = int(report.src_size * DISK_SPACE_MARGIN)
+        for site, future in space_futures:
+            available = future.result()
+            report.add(site, 'disk space', available >= report.required_space,
+                       "needs %s, available %s" % (format_bytes(report.required_space), format_bytes(available)))
+
+    return report
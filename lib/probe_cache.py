@@ -0,0 +1,89 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Run-scoped probe cache for cadinstall
+
+The same questions get asked about a site host many times in one run:
+which host are we on, does this directory exist, which parent of the
+install path is writable, how much space is free there. Answers are kept
+here for the life of the process so each is looked up once.
+
+Anything that changes a host's filesystem must call invalidate_probes()
+for the path it touched so that later probes see the change.
+"""
+
+import socket
+import logging
+import threading
+
+logger = logging.getLogger('cadinstall')
+
+# Kinds of probe whose answer includes free space, which any change on the
+# host can affect
+HOST_WIDE_KINDS = ('ancestor',)
+
+_current_host = None
+_probes = {}  # (host, kind, path) -> result
+_lock = threading.Lock()
+
+
+def current_host():
+    """Return the fully qualified name of this host, looked up once per process."""
+    global _current_host
+    if _current_host is None:
+        _current_host = socket.getfqdn()
+    return _current_host
+
+
+def _related(a, b):
+    """True if a and b are the same path or one is below the other."""
+    if a == b:
+        return True
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    return longer.startswith(shorter.rstrip('/') + '/')
+
+
+def cached_probe(host, kind, path, probe):
+    """
+    Return the cached result of a probe, running probe() on a miss.
+
+    Args:
+        host:  Host the probe runs against.
+        kind:  What is being asked (e.g. 'exists', 'ancestor').
+        path:  Path the probe is about.
+        probe: Callable returning the answer.
+    """
+    key = (host.lower(), kind, path)
+    with _lock:
+        if key in _probes:
+            return _probes[key]
+    result = probe()
+    with _lock:
+        _probes[key] = result
+    return result
+
+
+def invalidate_probes(host, path=None):
+    """
+    Forget probes made stale by a change on host.
+
+    Probes about path, its parents and anything below it are dropped, as
+    are all probes on the host that include free space. With path None,
+    everything cached for the host is dropped.
+    """
+    host = host.lower()
+    with _lock:
+        for key in list(_probes):
+            probe_host, kind, probe_path = key
+            if probe_host != host:
+                continue
+            if path is None or kind in HOST_WIDE_KINDS or _related(probe_path, path):
+                del _probes[key]
+
+
+def clear_probe_cache():
+    global _current_host
+    with _lock:
+        _probes.clear()
+        _current_host = None
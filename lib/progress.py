@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Transfer progress for cadinstall
+
+Every copy to a site reports into a TransferProgress. rsync runs with
+--info=progress2 where its version allows, and its progress lines are
+parsed per rsync; the other backends report their own counters as shards,
+byte ranges and tar streams finish. Totals come from the source manifest.
+
+Instead of logging every file rsync copies (those lines only go to the
+log file), a snapshot of bytes and files done, percent, bytes/s, files/s
+and ETA is logged every tool_defs.progress_interval seconds. When the copy
+ends, a throughput summary is logged and kept for the site's
+.cadinstall.metadata.
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import namedtuple
+
+import lib.tool_defs
+from lib.utils import format_bytes
+from lib.transfer_profiles import rsync_version
+
+logger = logging.getLogger('cadinstall')
+
+# rsync understands --info=progress2 from this version on
+PROGRESS2_RSYNC_VERSION = (3, 1, 0)
+
+#      1,234,567  45%   12.34MB/s    0:01:23 (xfr#12, to-chk=100/2000)
+_PROGRESS2 = re.compile(r'^\s*([\d,]+)\s+(\d+)%\s+\S+/s\s+\d+:\d\d:\d\d(?:\s+\(xfr#(\d+),\s*\w+-chk=\d+/\d+\))?\s*$')
+
+RsyncProgress = namedtuple('RsyncProgress', 'bytes percent files')
+
+
+def parse_progress2(line):
+    """An RsyncProgress from one rsync --info=progress2 line, or None for any other line."""
+    match = _PROGRESS2.match(line)
+    if not match:
+        return None
+    return RsyncProgress(int(match.group(1).replace(',', '')), int(match.group(2)), int(match.group(3) or 0))
+
+
+def progress_rsync_options(host=None):
+    """--info=progress2 if rsync on host (None for this host), which runs the transfer, supports it."""
+    version = rsync_version(host)
+    if version is None or version < PROGRESS2_RSYNC_VERSION:
+        return ''
+    return '--info=progress2'
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class TransferProgress:
+    """
+    Progress of one copy to a site.
+
+    Each rsync, shard or big file reports under its own key, so a retry or
+    a final count replaces what that key reported before instead of adding
+    to it.
+    """
+
+    def __init__(self, dest, dest_host, total_bytes=None, total_files=None, interval=None):
+        self.dest = dest
+        self.dest_host = dest_host
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.interval = interval if interval is not None else lib.tool_defs.progress_interval
+        self.started = time.monotonic()
+        self._counts = {}   # key -> [bytes, files]
+        self._percent = {}  # key -> percent rsync reported, used without totals
+        self._snapshot = (self.started, 0, 0)  # time, bytes and files of the last snapshot
+        self._next_log = self.started + self.interval
+        self._lock = threading.Lock()
+
+    def totals(self):
+        """(bytes, files) done so far."""
+        with self._lock:
+            return (sum(count[0] for count in self._counts.values()),
+                    sum(count[1] for count in self._counts.values()))
+
+    def update(self, key, bytes_done, files_done):
+        """What key has copied so far. A restarted rsync never takes the count backwards."""
+        with self._lock:
+            count = self._counts.setdefault(key, [0, 0])
+            count[0] = max(count[0], bytes_done)
+            count[1] = max(count[1], files_done)
+        self._maybe_log()
+
+    def add(self, key, bytes_done=0, files_done=0):
+        with self._lock:
+            count = self._counts.setdefault(key, [0, 0])
+            count[0] += bytes_done
+            count[1] += files_done
+        self._maybe_log()
+
+    def complete(self, key, bytes_done, files_done):
+        """The final count for key, once it has finished."""
+        with self._lock:
+            self._counts[key] = [bytes_done, files_done]
+            self._percent.pop(key, None)
+        self._maybe_log()
+
+    def rsync_output(self, key):
+        """
+        A stdout callback (see run_command()) for one rsync reporting under
+        key: progress lines update the counts, other lines go to the log file.
+        """
+        def on_line(line):
+            progress = parse_progress2(line)
+            if progress is None:
+                if line:
+                    logger.debug(line)
+                return
+            with self._lock:
+                self._percent[key] = progress.percent
+            self.update(key, progress.bytes, progress.files)
+        return on_line
+
+    def _percent_done(self, done_bytes):
+        if self.total_bytes:
+            return min(100.0, 100.0 * done_bytes / self.total_bytes)
+        with self._lock:
+            if len(self._percent) == 1:
+                return float(list(self._percent.values())[0])
+        return None
+
+    def snapshot(self, now=None):
+        """One line with bytes and files done, percent, current rates and ETA."""
+        now = now if now is not None else time.monotonic()
+        done_bytes, done_files = self.totals()
+        with self._lock:
+            last_time, last_bytes, last_files = self._snapshot
+            self._snapshot = (now, done_bytes, done_files)
+        span = now - last_time
+        rate = (done_bytes - last_bytes) / span if span > 0 else 0.0
+        files_rate = (done_files - last_files) / span if span > 0 else 0.0
+
+        text = "Progress to %s: %s" % (self.dest_host, format_bytes(done_bytes))
+        if self.total_bytes:
+            text += " of %s" % format_bytes(self.total_bytes)
+        percent = self._percent_done(done_bytes)
+        if percent is not None:
+            text += " (%d%%)" % percent
+        text += ", %d" % done_files
+        if self.total_files:
+            text += " of %d" % self.total_files
+        text += " files, %s/s, %.0f files/s" % (format_bytes(rate), files_rate)
+        # The average rate so far gives a steadier estimate than the current one
+        average = done_bytes / max(now - self.started, 1e-6)
+        if self.total_bytes and average > 0 and done_bytes < self.total_bytes:
+            text += ", ETA %s" % format_duration((self.total_bytes - done_bytes) / average)
+        return text
+
+    def _maybe_log(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_log:
+                return
+            # Claimed under the lock, so concurrent reporters log once per interval
+            self._next_log = now + self.interval
+        logger.info(self.snapshot(now))
+
+    def finish(self):
+        """Log the throughput summary and keep it for the metadata file. Returns it."""
+        elapsed = time.monotonic() - self.started
+        done_bytes, done_files = self.totals()
+        summary = ("%s, %d files in %s (%s/s, %.0f files/s)"
+                   % (format_bytes(done_bytes), done_files, format_duration(elapsed),
+                      format_bytes(done_bytes / max(elapsed, 1e-6)), done_files / max(elapsed, 1e-6)))
+        logger.info("Copied %s to %s: %s" % (self.dest, self.dest_host, summary))
+        with _summaries_lock:
+            _summaries[(self.dest_host, self.dest)] = summary
+        return summary
+
+
+_summaries = {}  # (dest_host, dest) -> summary of this run's copy
+_summaries_lock = threading.Lock()
+
+
+def transfer_summary(dest, dest_host):
+    """The throughput summary of this run's copy of dest to dest_host, or None."""
+    with _summaries_lock:
+        return _summaries.get((dest_host, dest))
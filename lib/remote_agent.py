@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Remote helper agent client for cadinstall
+
+Filesystem probes on a site's write host (does this directory exist, is it
+writable, how much space is free, ...) used to be one ssh + one process per
+probe. This module starts lib/remote_agent_main.py once per host over a
+single ssh session and sends it requests over stdin/stdout instead.
+
+The agent runs as cadtools on the remote host, exactly like the commands it
+replaces, because ssh authenticates as cadtools after the setuid binary's
+setreuid. It is only used in setuid mode and, unless asked for explicitly,
+only for remote hosts; callers fall back to the individual commands
+whenever get_agent() returns None.
+"""
+
+import os
+import json
+import base64
+import atexit
+import logging
+import threading
+import subprocess
+
+import lib.tool_defs
+from lib.executor import get_execution_mode, get_sudo_path
+from lib.ssh_pool import ssh_prefix
+
+logger = logging.getLogger('cadinstall')
+
+AGENT_SOURCE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'remote_agent_main.py')
+
+# Reads the agent program from the first line of stdin, then serves requests
+BOOTSTRAP = "import sys,base64;exec(base64.b64decode(sys.stdin.readline()))"
+
+
+class AgentError(Exception):
+    """The agent could not be reached or rejected a request."""
+
+
+class RemoteAgent:
+    """One running helper on one host. Calls are serialized with a lock."""
+
+    def __init__(self, host):
+        self.host = host
+        self.process = None
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _command(self):
+        """argv that runs the bootstrap on the host as cadtools."""
+        python = lib.tool_defs.remote_python
+        # ssh joins the remote arguments and the remote shell splits them
+        # again, so the bootstrap is quoted as one word.
+        return [get_sudo_path()] + ssh_prefix(self.host).split() + [python, '-u', '-c', "'%s'" % BOOTSTRAP]
+
+    def start(self):
+        logger.debug("Starting remote helper on %s" % self.host)
+        self.process = subprocess.Popen(self._command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, bufsize=0)
+        with open(AGENT_SOURCE, 'rb') as f:
+            program = base64.b64encode(f.read())
+        self.process.stdin.write(program + b'\n')
+        self.process.stdin.flush()
+        ready = self._read_reply()
+        if ready.get('result') != 'ready':
+            raise AgentError("unexpected greeting from %s: %s" % (self.host, ready))
+
+    def _read_reply(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise AgentError("remote helper on %s exited" % self.host)
+        return json.loads(line.decode('utf-8'))
+
+    def call(self, op, **kwargs):
+        """Run one request and return its result. Raises AgentError on failure."""
+        with self._lock:
+            if self.process is None or self.process.poll() is not None:
+                raise AgentError("remote helper on %s is not running" % self.host)
+            request = dict(kwargs, id=self._next_id, op=op)
+            self._next_id += 1
+            try:
+                self.process.stdin.write(json.dumps(request).encode('utf-8') + b'\n')
+                self.process.stdin.flush()
+                reply = self._read_reply()
+            except (OSError, ValueError) as e:
+                raise AgentError("lost remote helper on %s: %s" % (self.host, e))
+            if not reply.get('ok'):
+                raise AgentError("%s on %s failed: %s" % (op, self.host, reply.get('error')))
+            return reply.get('result')
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+        self.process = None
+
+
+_agents = {}  # host -> RemoteAgent, or None if it could not be started
+_agents_lock = threading.Lock()
+
+
+def get_agent(host, same_host=False):
+    """
+    Return a running RemoteAgent for host, starting it on first use.
+
+    Returns None when the agent cannot be used (same host, listener mode,
+    disabled in tool_defs, or it failed to start) so callers fall back to
+    running individual commands. With same_host=True it is also started
+    (over ssh, as cadtools) when host is this host, for work that has no
+    command to fall back to.
+    """
+    from lib.utils import check_same_host
+
+    if not lib.tool_defs.remote_python:
+        return None
+    if get_execution_mode() != 'setuid' or (check_same_host(host) == 0 and not same_host):
+        return None
+
+    with _agents_lock:
+        if host in _agents:
+            return _agents[host]
+        if not _agents:
+            atexit.register(close_agents)
+        agent = RemoteAgent(host)
+        try:
+            agent.start()
+            logger.debug("Remote helper running on %s" % host)
+        except Exception as e:
+            logger.debug("Could not start remote helper on %s, using individual commands: %s" % (host, e))
+            agent.close()
+            agent = None
+        _agents[host] = agent
+        return agent
+
+
+def close_agents():
+    with _agents_lock:
+        for agent in _agents.values():
+            if agent is not None:
+                agent.close()
+        _agents.clear()
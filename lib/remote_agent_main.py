@@ -0,0 +1,511 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+cadinstall remote helper
+
+This program is shipped to a site's write host over a single ssh session by
+lib/remote_agent.py and runs there as the cadtools user. It answers
+filesystem requests natively so that each probe does not cost a new process
+and ssh session.
+
+Protocol: one JSON object per line on stdin, one JSON reply per line on
+stdout.
+
+    request:  {"id": 1, "op": "stat", "path": "/tools_vendor/synopsys"}
+    reply:    {"id": 1, "ok": true, "result": {...}}
+              {"id": 1, "ok": false, "error": "..."}
+
+It must only use the standard library and run on the system python3 of the
+write hosts.
+"""
+
+import os
+import dbm
+import pwd
+import grp
+import sys
+import json
+import mmap
+import stat
+import time
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Files this large are hashed through mmap rather than read()
+MMAP_THRESHOLD = 8 * 1024 * 1024
+
+# Files handled per round of op_dedupe; the time limit is checked between rounds
+DEDUPE_BATCH = 256
+
+METADATA = '.cadinstall.metadata'
+
+
+def _entry(path, st):
+    if stat.S_ISLNK(st.st_mode):
+        kind = 'link'
+    elif stat.S_ISDIR(st.st_mode):
+        kind = 'dir'
+    elif stat.S_ISREG(st.st_mode):
+        kind = 'file'
+    else:
+        kind = 'special'
+    return {
+        'path': path,
+        'type': kind,
+        'mode': stat.S_IMODE(st.st_mode),
+        'uid': st.st_uid,
+        'gid': st.st_gid,
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'nlink': st.st_nlink,
+    }
+
+
+def op_stat(path):
+    """lstat a path. Returns None if it does not exist."""
+    try:
+        return _entry(path, os.lstat(path))
+    except FileNotFoundError:
+        return None
+
+
+def op_access(path, mode='r'):
+    flags = {'f': os.F_OK, 'r': os.R_OK, 'w': os.W_OK, 'x': os.X_OK}
+    wanted = 0
+    for char in mode:
+        wanted |= flags[char]
+    return os.access(path, wanted)
+
+
+def op_statvfs(path):
+    st = os.statvfs(path)
+    return {'available': st.f_bavail * st.f_frsize, 'total': st.f_blocks * st.f_frsize}
+
+
+def op_resolve(path):
+    """Deepest existing directory at or above path, with its writability and free space."""
+    current = path
+    while current not in ('', '/') and not os.path.isdir(current):
+        current = os.path.dirname(current)
+    current = current or '/'
+    st = os.statvfs(current)
+    return {
+        'path': current,
+        'writable': os.access(current, os.W_OK),
+        'available': st.f_bavail * st.f_frsize,
+    }
+
+
+def op_mkdir(path, mode=0o755, parents=True):
+    if parents:
+        os.makedirs(path, mode=mode, exist_ok=True)
+    elif not os.path.isdir(path):
+        os.mkdir(path, mode)
+    return True
+
+
+def op_symlink(target, path, replace=True):
+    """Create path -> target. With replace, an existing link or file is swapped atomically."""
+    if not replace:
+        os.symlink(target, path)
+        return True
+    tmp = "%s.cadinstall.%d" % (path, os.getpid())
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    os.symlink(target, tmp)
+    os.rename(tmp, path)
+    return True
+
+
+def op_walk(path, max_entries=None):
+    """List every entry under path (not following symlinks), relative to path."""
+    entries = []
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        full = os.path.join(path, rel) if rel else path
+        with os.scandir(full) as it:
+            for dirent in it:
+                child = os.path.join(rel, dirent.name) if rel else dirent.name
+                entries.append(_entry(child, dirent.stat(follow_symlinks=False)))
+                if max_entries is not None and len(entries) >= max_entries:
+                    return entries
+                if dirent.is_dir(follow_symlinks=False):
+                    stack.append(child)
+    return entries
+
+
+def op_fixperms(path, owner, group, dir_mode, paths=None):
+    """
+    Bring the tree under path (path included) to the install policy in one
+    walk: directories dir_mode, files a=rX,u+w (0755 if any execute bit is
+    set, else 0644), everything owned by owner:group. Only entries that
+    differ are changed. Symlinks only get their ownership fixed.
+
+    With paths (relative to path) only those entries are checked, without
+    walking the tree.
+    """
+    uid = pwd.getpwnam(owner).pw_uid
+    gid = grp.getgrnam(group).gr_gid
+    counts = {'checked': 0, 'changed': 0, 'chmod': 0, 'chown': 0, 'failed': 0, 'errors': []}
+
+    def error(message):
+        # Only the first few are sent back; the rest are counted
+        counts['failed'] += 1
+        if len(counts['errors']) < 20:
+            counts['errors'].append(message)
+
+    def fix(full, st):
+        counts['checked'] += 1
+        changed = False
+        try:
+            if st.st_uid != uid or st.st_gid != gid:
+                os.lchown(full, uid, gid)
+                counts['chown'] += 1
+                changed = True
+                # chown can clear setgid, so check the mode afterwards
+                st = os.lstat(full)
+            if not stat.S_ISLNK(st.st_mode):
+                if stat.S_ISDIR(st.st_mode):
+                    wanted = dir_mode
+                else:
+                    wanted = 0o755 if st.st_mode & 0o111 else 0o644
+                if stat.S_IMODE(st.st_mode) != wanted:
+                    os.chmod(full, wanted)
+                    counts['chmod'] += 1
+                    changed = True
+        except OSError as e:
+            error("%s: %s" % (full, e))
+        if changed:
+            counts['changed'] += 1
+
+    if paths is not None:
+        for rel in paths:
+            full = os.path.join(path, rel)
+            try:
+                st = os.lstat(full)
+            except OSError as e:
+                error("%s: %s" % (full, e))
+                continue
+            fix(full, st)
+        return counts
+
+    fix(path, os.lstat(path))
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for dirent in it:
+                    try:
+                        st = dirent.stat(follow_symlinks=False)
+                    except OSError as e:
+                        error("%s: %s" % (dirent.path, e))
+                        continue
+                    fix(dirent.path, st)
+                    if stat.S_ISDIR(st.st_mode):
+                        stack.append(dirent.path)
+        except OSError as e:
+            error("%s: %s" % (current, e))
+    return counts
+
+
+def op_lstat_many(root, paths, readlink=False):
+    """
+    lstat each path below root. Returns [type, size, dev, ino, mtime_ns] per
+    path (type as in manifests: f, d, l or o), or None if it does not exist.
+    With readlink, a sixth item holds a symlink's target (None for others).
+    """
+    results = []
+    for rel in paths:
+        try:
+            st = os.lstat(os.path.join(root, rel))
+        except FileNotFoundError:
+            results.append(None)
+            continue
+        if stat.S_ISREG(st.st_mode):
+            kind = 'f'
+        elif stat.S_ISDIR(st.st_mode):
+            kind = 'd'
+        elif stat.S_ISLNK(st.st_mode):
+            kind = 'l'
+        else:
+            kind = 'o'
+        result = [kind, st.st_size, st.st_dev, st.st_ino, st.st_mtime_ns]
+        if readlink:
+            result.append(os.readlink(os.path.join(root, rel)) if kind == 'l' else None)
+        results.append(result)
+    return results
+
+
+def hash_file(path):
+    """BLAKE2b of a file's contents, as a hex string. lib/verify.py uses this locally too."""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, 'madvise'):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                digest.update(m)
+        else:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_one(path):
+    try:
+        return [hash_file(path), None]
+    except OSError as e:
+        return [None, str(e)]
+
+
+def op_hash(root, paths, workers=None):
+    """Hash each path below root in a process pool. Returns [hash, error] per path."""
+    full_paths = [os.path.join(root, rel) for rel in paths]
+    if len(full_paths) < 2:
+        return [_hash_one(path) for path in full_paths]
+    kwargs = {}
+    if sys.version_info >= (3, 7):
+        # Workers must be forked: the helper has no importable __main__
+        kwargs['mp_context'] = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, **kwargs) as pool:
+        return list(pool.map(_hash_one, full_paths, chunksize=16))
+
+
+def _installs_below(root, max_depth, skip=()):
+    """Directories at most max_depth below root holding a completed install."""
+    found = []
+    stack = [(root, 0)]
+    while stack:
+        current, depth = stack.pop()
+        if current in skip:
+            continue
+        metadata = os.path.join(current, METADATA)
+        try:
+            with open(metadata) as f:
+                if any(line.startswith('Install completed on') for line in f):
+                    found.append(current)
+                    continue
+        except OSError:
+            pass
+        if depth >= max_depth:
+            continue
+        try:
+            with os.scandir(current) as it:
+                for dirent in it:
+                    if dirent.is_dir(follow_symlinks=False):
+                        stack.append((dirent.path, depth + 1))
+        except OSError:
+            pass
+    return sorted(found)
+
+
+def op_find_installs(root, max_depth, skip=()):
+    """Completed installs (directories with a finished .cadinstall.metadata) under root."""
+    return _installs_below(root, max_depth, skip=set(skip))
+
+
+def _blob_path(store, digest, st):
+    # Files only share an inode when mode, owner and mtime match too, so
+    # linking never changes a file's metadata (update's quick check and
+    # rsync --link-dest compare mtimes)
+    return os.path.join(store, digest[:2], "%s.%o.%d.%d.%d"
+                        % (digest, stat.S_IMODE(st.st_mode), st.st_uid, st.st_gid, st.st_mtime_ns))
+
+
+def _replace_with_link(existing, path):
+    """Make path a hard link to existing, atomically."""
+    tmp = os.path.join(os.path.dirname(path), ".%s.cadinstall.dedupe" % os.path.basename(path))
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    os.link(existing, tmp)
+    os.rename(tmp, path)
+
+
+_niced = False
+
+
+def op_dedupe(root, store, min_bytes=0, time_limit=None, workers=None, nice=0, force=False):
+    """
+    Hard link every file under root to its blob in the content-addressed
+    store, adding the blobs that are missing.
+
+    store/index is a dbm file kept on this host: "dev:ino:size:mtime_ns"
+    maps to a file's hash, so a file is hashed once however often it is
+    seen, and "tree:<root>" records the .cadinstall.metadata mtime of a
+    fully processed install, which is then skipped unless force is set.
+    With time_limit (seconds) the walk stops early and reports
+    complete=False; the next call picks up where this one left off.
+    """
+    global _niced
+    if nice and not _niced:
+        os.nice(nice)
+        _niced = True
+    deadline = time.time() + time_limit if time_limit else None
+    counts = {'checked': 0, 'hashed': 0, 'stored': 0, 'linked': 0, 'bytes_saved': 0,
+              'complete': False, 'skipped': False, 'failed': 0, 'errors': []}
+
+    def error(message):
+        counts['failed'] += 1
+        if len(counts['errors']) < 20:
+            counts['errors'].append(message)
+
+    os.makedirs(store, mode=0o755, exist_ok=True)
+    index = dbm.open(os.path.join(store, 'index'), 'c')
+    try:
+        tree_key = 'tree:' + root
+        try:
+            signature = str(os.lstat(os.path.join(root, METADATA)).st_mtime_ns)
+        except OSError:
+            signature = None
+        if not force and signature is not None and index.get(tree_key) == signature.encode():
+            counts['complete'] = counts['skipped'] = True
+            return counts
+
+        def inode_key(st):
+            return "%d:%d:%d:%d" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+        def link(path, st, digest):
+            blob = _blob_path(store, digest, st)
+            try:
+                blob_st = os.lstat(blob)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(blob), mode=0o755, exist_ok=True)
+                _replace_with_link(path, blob)
+                counts['stored'] += 1
+                return
+            if (blob_st.st_dev, blob_st.st_ino) == (st.st_dev, st.st_ino):
+                return
+            if blob_st.st_size != st.st_size:
+                raise OSError("store entry %s does not match (size %d, expected %d)"
+                              % (blob, blob_st.st_size, st.st_size))
+            _replace_with_link(blob, path)
+            index[inode_key(blob_st)] = digest
+            counts['linked'] += 1
+            if st.st_nlink == 1:
+                counts['bytes_saved'] += st.st_size
+
+        def process(batch):
+            todo = [(path, st) for path, st, digest in batch if digest is None]
+            if todo:
+                counts['hashed'] += len(todo)
+                hashes = dict(zip((path for path, _ in todo), op_hash('', [path for path, _ in todo], workers)))
+            for path, st, digest in batch:
+                if digest is None:
+                    digest, failure = hashes[path]
+                    if digest is None:
+                        error("%s: %s" % (path, failure))
+                        continue
+                    index[inode_key(st)] = digest
+                try:
+                    link(path, st, digest)
+                except OSError as e:
+                    error("%s: %s" % (path, e))
+
+        batch = []
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            if current == store:
+                continue
+            try:
+                with os.scandir(current) as it:
+                    for dirent in it:
+                        st = dirent.stat(follow_symlinks=False)
+                        if stat.S_ISDIR(st.st_mode):
+                            stack.append(dirent.path)
+                            continue
+                        if not stat.S_ISREG(st.st_mode) or st.st_size < max(min_bytes, 1) or dirent.name == METADATA:
+                            continue
+                        counts['checked'] += 1
+                        digest = index.get(inode_key(st))
+                        batch.append((dirent.path, st, digest.decode() if digest else None))
+                        if len(batch) >= DEDUPE_BATCH:
+                            process(batch)
+                            batch = []
+                            if deadline is not None and time.time() > deadline:
+                                return counts
+            except OSError as e:
+                error("%s: %s" % (current, e))
+        process(batch)
+
+        counts['complete'] = True
+        if signature is not None and not counts['failed']:
+            index[tree_key] = signature
+        return counts
+    finally:
+        index.close()
+
+
+def op_dedupe_prune(store):
+    """Remove blobs no installed file links to any more. Returns (blobs, bytes) removed."""
+    removed = [0, 0]
+    try:
+        prefixes = os.listdir(store)
+    except FileNotFoundError:
+        return removed
+    for prefix in prefixes:
+        directory = os.path.join(store, prefix)
+        if len(prefix) != 2 or not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as it:
+            for dirent in it:
+                st = dirent.stat(follow_symlinks=False)
+                if stat.S_ISREG(st.st_mode) and st.st_nlink == 1:
+                    os.unlink(dirent.path)
+                    removed[0] += 1
+                    removed[1] += st.st_size
+    return removed
+
+
+OPS = {
+    'stat': op_stat,
+    'access': op_access,
+    'statvfs': op_statvfs,
+    'resolve': op_resolve,
+    'mkdir': op_mkdir,
+    'symlink': op_symlink,
+    'walk': op_walk,
+    'fixperms': op_fixperms,
+    'lstat_many': op_lstat_many,
+    'hash': op_hash,
+    'find_installs': op_find_installs,
+    'dedupe': op_dedupe,
+    'dedupe_prune': op_dedupe_prune,
+}
+
+
+def handle(request):
+    func = OPS.get(request.get('op'))
+    if func is None:
+        return {'ok': False, 'error': "unknown op: %s" % request.get('op')}
+    args = dict((k, v) for k, v in request.items() if k not in ('id', 'op'))
+    try:
+        return {'ok': True, 'result': func(**args)}
+    except Exception as e:
+        return {'ok': False, 'error': "%s: %s" % (type(e).__name__, e)}
+
+
+def main():
+    sys.stdout.write(json.dumps({'id': 0, 'ok': True, 'result': 'ready'}) + '\n')
+    sys.stdout.flush()
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            reply = {'id': None, 'ok': False, 'error': "invalid request: %s" % e}
+        else:
+            reply = handle(request)
+            reply['id'] = request.get('id')
+        sys.stdout.write(json.dumps(reply) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
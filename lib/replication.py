@@ -0,0 +1,245 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Replication planner for cadinstall
+
+Decides which already-installed site seeds each remaining site. The staged
+source (the "origin") and every site that has finished its copy can seed
+other sites, several at a time, so the set of sources roughly doubles each
+round and total install time grows with the log of the number of sites.
+Sources are chosen by measured (or configured) link bandwidth rather than
+by the order sites were listed in.
+
+A site seeds another by running rsync over ssh from its write host to the
+other site's write host as cadtools, so it needs cadtools to be able to ssh
+between those hosts without a password. check_seed_links() finds the pairs
+where it cannot; those sites copy from the origin instead.
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.tool_defs
+from lib.utils import run_command_with_output, check_same_host
+from lib.ssh_pool import ssh_prefix
+
+logger = logging.getLogger('cadinstall')
+
+# Name used for the staged source in plans and bandwidth tables
+ORIGIN = 'origin'
+
+# Probe payload sizes. Bandwidth is taken from the difference between the two
+# so that SSH connection setup time cancels out.
+PROBE_SMALL = 1 * 1024 * 1024
+PROBE_LARGE = 16 * 1024 * 1024
+
+# Bandwidth assumed for a pair that could not be measured (bytes/s). Low on
+# purpose so that measured links are always preferred.
+UNKNOWN_BANDWIDTH = 1.0
+
+# Seconds one site host waits for ssh to another in check_seed_links()
+SEED_LINK_TIMEOUT = 10
+
+_bandwidth_cache = {}
+
+
+def _probe_command(from_host, to_host, nbytes):
+    """Build a command that moves nbytes of zeros from from_host to to_host."""
+    if from_host is None:
+        # The origin is this host, so push the zeros over ssh the same way
+        # the install copy does; only the ssh needs to run as cadtools.
+        return "/usr/bin/head -c %d /dev/zero | %s '/bin/cat > /dev/null'" % (nbytes, ssh_prefix(to_host))
+    return ("%s '/usr/bin/head -c %d /dev/zero | /usr/bin/ssh %s \"/bin/cat > /dev/null\"'"
+            % (ssh_prefix(from_host), nbytes, to_host))
+
+
+def _seed_link_command(from_host, to_host):
+    """Build a command that succeeds if cadtools on from_host can ssh to to_host without a prompt."""
+    return ("%s '/usr/bin/ssh -o BatchMode=yes -o ConnectTimeout=%d %s /bin/true'"
+            % (ssh_prefix(from_host), SEED_LINK_TIMEOUT, to_host))
+
+
+def check_seed_links(sites, site_hosts):
+    """
+    Find the site pairs that can seed each other.
+
+    Every pair of distinct write hosts is checked once, all checks running
+    concurrently. Sites served by the same host can always seed each other.
+
+    Returns (links, unreachable): the set of (source, site) pairs that can
+    be used, and a list of (source, site) pairs that cannot.
+    """
+    pairs = [(a, b) for a in sites for b in sites if a != b]
+    host_pairs = set((site_hosts[a].lower(), site_hosts[b].lower()) for a, b in pairs
+                     if site_hosts[a].lower() != site_hosts[b].lower())
+
+    def check(host_pair):
+        status, _ = run_command_with_output(_seed_link_command(*host_pair), log_stderr=False,
+                                            log_stdout=False, force_run=True)
+        return host_pair, status == 0
+
+    reachable = {}
+    if host_pairs:
+        with ThreadPoolExecutor(max_workers=len(host_pairs)) as pool:
+            reachable = dict(pool.map(check, host_pairs))
+
+    links = set()
+    unreachable = []
+    for a, b in pairs:
+        host_pair = (site_hosts[a].lower(), site_hosts[b].lower())
+        if host_pair[0] == host_pair[1] or reachable[host_pair]:
+            links.add((a, b))
+        else:
+            unreachable.append((a, b))
+    return links, unreachable
+
+
+def _timed_probe(from_host, to_host, nbytes):
+    command = _probe_command(from_host, to_host, nbytes)
+    start = time.monotonic()
+    status, _ = run_command_with_output(command, log_stderr=False, log_stdout=False, force_run=True)
+    elapsed = time.monotonic() - start
+    if status != 0:
+        return None
+    return elapsed
+
+
+def measure_link_bandwidth(from_host, to_host):
+    """
+    Measure the bandwidth in bytes/s from from_host to to_host.
+
+    from_host is None for the host running cadinstall. Results are cached for
+    the life of the process. Returns None if the link could not be measured.
+    """
+    key = (from_host, to_host)
+    if key in _bandwidth_cache:
+        return _bandwidth_cache[key]
+
+    bandwidth = None
+    small = _timed_probe(from_host, to_host, PROBE_SMALL)
+    large = _timed_probe(from_host, to_host, PROBE_LARGE) if small is not None else None
+    if small is not None and large is not None and large > small:
+        bandwidth = (PROBE_LARGE - PROBE_SMALL) / (large - small)
+
+    if bandwidth is None:
+        logger.debug("Could not measure bandwidth from %s to %s" % (from_host or 'localhost', to_host))
+    else:
+        logger.debug("Measured bandwidth from %s to %s: %.1f MB/s" % (from_host or 'localhost', to_host, bandwidth / 1e6))
+    _bandwidth_cache[key] = bandwidth
+    return bandwidth
+
+
+def measure_site_bandwidth(sites, site_hosts, can_seed=True, links=None):
+    """
+    Build the bandwidth table used by plan_replication().
+
+    Pairs configured in tool_defs.siteLinkBandwidth are used as-is; every
+    other pair is probed, all probes running concurrently. With links (from
+    check_seed_links()), only those site pairs are considered.
+
+    Returns a dict mapping (source, site) to bytes/s, where source is ORIGIN
+    or a site name.
+    """
+    configured = getattr(lib.tool_defs, 'siteLinkBandwidth', {})
+    pairs = [(ORIGIN, site) for site in sites]
+    if can_seed:
+        pairs += [(a, b) for a in sites for b in sites if a != b and (links is None or (a, b) in links)]
+
+    table = {}
+    to_probe = []
+    for source, site in pairs:
+        if (source, site) in configured:
+            table[(source, site)] = configured[(source, site)]
+        elif source != ORIGIN and site_hosts[source].lower() == site_hosts[site].lower():
+            # Two sites served by the same host: nothing crosses the network.
+            table[(source, site)] = float('inf')
+        else:
+            to_probe.append((source, site))
+
+    def probe(pair):
+        source, site = pair
+        if source == ORIGIN:
+            from_host = None
+        elif check_same_host(site_hosts[source]) == 0:
+            from_host = None
+        else:
+            from_host = site_hosts[source]
+        return pair, measure_link_bandwidth(from_host, site_hosts[site])
+
+    if to_probe:
+        logger.info("Measuring link bandwidth for %d site pair(s) ..." % len(to_probe))
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as pool:
+            for pair, bandwidth in pool.map(probe, to_probe):
+                if bandwidth is not None:
+                    table[pair] = bandwidth
+    return table
+
+
+def plan_replication(sites, bandwidth, fanout=2, can_seed=True, links=None):
+    """
+    Choose a seeding source for every site.
+
+    Greedy earliest-finish-first: every source (the origin and each site once
+    its own copy has finished) has ``fanout`` transfer slots. On each step the
+    (source, site) pair with the earliest estimated finish time is scheduled,
+    and the new site becomes a source from that finish time onwards.
+
+    Args:
+        sites:       Site names, in the user's preferred order (ties keep it).
+        bandwidth:   Dict of (source, site) -> bytes/s from measure_site_bandwidth().
+        fanout:      Concurrent transfers one source may serve. 0 or less
+                     means unlimited (every site copies from the origin).
+        can_seed:    False if installed sites cannot act as sources.
+        links:       Set of (source, site) pairs that may seed, from
+                     check_seed_links(). None allows every pair. The origin
+                     can always seed.
+
+    Estimated times are in units of "one tree copy at 1 byte/s"; every copy
+    moves the same tree, so the size of the tree does not change the plan.
+
+    Returns a list of (site, source, after) tuples in an order where every
+    source appears before the sites it seeds. after is the earlier site
+    whose transfer held the source's slot until then, or None; its copy
+    has to finish before this one starts to keep the source at fanout.
+    """
+    if fanout <= 0:
+        fanout = max(1, len(sites))
+        can_seed = False
+
+    # source -> list of [time the slot becomes free, site whose copy holds it]
+    slots = {ORIGIN: [[0.0, None] for _ in range(fanout)]}
+    pending = list(sites)
+    plan = []
+
+    while pending:
+        best = None
+        for site in pending:
+            for source, source_slots in slots.items():
+                if source != ORIGIN and links is not None and (source, site) not in links:
+                    continue
+                start = min(free_at for free_at, _ in source_slots)
+                rate = bandwidth.get((source, site), UNKNOWN_BANDWIDTH)
+                finish = start + (0.0 if rate == float('inf') else 1.0 / rate)
+                if best is None or finish < best[0]:
+                    best = (finish, site, source)
+        finish, site, source = best
+        slot = min(slots[source], key=lambda slot: slot[0])
+        after = slot[1]
+        slot[:] = [finish, site]
+        pending.remove(site)
+        plan.append((site, source, after))
+        if can_seed:
+            slots[site] = [[finish, None] for _ in range(fanout)]
+
+    return plan
+
+
+def log_replication_plan(plan):
+    logger.info("Replication plan:")
+    for site, source, after in plan:
+        if after is None:
+            logger.info("  %s <- %s" % (site, source))
+        else:
+            logger.info("  %s <- %s (after %s)" % (site, source, after))
@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Stage scheduler for cadinstall
+
+The install of one version to one site is a short chain of stages
+(metadata -> copy -> link/modules -> metadata). This module models those
+stages as a dependency graph and runs every stage whose dependencies have
+finished, so that independent sites install at the same time and the total
+wall-clock time approaches that of the slowest site rather than the sum.
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger('cadinstall')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Stage:
+    """
+    A single unit of work for one site, plus the stages it waits on.
+
+    A stage runs once every stage in deps is done and every stage in after
+    has finished one way or another; only a failed dep stops it.
+    """
+
+    def __init__(self, site, name, func, args=(), kwargs=None, deps=(), after=()):
+        self.site = site
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.deps = list(deps)
+        self.after = list(after)
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return "Stage(%s:%s, %s)" % (self.site, self.name, self.state)
+
+
+class StageScheduler:
+    """
+    Run a graph of Stage objects on a thread pool.
+
+    A stage is considered failed if it raises (including SystemExit from the
+    existing helpers that exit on error) or returns a non-zero integer status.
+    Stages that depend on a failed stage are skipped; stages belonging to
+    other sites keep running so that one bad site does not stall the rest.
+
+    Args:
+        site_concurrency: Maximum number of stages that may run at the same
+                          time for any one site.
+        max_workers:      Size of the thread pool. Defaults to enough threads
+                          to run every site at full concurrency.
+    """
+
+    def __init__(self, site_concurrency=1, max_workers=None):
+        self.site_concurrency = max(1, int(site_concurrency))
+        self.max_workers = max_workers
+        self.stages = []
+
+    def add_stage(self, site, name, func, *args, deps=(), after=(), **kwargs):
+        stage = Stage(site, name, func, args, kwargs, deps, after)
+        self.stages.append(stage)
+        return stage
+
+    def sites(self):
+        seen = []
+        for stage in self.stages:
+            if stage.site not in seen:
+                seen.append(stage.site)
+        return seen
+
+    def site_stages(self, site):
+        return [stage for stage in self.stages if stage.site == site]
+
+    def failed_sites(self):
+        return [site for site in self.sites()
+                if any(stage.state in (FAILED, SKIPPED) for stage in self.site_stages(site))]
+
+    def _ready(self, stage):
+        return (stage.state == PENDING and all(dep.state == DONE for dep in stage.deps)
+                and all(other.state in (DONE, FAILED, SKIPPED) for other in stage.after))
+
+    def _blocked(self, stage):
+        return stage.state == PENDING and any(dep.state in (FAILED, SKIPPED) for dep in stage.deps)
+
+    def _run_stage(self, stage):
+        stage.started = time.monotonic()
+        try:
+            result = stage.func(*stage.args, **stage.kwargs)
+        except SystemExit as e:
+            # The install helpers call sys.exit(1) on failure. Inside a worker
+            # thread that must not take down the whole run, so record it.
+            result = e.code if e.code is not None else 0
+            if result != 0:
+                stage.error = "exited with status %s" % result
+        except Exception as e:
+            stage.error = str(e)
+            result = 1
+        stage.finished = time.monotonic()
+        stage.result = result
+        if stage.error is None and isinstance(result, int) and not isinstance(result, bool) and result != 0:
+            stage.error = "returned status %d" % result
+        return stage
+
+    def _report(self, stage):
+        stages = self.site_stages(stage.site)
+        complete = len([s for s in stages if s.state == DONE])
+        elapsed = stage.finished - stage.started
+        if stage.state == DONE:
+            logger.info("Site %s: stage '%s' finished in %.1fs (%d/%d stages complete)"
+                        % (stage.site, stage.name, elapsed, complete, len(stages)))
+        else:
+            logger.error("Site %s: stage '%s' failed after %.1fs: %s"
+                         % (stage.site, stage.name, elapsed, stage.error))
+
+    def run(self):
+        """
+        Run every stage, respecting dependencies and the per-site limit.
+        Returns True if all stages completed successfully.
+        """
+        if not self.stages:
+            return True
+
+        workers = self.max_workers or max(1, len(self.sites()) * self.site_concurrency)
+        running = {}
+        run_start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                for stage in self.stages:
+                    if self._blocked(stage):
+                        stage.state = SKIPPED
+                        logger.warning("Site %s: skipping stage '%s' because a stage it depends on did not complete"
+                                       % (stage.site, stage.name))
+
+                active_per_site = {}
+                for stage in running.values():
+                    active_per_site[stage.site] = active_per_site.get(stage.site, 0) + 1
+
+                for stage in self.stages:
+                    if not self._ready(stage):
+                        continue
+                    if active_per_site.get(stage.site, 0) >= self.site_concurrency:
+                        continue
+                    stage.state = RUNNING
+                    active_per_site[stage.site] = active_per_site.get(stage.site, 0) + 1
+                    logger.info("Site %s: starting stage '%s'" % (stage.site, stage.name))
+                    running[pool.submit(self._run_stage, stage)] = stage
+
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    future.result()
+                    stage.state = FAILED if stage.error else DONE
+                    self._report(stage)
+
+        self._summarize(time.monotonic() - run_start)
+        return not self.failed_sites()
+
+    def _summarize(self, elapsed):
+        logger.info("Install pipeline finished in %.1fs" % elapsed)
+        for site in self.sites():
+            stages = self.site_stages(site)
+            times = [s.finished for s in stages if s.finished is not None]
+            starts = [s.started for s in stages if s.started is not None]
+            site_elapsed = (max(times) - min(starts)) if times and starts else 0.0
+            states = [s.state for s in stages]
+            if all(state == DONE for state in states):
+                logger.info("Site %s: all %d stages complete (%.1fs)" % (site, len(stages), site_elapsed))
+            else:
+                failed = [s.name for s in stages if s.state == FAILED]
+                skipped = [s.name for s in stages if s.state == SKIPPED]
+                logger.error("Site %s: failed stages: %s; skipped stages: %s"
+                             % (site, ', '.join(failed) or 'none', ', '.join(skipped) or 'none'))
@@ -0,0 +1,180 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+SSH connection pool for cadinstall
+
+Every remote operation is a separate ssh invocation. Rather than paying for
+a full handshake and authentication each time, one multiplexed OpenSSH
+master connection (ControlMaster) is kept per destination host for the
+whole run. Masters can be opened in the background while the command line
+is still being validated, every ssh built with ssh_prefix() reuses them,
+and they are shut down when cadinstall exits.
+
+Bulk transfers to a host whose transfer profile names an ssh cipher open
+their own connection instead: a multiplexed session always uses the
+master's cipher.
+"""
+
+import os
+import atexit
+import getpass
+import logging
+import threading
+
+import lib.tool_defs
+
+logger = logging.getLogger('cadinstall')
+
+SSH = '/usr/bin/ssh'
+
+_control_dir = None
+_masters = {}  # host -> threading.Event set once the master is up (or failed)
+_lock = threading.Lock()
+
+# How long ssh_prefix() waits for a master that is still being opened
+MASTER_WAIT_TIMEOUT = 30
+
+
+def _enabled():
+    return _control_dir is not None and lib.tool_defs.ssh_control_persist > 0
+
+
+def ssh_options():
+    """Return the ssh -o options that attach to the pooled master connection."""
+    if not _enabled():
+        return ""
+    return "-o ControlMaster=auto -o ControlPath=%s/%%C -o ControlPersist=%d" % (
+        _control_dir, lib.tool_defs.ssh_control_persist)
+
+
+def ssh_prefix(host):
+    """
+    Return the "/usr/bin/ssh [options] host" prefix for a remote command.
+
+    If a master for host is still being opened in the background, wait for
+    it so the command multiplexes over it instead of racing it.
+    """
+    event = _masters.get(host)
+    if event is not None and not event.is_set():
+        event.wait(MASTER_WAIT_TIMEOUT)
+    options = ssh_options()
+    if options:
+        return "%s %s %s" % (SSH, options, host)
+    return "%s %s" % (SSH, host)
+
+
+def transfer_ssh_options(host):
+    """
+    Return the ssh options for bulk transfers to host: the pooled master,
+    or a connection of its own with the cipher of host's transfer profile.
+    """
+    from lib.transfer_profiles import get_transfer_profile
+
+    cipher = get_transfer_profile(host).cipher
+    if not cipher:
+        return ssh_options()
+    return "-o ControlPath=none -c %s" % cipher
+
+
+def transfer_ssh_prefix(host):
+    """Like ssh_prefix() but with transfer_ssh_options(), for commands that stream data."""
+    options = transfer_ssh_options(host)
+    if options == ssh_options():
+        return ssh_prefix(host)
+    return "%s %s %s" % (SSH, options, host)
+
+
+def rsync_rsh_option(host=None):
+    """
+    Return an rsync --rsh option that uses the pooled connections, or ''.
+    With host, use transfer_ssh_options() for it.
+    """
+    options = transfer_ssh_options(host) if host else ssh_options()
+    if not options:
+        return ""
+    return "--rsh='%s %s'" % (SSH, options)
+
+
+def _create_control_dir():
+    """Create the private socket directory as the cadtools user."""
+    from lib.utils import run_command_with_output
+
+    path = "/tmp/cadinstall.ssh.%s.%d" % (getpass.getuser(), os.getpid())
+    # Force run even in pretend mode - the directory only holds sockets.
+    status, _ = run_command_with_output("/usr/bin/mkdir -p -m 700 %s" % path,
+                                        log_stdout=False, force_run=True)
+    if status != 0:
+        logger.debug("Could not create ssh control directory %s; connections will not be pooled" % path)
+        return None
+    return path
+
+
+def _open_master(host, event):
+    from lib.utils import run_command_with_output
+
+    try:
+        command = "%s %s %s /bin/true" % (SSH, ssh_options(), host)
+        status, _ = run_command_with_output(command, log_stderr=False, log_stdout=False, force_run=True)
+        if status == 0:
+            logger.debug("Opened pooled ssh connection to %s" % host)
+        else:
+            logger.debug("Could not open pooled ssh connection to %s (status %d)" % (host, status))
+    finally:
+        event.set()
+
+
+def start_ssh_pool(hosts, background=True):
+    """
+    Open one master connection per remote host.
+
+    Hosts that are the current host are skipped. With background=True the
+    masters are opened on daemon threads and this returns immediately;
+    ssh_prefix() waits for a host's master before using it.
+    """
+    global _control_dir
+    from lib.utils import check_same_host
+
+    if lib.tool_defs.ssh_control_persist <= 0:
+        return
+
+    with _lock:
+        if _control_dir is None:
+            _control_dir = _create_control_dir()
+            if _control_dir is None:
+                return
+            atexit.register(close_ssh_pool)
+
+        new_hosts = []
+        for host in hosts:
+            if host in _masters or check_same_host(host) == 0:
+                continue
+            _masters[host] = threading.Event()
+            new_hosts.append(host)
+
+    for host in new_hosts:
+        if background:
+            thread = threading.Thread(target=_open_master, args=(host, _masters[host]))
+            thread.daemon = True
+            thread.start()
+        else:
+            _open_master(host, _masters[host])
+
+
+def close_ssh_pool():
+    """Shut down every master connection and remove the socket directory."""
+    global _control_dir
+    from lib.utils import run_command_with_output
+
+    with _lock:
+        if _control_dir is None:
+            return
+        options = ssh_options()
+        for host, event in list(_masters.items()):
+            event.wait(MASTER_WAIT_TIMEOUT)
+            run_command_with_output("%s %s -O exit %s" % (SSH, options, host),
+                                    log_stderr=False, log_stdout=False, force_run=True)
+        run_command_with_output("/usr/bin/rm -rf %s" % _control_dir,
+                                log_stderr=False, log_stdout=False, force_run=True)
+        _masters.clear()
+        _control_dir = None
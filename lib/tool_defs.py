@@ -29,13 +29,19 @@ module_path = '/tools_vendor/tt/Modules/modulefiles'
 
 rsync = '/usr/bin/rsync'
 mkdir = '/usr/bin/mkdir'
+dd = '/usr/bin/dd'
+tar = '/usr/bin/tar'
 curl = '/usr/bin/curl'
 rsync_exclude_file = os.path.realpath(os.path.dirname(os.path.realpath(__file__)) + '/../etc/rsync_exclude_list.txt')
 # Absolute chmod (not u+ / g+). Additive flags leave group-write from a 0002
 # umask (venv dirs 775 / files 664). a=rX clears write, then owner write is
 # restored; X keeps execute on dirs and already-executable files; Dg+s is setgid.
 rsync_chmod = "a=rX,u+w,Dg+s"
-rsync_options = "-av --chmod=%s --exclude-from=%s" % (rsync_chmod, rsync_exclude_file)
+# An interrupted rsync keeps partly copied files in rsync_partial_dir inside
+# each destination directory, and the next run carries on from them.
+rsync_partial_dir = '.cadinstall.partial'
+rsync_options = "-av --chmod=%s --exclude-from=%s --partial-dir=%s" % (rsync_chmod, rsync_exclude_file,
+                                                                      rsync_partial_dir)
 
 # Set up the global variables for the jenkins job
 curl_cmd = curl + ' -X POST -L'
@@ -55,6 +61,73 @@ disabled_subcommands = {
 # will refuse to run.
 delete_time_limit = 240  # 4 hours
 
+# Maximum number of install stages (copy, link, module files, ...) that may run
+# at the same time for a single site. Different sites always run concurrently.
+site_stage_concurrency = 2
+
+# Seconds an idle pooled ssh master connection to a site host stays open. Every
+# remote command in a run reuses one connection per host. 0 disables pooling.
+ssh_control_persist = 600
+
+# Python used to run the remote helper (lib/remote_agent_main.py) on site hosts
+# for filesystem probes. Set to None to always use one ssh command per probe.
+remote_python = '/usr/bin/python3'
+
+# Number of sites that one finished site (or the staged source) may seed at the
+# same time when replicating an install. 0 makes every site copy from the
+# staged source.
+seed_fanout = 2
+
+# Threads used to walk a source tree when sizing it (lib/treescan.py). Source
+# trees usually live on NFS, where many directories in flight hide latency.
+treescan_workers = 16
+
+# Parallel rsyncs used to copy a tree (lib/transfer.py). Trees smaller than
+# transfer_shard_min_bytes use a single rsync. A failed shard is retried on
+# its own up to transfer_retries times. When balancing shards each file also
+# counts as transfer_file_cost bytes, for its per-file overhead.
+transfer_shards = 8
+transfer_shard_min_bytes = 1024 * 1024 * 1024
+transfer_retries = 2
+transfer_file_cost = 256 * 1024
+
+# Files at least this big are copied in up to range_transfer_streams byte
+# ranges at once (setuid mode only). None copies them with rsync like the rest.
+range_transfer_min_bytes = 4 * 1024 * 1024 * 1024
+range_transfer_streams = 8
+
+# A new install of a tree with at least tar_stream_min_files files averaging
+# no more than tar_stream_max_average_bytes is copied as one tar stream
+# instead of with rsync. The stream to a remote host is compressed as its
+# transfer profile says; the compressor must exist on both ends.
+tar_stream_min_files = 20000
+tar_stream_max_average_bytes = 256 * 1024
+
+# Processes used to hash files when verifying an install (lib/verify.py), on
+# this host and on the site write hosts. None uses one per CPU.
+verify_workers = None
+
+# Hashes computed by verify, kept across runs so unchanged files are not read
+# again. Keyed by host, device, inode, size and mtime.
+hash_cache_file = os.path.expanduser('~/.cache/cadinstall/hashes')
+
+# Content-addressed store of installed files on each site (lib/dedupe.py).
+# It must be on the same filesystem as dest so installed files can be hard
+# linked to it. Files smaller than dedupe_min_bytes are left alone. The dedupe
+# subcommand processes installs for at most dedupe_time_limit minutes per site
+# (None for no limit) and carries on where it stopped on the next run.
+dedupe_store = dest + '/.cadinstall.store'
+dedupe_min_bytes = 64 * 1024
+dedupe_time_limit = None
+
+# Seconds between the progress snapshots (bytes, files, rates and ETA) logged
+# for each site while a tree is copied (lib/progress.py). 0 turns them off.
+progress_interval = 30
+
+# Install journals (lib/journal.py), one per install and site, kept on this
+# host until the install has finished everywhere. install --resume reads them.
+journal_dir = os.path.expanduser('~/.cache/cadinstall/journals')
+
 ## Define the host per site that has /tools_vendor mounted with write access.
 ## All operations to /tools_vendor MUST be performed on these machines.
 ## These are the ONLY hosts in each site with write access to /tools_vendor.
@@ -64,4 +137,38 @@ siteHash = {
     'yyz': 'yyz2-nfspublish.yyz2.tenstorrent.com'
 }
 
+## How trees are copied to a site (lib/transfer_profiles.py). Settings left
+## out of a profile use their defaults: no compression, whole files, the
+## pooled ssh connection and rsync's own block size.
+##   compress:       None, 'zlib' or 'zstd' (zstd needs rsync 3.2.0 on both
+##                   ends, older rsyncs get zlib)
+##   compress_level: compression level
+##   whole_file:     False uses rsync's delta algorithm against files already
+##                   in the destination
+##   cipher:         ssh cipher for bulk transfers, which then use their own
+##                   connection, e.g. 'aes128-gcm@openssh.com'
+##   block_size:     rsync --block-size for the delta algorithm
+transferProfiles = {
+    'local': {'whole_file': True},
+    'lan':   {'whole_file': True},
+    'wan':   {'compress': 'zstd', 'compress_level': 3, 'whole_file': False, 'block_size': 128 * 1024},
+}
 
+## Transfer profile per site. Sites not listed get 'local' if their write host
+## is the host running cadinstall, 'lan' if it is in the same domain and 'wan'
+## otherwise.
+siteTransferProfile = {
+#    'aus': 'wan',
+#    'yyz': 'lan',
+}
+
+## Files rsync sends uncompressed under a compressing profile
+rsync_skip_compress = 'gz/tgz/bz2/tbz/xz/txz/zst/tzst/zip/jar/7z/rpm/deb/iso/png/jpg/mp4'
+
+## Link bandwidth in bytes/s between sites, used by the replication planner to
+## pick which installed site seeds another. 'origin' is the staged source on the
+## host running cadinstall. Pairs not listed here are measured at install time.
+siteLinkBandwidth = {
+#    ('origin', 'yyz'): 100 * 1000 * 1000,
+#    ('yyz', 'aus'): 50 * 1000 * 1000,
+}
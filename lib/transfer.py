@@ -0,0 +1,595 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Sharded parallel transfer engine for cadinstall
+
+A single rsync builds its file list and copies one file at a time, which
+leaves NFS filers and fast site links mostly idle. For large trees the
+source manifest is split into shards balanced by bytes and file count,
+and one rsync per shard runs at the same time into the same destination,
+each reading its part of the tree from a --files-from list.
+
+    1. skeleton: one rsync of the directories only, so shards never race
+       to create the same parent
+    2. shards:   up to tool_defs.transfer_shards rsyncs at once; a shard
+       that fails is retried on its own, up to tool_defs.transfer_retries
+       times
+    3. skeleton again, to restore the directory times the shards changed
+
+Files of tool_defs.range_transfer_min_bytes or more would hold up whichever
+shard they land in, so in setuid mode they are copied separately in byte
+ranges (dd on each side, piped over ssh for a remote host) alongside the
+shards, into a temporary file next to the destination. Once the hashes of
+the temporary file and the source agree it is given the source's mode and
+mtime and renamed into place.
+
+A brand-new install of a tree of mostly small files skips rsync
+altogether: the manifest's entries are streamed as one tar archive
+(compressed as the site's transfer profile says, for remote hosts) into a
+tar extracting on the write host. The archive carries the same a=rX,u+w
+modes rsync --chmod would set, and the usual permission pass follows.
+
+An install can also be linked against the previous version of the tool
+on the site (link_dest): every rsync gets --link-dest, so unchanged files
+become hard links to it, and --stats, whose counters are summed into an
+account of the bytes that did not have to be copied or stored.
+
+With an install journal (lib/journal.py) the shard plan is kept next to
+the journal, and every shard, big file and byte range is recorded as it
+finishes, so a resumed install reuses the same shards and only sends what
+is missing. Big files keep their temporary file between runs.
+"""
+
+import os
+import re
+import heapq
+import shlex
+import asyncio
+import getpass
+import logging
+
+import lib.tool_defs
+from lib.utils import (run_command, run_command_with_output, run_command_async, format_bytes,
+                       check_same_host, run_batch, batch_step)
+from lib.ssh_pool import rsync_rsh_option, ssh_prefix, transfer_ssh_prefix
+from lib.executor import get_execution_mode
+from lib.probe_cache import current_host
+from lib.remote_agent import get_agent, AgentError
+from lib.verify import HashCache, get_hash_cache, hash_paths
+from lib.transfer_profiles import get_transfer_profile, transfer_rsync_options
+from lib.progress import progress_rsync_options
+
+logger = logging.getLogger('cadinstall')
+
+# Files at least this large are placed first, largest first, so that they
+# spread evenly over the shards; the rest are streamed to the lightest shard
+LARGE_FILE_BYTES = 64 * 1024 * 1024
+
+
+class Shard:
+    """One --files-from list and what it holds."""
+
+    def __init__(self, index, list_path):
+        self.index = index
+        self.list_path = list_path
+        self.files = 0
+        self.bytes = 0
+        self.status = None
+        self.attempts = 0
+        self.output = ''
+
+    def cost(self):
+        # Per-file overhead (open, create, set attributes) dominates small
+        # files on NFS, so every file also counts as file_cost bytes
+        return self.bytes + self.files * lib.tool_defs.transfer_file_cost
+
+
+def _list_prefix(dest_host):
+    return "/tmp/.cadinstall.files.%s.%d.%s" % (getpass.getuser(), os.getpid(), dest_host)
+
+
+def plan_shards(manifest, count, prefix, ranged_min_bytes=None):
+    """
+    Split the non-directory entries of manifest into count shards.
+
+    Writes one NUL separated --files-from list per shard (prefix.<n>) and
+    prefix.dirs with every directory. Files of ranged_min_bytes or more are
+    left out of the shards for a range transfer. Returns (dirs list path,
+    shards, ranged entries); shards that ended up empty are dropped.
+    """
+    shards = [Shard(index, "%s.%d" % (prefix, index)) for index in range(count)]
+    handles = [open(shard.list_path, 'wb') for shard in shards]
+    heap = [(0, shard.index) for shard in shards]
+
+    def place(entry):
+        _, index = heapq.heappop(heap)
+        shard = shards[index]
+        handles[index].write(os.fsencode(entry.path) + b'\0')
+        shard.files += 1
+        shard.bytes += entry.size if entry.type == 'f' else 0
+        heapq.heappush(heap, (shard.cost(), index))
+
+    dirs_path = "%s.dirs" % prefix
+    ranged = []
+    try:
+        large = sorted((entry for entry in manifest.files() if entry.size >= LARGE_FILE_BYTES),
+                       key=lambda entry: entry.size, reverse=True)
+        for entry in large:
+            if ranged_min_bytes and entry.size >= ranged_min_bytes:
+                ranged.append(entry)
+            else:
+                place(entry)
+        with open(dirs_path, 'wb') as dirs:
+            # '.' carries the attributes of the top directory itself
+            dirs.write(b'.\0')
+            for entry in manifest.entries():
+                if entry.type == 'd':
+                    dirs.write(os.fsencode(entry.path) + b'\0')
+                elif entry.type != 'f' or entry.size < LARGE_FILE_BYTES:
+                    place(entry)
+    finally:
+        for handle in handles:
+            handle.close()
+
+    for path in [dirs_path] + [shard.list_path for shard in shards]:
+        # Read by rsync running as cadtools
+        os.chmod(path, 0o644)
+    used = [shard for shard in shards if shard.files]
+    for shard in shards:
+        if not shard.files:
+            os.remove(shard.list_path)
+    return dirs_path, used, ranged
+
+
+# Counters read from rsync --stats. 3.0 says "Number of files transferred".
+_STATS_PATTERNS = {
+    'files': r'^Number of files: [\d,]+ \(reg: ([\d,]+)',
+    'files_transferred': r'^Number of (?:regular )?files transferred: ([\d,]+)',
+    'total_bytes': r'^Total file size: ([\d,]+)',
+    'transferred_bytes': r'^Total transferred file size: ([\d,]+)',
+    'literal_bytes': r'^Literal data: ([\d,]+)',
+    'matched_bytes': r'^Matched data: ([\d,]+)',
+}
+
+
+def parse_rsync_stats(output):
+    """Counters from the --stats summary in rsync output. Missing ones are 0."""
+    stats = {}
+    for name, pattern in _STATS_PATTERNS.items():
+        match = re.search(pattern, output or '', re.MULTILINE)
+        stats[name] = int(match.group(1).replace(',', '')) if match else 0
+    return stats
+
+
+def sum_rsync_stats(outputs):
+    """parse_rsync_stats() over several rsyncs, added up."""
+    total = dict.fromkeys(_STATS_PATTERNS, 0)
+    for output in outputs:
+        for name, value in parse_rsync_stats(output).items():
+            total[name] += value
+    return total
+
+
+def link_dest_options(link_dest):
+    """rsync options that hard link files unchanged since link_dest, or '' without one."""
+    if not link_dest:
+        return ''
+    return "--link-dest=%s --stats" % shlex.quote(link_dest)
+
+
+def log_link_savings(stats, link_dest, dest_host):
+    """
+    Log what linking against link_dest saved. Files rsync did not transfer
+    were hard linked; of the ones it did, matched data came from the
+    previous version's copy through the delta algorithm.
+    """
+    total = stats['total_bytes']
+    linked_files = stats['files'] - stats['files_transferred']
+    linked_bytes = total - stats['transferred_bytes']
+    saved = total - stats['literal_bytes']
+    logger.info("Linked %d unchanged files (%s) to %s on %s; %s of changed files reused, %s sent"
+                % (linked_files, format_bytes(linked_bytes), link_dest, dest_host,
+                   format_bytes(stats['matched_bytes']), format_bytes(stats['literal_bytes'])))
+    logger.info("Saved %s of %s to copy (%d%%) and %s of %s to store (%d%%)"
+                % (format_bytes(saved), format_bytes(total), 100 * saved // total if total else 0,
+                   format_bytes(linked_bytes), format_bytes(total), 100 * linked_bytes // total if total else 0))
+
+
+def rsync_files_from_command(src, dest, dest_host, owner_group, files_from, link_dest=None, progress=False):
+    """
+    rsync of the entries listed in files_from (NUL separated) from src to
+    dest on dest_host. With progress it reports with --info=progress2 if
+    it can (see lib/progress.py).
+    """
+    options = "%s --chown=%s --files-from=%s --from0" % (lib.tool_defs.rsync_options, owner_group, files_from)
+    if link_dest:
+        options += " " + link_dest_options(link_dest)
+    if progress and progress_rsync_options():
+        options += " " + progress_rsync_options()
+    if check_same_host(dest_host) == 0:
+        return "%s %s %s %s/ %s/" % (lib.tool_defs.rsync, options, transfer_rsync_options(dest_host, remote=False),
+                                     src, dest)
+    return "%s %s %s %s %s/ %s:%s/" % (lib.tool_defs.rsync, options, transfer_rsync_options(dest_host),
+                                       rsync_rsh_option(dest_host), src, dest_host, dest)
+
+
+def range_transfer_available(dest_host):
+    """
+    True if big files can be copied in ranges to dest_host: setuid mode, and
+    the remote helper must be running on a remote host to hash the result.
+    """
+    if not lib.tool_defs.range_transfer_min_bytes or get_execution_mode() != 'setuid':
+        return False
+    return check_same_host(dest_host) == 0 or get_agent(dest_host) is not None
+
+
+def split_ranges(size, streams, min_bytes):
+    """Split size bytes into at most streams (offset, length) ranges of at least min_bytes."""
+    count = max(1, min(streams, size // max(min_bytes, 1)))
+    length = -(-size // count)
+    return [(offset, min(length, size - offset)) for offset in range(0, size, length)]
+
+
+def part_path(path):
+    """Temporary name a range transfer writes to, next to path."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, ".%s.cadinstall.part" % name)
+
+
+def dd_range_command(src_file, part, dest_host, offset, length):
+    """Copy length bytes at offset from src_file into the same place in part on dest_host."""
+    dd = lib.tool_defs.dd
+    read = ("%s if=%s iflag=skip_bytes,count_bytes skip=%d count=%d bs=4M status=none"
+            % (dd, shlex.quote(src_file), offset, length))
+    if check_same_host(dest_host) == 0:
+        return ("%s if=%s of=%s iflag=skip_bytes,count_bytes oflag=seek_bytes "
+                "skip=%d seek=%d count=%d bs=4M conv=notrunc status=none"
+                % (dd, shlex.quote(src_file), shlex.quote(part), offset, offset, length))
+    write = ("%s of=%s oflag=seek_bytes seek=%d bs=4M conv=notrunc status=none"
+             % (dd, shlex.quote(part), offset))
+    return "%s | %s %s" % (read, transfer_ssh_prefix(dest_host), shlex.quote(write))
+
+
+def _source_hash(path, entry):
+    cache = get_hash_cache()
+    key = HashCache.key(current_host(), entry.dev, entry.ino, entry.size, entry.mtime)
+    digest = cache.get(key)
+    if digest is None:
+        (digest, error), = hash_paths([path])
+        if digest is None:
+            logger.error("Could not hash %s: %s" % (path, error))
+            return None
+        cache.put(key, digest)
+    return digest
+
+
+def _dest_hash(part, dest_host):
+    if check_same_host(dest_host) == 0:
+        (digest, error), = hash_paths([part])
+    else:
+        try:
+            (digest, error), = get_agent(dest_host).call('hash', root=os.path.dirname(part),
+                                                         paths=[os.path.basename(part)])
+        except AgentError as e:
+            digest, error = None, str(e)
+    if digest is None:
+        logger.error("Could not hash %s on %s: %s" % (part, dest_host, error))
+    return digest
+
+
+def file_key(entry):
+    """How the install journal knows a big file: path, size and mtime."""
+    return "%s:%d:%d" % (entry.path, entry.size, entry.mtime)
+
+
+async def _copy_ranges(entry, src, dest, dest_host, semaphore, journal=None, progress=None):
+    """
+    Copy one big file in ranges, check its hash and move it into place.
+    Returns a status. With a journal, ranges copied by an earlier run are
+    skipped and the temporary file is kept when a range fails. Copied
+    ranges are reported to progress.
+    """
+    src_file = os.path.join(src, entry.path)
+    final = os.path.join(dest, entry.path)
+    part = part_path(final)
+    key = file_key(entry)
+    ranges = split_ranges(entry.size, lib.tool_defs.range_transfer_streams, LARGE_FILE_BYTES)
+    done = journal.ranges_done(key) if journal is not None else set()
+    logger.info("Copying %s (%s) to %s in %d ranges%s"
+                % (entry.path, format_bytes(entry.size), dest_host, len(ranges),
+                   " (%d copied by the previous run)" % len(done) if done else ''))
+
+    source_hash = asyncio.ensure_future(asyncio.to_thread(_source_hash, src_file, entry))
+    statuses = dict((offset, 0 if offset in done else None) for offset, _ in ranges)
+
+    async def copy_range(offset, length):
+        async with semaphore:
+            statuses[offset], _ = await run_command_async(
+                dd_range_command(src_file, part, dest_host, offset, length), log_stdout=False)
+        if statuses[offset] == 0 and journal is not None:
+            journal.mark_range(key, offset)
+        if statuses[offset] == 0 and progress is not None:
+            progress.add(('file', entry.path), length)
+
+    pending = [(offset, length) for offset, length in ranges if offset not in done]
+    for attempt in range(lib.tool_defs.transfer_retries + 1):
+        await asyncio.gather(*(copy_range(offset, length) for offset, length in pending))
+        pending = [(offset, length) for offset, length in ranges if statuses[offset] != 0]
+        if not pending:
+            break
+        logger.warning("%d range(s) of %s failed (attempt %d)" % (len(pending), entry.path, attempt + 1))
+
+    expected = await source_hash
+    if pending:
+        status = statuses[pending[0][0]]
+    else:
+        digest = await asyncio.to_thread(_dest_hash, part, dest_host)
+        status = 0 if digest is not None and digest == expected else 1
+        if digest is not None and digest != expected:
+            logger.error("Checksum mismatch after copying %s to %s" % (entry.path, dest_host))
+            if journal is not None:
+                journal.reset_ranges(key)
+            journal = None
+
+    if status != 0:
+        if journal is None:
+            await asyncio.to_thread(run_batch, dest_host, [batch_step("/usr/bin/rm -f %s" % shlex.quote(part))])
+        return status
+
+    mode = 0o755 if entry.mode & 0o111 else 0o644
+    mtime = "@%d.%09d" % divmod(entry.mtime, 1000000000)
+    results = await asyncio.to_thread(run_batch, dest_host, [
+        batch_step("/usr/bin/chmod %o %s" % (mode, shlex.quote(part))),
+        batch_step("/usr/bin/touch -m -d %s %s" % (mtime, shlex.quote(part))),
+        batch_step("/usr/bin/mv -f %s %s" % (shlex.quote(part), shlex.quote(final))),
+    ])
+    for result in results:
+        if result['status'] != 0:
+            logger.error("Could not move %s into place on %s" % (final, dest_host))
+            return result['status'] if result['status'] is not None else 1
+    if journal is not None:
+        journal.mark_file(key)
+    if progress is not None:
+        progress.complete(('file', entry.path), entry.size, 1)
+    logger.info("Copied %s to %s" % (entry.path, dest_host))
+    return 0
+
+
+def use_sharded_transfer(manifest):
+    """True if the tree is big enough for a sharded transfer to pay off."""
+    return (lib.tool_defs.transfer_shards > 1
+            and manifest.size >= lib.tool_defs.transfer_shard_min_bytes)
+
+
+def use_tar_stream(manifest):
+    """True for trees of mostly small files, where rsync's per-file work costs the most."""
+    files = manifest.totals.files
+    if not lib.tool_defs.tar_stream_min_files or files < lib.tool_defs.tar_stream_min_files:
+        return False
+    return manifest.totals.apparent_bytes // files <= lib.tool_defs.tar_stream_max_average_bytes
+
+
+def _remote(command, dest_host):
+    if check_same_host(dest_host) == 0:
+        return command
+    return "%s %s" % (ssh_prefix(dest_host), shlex.quote(command))
+
+
+def _find_in_dest(dest, dest_host, action):
+    """Run find over dest, skipping .cadinstall.metadata. Returns (status, output)."""
+    command = "/usr/bin/find %s -mindepth 1 ! -path %s %s" % (
+        shlex.quote(dest), shlex.quote(dest + '/.cadinstall.metadata'), action)
+    return run_command_with_output(_remote(command, dest_host), log_stdout=False, force_run=True)
+
+
+def destination_is_empty(dest, dest_host):
+    """True if dest exists and holds nothing but .cadinstall.metadata."""
+    status, output = _find_in_dest(dest, dest_host, "-print -quit")
+    return status == 0 and not output.strip()
+
+
+def tar_stream_command(src, dest, dest_host, files_from):
+    """tar of the entries in files_from piped into a tar extracting in dest on dest_host."""
+    compress = get_transfer_profile(dest_host).tar_compress() if check_same_host(dest_host) != 0 else None
+    tar = lib.tool_defs.tar
+    create = ("%s -C %s --null --no-recursion -T %s --mode=%s%s -cf -"
+              % (tar, shlex.quote(src), files_from, 'a=rX,u+w',
+                 " -I %s" % shlex.quote(compress) if compress else ''))
+    if check_same_host(dest_host) == 0:
+        return "%s | %s -C %s -xpf -" % (create, tar, shlex.quote(dest))
+    extract = "%s -C %s%s -xpf -" % (tar, shlex.quote(dest), " -I %s" % shlex.quote(compress) if compress else '')
+    return "%s | %s %s" % (create, transfer_ssh_prefix(dest_host), shlex.quote(extract))
+
+
+def tar_stream_transfer(manifest, src, dest, dest_host, progress=None):
+    """
+    Copy the tree in manifest from src into the empty dest on dest_host as one
+    tar stream. Returns 0 once every entry has arrived.
+    """
+    list_path = "%s.tar" % _list_prefix(dest_host)
+    expected = 0
+    files = 0
+    with open(list_path, 'wb') as f:
+        for entry in manifest.entries():
+            # ./ keeps names that start with '-' from being read as options
+            f.write(b'./' + os.fsencode(entry.path) + b'\0')
+            expected += 1
+            if entry.type != 'd':
+                files += 1
+    os.chmod(list_path, 0o644)
+
+    try:
+        logger.info("Copying %d entries (%s) to %s as one tar stream"
+                    % (expected, format_bytes(manifest.totals.apparent_bytes), dest_host))
+        status = run_command(tar_stream_command(src, dest, dest_host, list_path))
+    finally:
+        os.remove(list_path)
+    if status != 0:
+        return status
+
+    # Only the status of the extracting tar comes back through the pipe, so
+    # make sure everything arrived
+    status, output = _find_in_dest(dest, dest_host, "-printf x")
+    found = len(output.replace('\n', ''))
+    if status != 0 or found != expected:
+        logger.error("The tar stream to %s delivered %d of %d entries" % (dest_host, found, expected))
+        return status or 1
+    if progress is not None:
+        progress.complete('tar', manifest.totals.apparent_bytes, files)
+    return 0
+
+
+async def _run_shards(shards, commands, workers, totals, ranged=(), range_args=(), journal=None, progress=None):
+    semaphore = asyncio.Semaphore(workers)
+    done = {'shards': 0, 'files': 0, 'bytes': 0}
+
+    async def run_one(shard):
+        key = ('shard', shard.index)
+        async with semaphore:
+            shard.attempts += 1
+            on_stdout = progress.rsync_output(key) if progress is not None else None
+            shard.status, shard.output = await run_command_async(commands[shard.index], on_stdout=on_stdout)
+        if shard.status == 0:
+            if journal is not None:
+                journal.mark_shard(shard.index)
+            if progress is not None:
+                progress.complete(key, shard.bytes, shard.files)
+            done['shards'] += 1
+            done['files'] += shard.files
+            done['bytes'] += shard.bytes
+            logger.info("Shard %d done: %d/%d shards, %d/%d files, %s/%s"
+                        % (shard.index, done['shards'], len(shards), done['files'], totals['files'],
+                           format_bytes(done['bytes']), format_bytes(totals['bytes'])))
+        else:
+            logger.warning("Shard %d failed with status %d (attempt %d)" % (shard.index, shard.status, shard.attempts))
+
+    async def run_shards():
+        pending = list(shards)
+        while pending:
+            await asyncio.gather(*(run_one(shard) for shard in pending))
+            pending = [shard for shard in pending
+                       if shard.status != 0 and shard.attempts <= lib.tool_defs.transfer_retries]
+            if pending:
+                logger.info("Retrying %d failed shard(s): %s"
+                            % (len(pending), ', '.join(str(shard.index) for shard in pending)))
+
+    # Big files share the worker slots with the shards
+    results = await asyncio.gather(run_shards(), *(_copy_ranges(entry, *range_args, semaphore, journal=journal,
+                                                                progress=progress)
+                                                   for entry in ranged))
+    return results[1:]
+
+
+def _restore_plan(manifest, prefix, plan):
+    """The shards and big files of a plan saved in an install journal, or None if its lists are gone."""
+    dirs_path = "%s.dirs" % prefix
+    shards = []
+    for index, files, size in plan['shards']:
+        shard = Shard(index, "%s.%d" % (prefix, index))
+        shard.files, shard.bytes = files, size
+        shards.append(shard)
+    if not all(os.path.exists(path) for path in [dirs_path] + [shard.list_path for shard in shards]):
+        return None
+    ranged_paths = set(plan['ranged'])
+    ranged = [entry for entry in manifest.files() if entry.path in ranged_paths] if ranged_paths else []
+    return dirs_path, shards, ranged
+
+
+def sharded_transfer(manifest, src, dest, dest_host, owner_group, shards=None, link_dest=None, journal=None,
+                     progress=None):
+    """
+    Copy the tree in manifest from src to dest on dest_host with parallel rsyncs.
+
+    With link_dest, files unchanged since that tree on dest_host are hard
+    linked to it. Big files then go through rsync like the rest, so they
+    can be linked too. With an install journal, shards and big files it
+    records as copied are skipped and new ones are recorded. Shards and big
+    files report to progress (a TransferProgress) as they copy.
+
+    Returns 0 if every shard was copied, otherwise the status of the first
+    shard that still failed after its retries.
+    """
+    count = shards or lib.tool_defs.transfer_shards
+    ranged_min_bytes = None
+    if not link_dest and range_transfer_available(dest_host):
+        ranged_min_bytes = lib.tool_defs.range_transfer_min_bytes
+
+    # A journal keeps the plan, so a resumed install uses the same shards
+    restored = None
+    if journal is not None:
+        prefix = journal.plan_prefix
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        signature = [manifest.totals.files, manifest.totals.apparent_bytes, count, ranged_min_bytes]
+        plan = journal.saved_plan(signature)
+        restored = _restore_plan(manifest, prefix, plan) if plan else None
+    else:
+        prefix = _list_prefix(dest_host)
+    if restored:
+        dirs_path, planned, ranged = restored
+    else:
+        dirs_path, planned, ranged = plan_shards(manifest, count, prefix, ranged_min_bytes=ranged_min_bytes)
+        if journal is not None:
+            journal.save_plan(signature, [[shard.index, shard.files, shard.bytes] for shard in planned],
+                              [entry.path for entry in ranged])
+    try:
+        copied = []
+        if journal is not None:
+            copied = [shard for shard in planned if journal.shard_done(shard.index)]
+            for shard in copied:
+                shard.status = 0
+            ranged = [entry for entry in ranged if not journal.file_done(file_key(entry))]
+            if copied:
+                logger.info("Skipping %d of %d shards copied to %s by the previous run"
+                            % (len(copied), len(planned), dest_host))
+        todo = [shard for shard in planned if shard not in copied]
+        totals = {'files': sum(shard.files for shard in todo), 'bytes': sum(shard.bytes for shard in todo)}
+        logger.info("Copying %d entries (%s) to %s in %d parallel shards"
+                    % (totals['files'], format_bytes(totals['bytes']), dest_host, len(todo)))
+        if ranged:
+            logger.info("Copying %d large file(s) (%s) in parallel ranges"
+                        % (len(ranged), format_bytes(sum(entry.size for entry in ranged))))
+        for shard in planned:
+            logger.debug("Shard %d: %d entries, %s" % (shard.index, shard.files, format_bytes(shard.bytes)))
+        skeleton_output = None
+        if progress is not None:
+            # Measured against what this run has to copy
+            progress.total_bytes = totals['bytes'] + sum(entry.size for entry in ranged)
+            progress.total_files = totals['files'] + len(ranged)
+            skeleton_output = progress.rsync_output('skeleton')
+
+        skeleton = rsync_files_from_command(src, dest, dest_host, owner_group, dirs_path)
+        status = run_command(skeleton, on_stdout=skeleton_output)
+        if status != 0:
+            logger.error("Failed to create the directory tree in %s on %s" % (dest, dest_host))
+            return status
+
+        commands = dict((shard.index, rsync_files_from_command(src, dest, dest_host, owner_group, shard.list_path,
+                                                               link_dest=link_dest, progress=progress is not None))
+                        for shard in todo)
+        range_statuses = asyncio.run(_run_shards(todo, commands, count, totals, ranged=ranged,
+                                                 range_args=(src, dest, dest_host), journal=journal,
+                                                 progress=progress))
+        failed = [shard for shard in planned if shard.status != 0]
+        if failed:
+            logger.error("%d of %d shard(s) failed to copy to %s: %s"
+                         % (len(failed), len(planned), dest_host, ', '.join(str(shard.index) for shard in failed)))
+            return failed[0].status
+        failed = [(entry, status) for entry, status in zip(ranged, range_statuses) if status != 0]
+        if failed:
+            logger.error("%d large file(s) failed to copy to %s: %s"
+                         % (len(failed), dest_host, ', '.join(entry.path for entry, _ in failed)))
+            return failed[0][1]
+        if link_dest:
+            log_link_savings(sum_rsync_stats(shard.output for shard in todo), link_dest, dest_host)
+
+        # Creating files in the shards changed the directory times
+        return run_command(skeleton, on_stdout=skeleton_output)
+    finally:
+        # A journal keeps its lists until the install has finished
+        lists = [] if journal is not None else [dirs_path] + [shard.list_path for shard in planned]
+        for path in lists:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Per-site transfer profiles for cadinstall
+
+The best way to move a tree depends on where the write host is: a copy
+on this host wants no compression and whole files, a copy inside the
+datacenter is limited by the disks, and a copy across the WAN is limited
+by the link and gains from compression and rsync's delta algorithm.
+
+Profiles are defined in tool_defs.transferProfiles and picked per site
+with tool_defs.siteTransferProfile. Sites without an entry get 'local'
+when their write host is this host, 'lan' when it is in this host's domain
+and 'wan' otherwise.
+"""
+
+import re
+import logging
+import threading
+import subprocess
+
+import lib.tool_defs
+from lib.probe_cache import current_host, cached_probe
+
+logger = logging.getLogger('cadinstall')
+
+# rsync can negotiate zstd (--compress-choice) from this version on
+ZSTD_RSYNC_VERSION = (3, 2, 0)
+
+DEFAULTS = {
+    'compress': None,       # None, 'zlib' or 'zstd'
+    'compress_level': None,
+    'whole_file': True,     # False uses rsync's delta algorithm
+    'cipher': None,         # ssh cipher for bulk transfers, e.g. aes128-gcm@openssh.com
+    'block_size': None,     # rsync --block-size for the delta algorithm
+}
+
+
+class TransferProfile:
+    """Named transfer settings, filled in from DEFAULTS."""
+
+    def __init__(self, name, settings):
+        unknown = set(settings) - set(DEFAULTS)
+        if unknown:
+            raise ValueError("unknown setting(s) in transfer profile %s: %s" % (name, ', '.join(sorted(unknown))))
+        self.name = name
+        for field, default in DEFAULTS.items():
+            setattr(self, field, settings.get(field, default))
+
+    def describe(self):
+        parts = []
+        if self.compress:
+            parts.append("%s compression%s" % (self.compress, " level %d" % self.compress_level
+                                               if self.compress_level is not None else ''))
+        else:
+            parts.append("no compression")
+        parts.append("whole files" if self.whole_file else "delta transfer")
+        if self.block_size:
+            parts.append("block size %d" % self.block_size)
+        if self.cipher:
+            parts.append("cipher %s" % self.cipher)
+        return ', '.join(parts)
+
+    def rsync_options(self, zstd_supported=True):
+        """rsync options for this profile. zstd falls back to zlib when not supported."""
+        options = ["--whole-file" if self.whole_file else "--no-whole-file"]
+        if self.compress:
+            compress = self.compress
+            if compress == 'zstd' and not zstd_supported:
+                compress = 'zlib'
+            options.append("--compress")
+            if compress == 'zstd':
+                options.append("--compress-choice=zstd")
+            if self.compress_level is not None:
+                options.append("--compress-level=%d" % self.compress_level)
+            options.append("--skip-compress=%s" % lib.tool_defs.rsync_skip_compress)
+        if self.block_size and not self.whole_file:
+            options.append("--block-size=%d" % self.block_size)
+        return ' '.join(options)
+
+    def tar_compress(self):
+        """Compression program for a tar stream with this profile, or None."""
+        if self.compress == 'zstd':
+            return "zstd -T0 -%d" % (self.compress_level or 3)
+        if self.compress == 'zlib':
+            return "gzip -%d" % (self.compress_level or 6)
+        return None
+
+
+def _site_for_host(host):
+    for site, site_host in lib.tool_defs.siteHash.items():
+        if site_host.lower() == host.lower():
+            return site
+    return None
+
+
+def _auto_profile_name(host):
+    this_host = current_host().lower()
+    host = host.lower()
+    if host == this_host:
+        return 'local'
+    if this_host.split('.')[1:2] == host.split('.')[1:2]:
+        return 'lan'
+    return 'wan'
+
+
+_selected = {}  # host -> TransferProfile
+_lock = threading.Lock()
+
+
+def get_transfer_profile(host):
+    """Return the TransferProfile for transfers to host, logging the choice once per host."""
+    key = host.lower()
+    with _lock:
+        if key in _selected:
+            return _selected[key]
+
+    site = _site_for_host(host)
+    name = lib.tool_defs.siteTransferProfile.get(site) if site else None
+    how = "configured"
+    if name is None:
+        name, how = _auto_profile_name(host), "automatic"
+    if name not in lib.tool_defs.transferProfiles:
+        logger.warning("Unknown transfer profile '%s' for %s, using automatic selection" % (name, site or host))
+        name, how = _auto_profile_name(host), "automatic"
+    profile = TransferProfile(name, lib.tool_defs.transferProfiles[name])
+    logger.info("Transfer profile for %s: %s (%s) - %s" % (site or host, name, how, profile.describe()))
+
+    with _lock:
+        _selected[key] = profile
+    return profile
+
+
+def parse_rsync_version(output):
+    """(major, minor, patch) from rsync --version output, or None."""
+    match = re.search(r'version\s+(\d+)\.(\d+)\.(\d+)', output or '')
+    if not match:
+        return None
+    return tuple(int(part) for part in match.groups())
+
+
+def rsync_version(host=None):
+    """rsync version on host (None for this host), looked up once per run. None if unknown."""
+    from lib.utils import run_command_with_output
+    from lib.ssh_pool import ssh_prefix
+
+    def probe():
+        if host is None:
+            try:
+                result = subprocess.run([lib.tool_defs.rsync, '--version'], stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, universal_newlines=True, timeout=30)
+            except (OSError, subprocess.SubprocessError):
+                return None
+            return parse_rsync_version(result.stdout)
+        status, output = run_command_with_output("%s %s --version" % (ssh_prefix(host), lib.tool_defs.rsync),
+                                                 log_stderr=False, log_stdout=False, force_run=True)
+        return parse_rsync_version(output) if status == 0 else None
+
+    return cached_probe(host or current_host(), 'rsync-version', lib.tool_defs.rsync, probe)
+
+
+def transfer_rsync_options(host, remote=True):
+    """
+    rsync options for the transfer profile of host. zstd compression is only
+    asked for when rsync on both ends is new enough to negotiate it.
+    """
+    profile = get_transfer_profile(host)
+    zstd_supported = True
+    if profile.compress == 'zstd':
+        versions = [rsync_version()] + ([rsync_version(host)] if remote else [])
+        zstd_supported = all(version is not None and version >= ZSTD_RSYNC_VERSION for version in versions)
+        if not zstd_supported:
+            logger.info("rsync on %s cannot negotiate zstd, using zlib compression" % host)
+    return profile.rsync_options(zstd_supported)
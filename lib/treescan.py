@@ -0,0 +1,269 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Source tree scanner for cadinstall
+
+Walks a tree with os.scandir, many directories at a time, to size it
+before an install. Compared to du -sb it:
+
+- keeps many NFS directory reads in flight instead of one,
+- counts hardlinked files once, by (dev, inode),
+- reports apparent size and allocated blocks separately,
+- skips what etc/rsync_exclude_list.txt excludes, so the total matches
+  what rsync will actually copy.
+"""
+
+import os
+import re
+import stat
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import lib.tool_defs
+
+logger = logging.getLogger('cadinstall')
+
+
+class ExcludeRule:
+    """
+    One rsync exclude pattern.
+
+    Follows rsync's rules for the patterns cadinstall uses: '*' and '?' do
+    not match '/', '**' does; a leading '/' anchors the pattern to the top
+    of the tree; a trailing '/' only matches directories; otherwise the
+    pattern matches the end of the path at a component boundary (so a
+    pattern without '/' matches the name alone).
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        anchored = pattern.startswith('/')
+        pattern = pattern.lstrip('/')
+        # Patterns without a '/' only ever look at the last path component
+        self.name_only = not anchored and '/' not in pattern and '**' not in pattern
+        if self.name_only:
+            self.expression = _translate(pattern)
+        else:
+            self.expression = ('^' if anchored else '(?:^|/)') + _translate(pattern)
+
+    def matches(self, rel_path, is_dir):
+        return ExcludeList([self]).matches(rel_path, is_dir)
+
+
+class ExcludeList:
+    """A set of ExcludeRules compiled into a few combined regular expressions."""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+
+        def combine(selected, template):
+            if not selected:
+                return None
+            return re.compile(template % '|'.join('(?:%s)' % rule.expression for rule in selected))
+
+        self._name_any = combine([r for r in self.rules if r.name_only and not r.dir_only], '^(?:%s)$')
+        self._name_dir = combine([r for r in self.rules if r.name_only and r.dir_only], '^(?:%s)$')
+        self._path_any = combine([r for r in self.rules if not r.name_only and not r.dir_only], '(?:%s)$')
+        self._path_dir = combine([r for r in self.rules if not r.name_only and r.dir_only], '(?:%s)$')
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def matches(self, rel_path, is_dir):
+        name = rel_path.rsplit('/', 1)[-1]
+        if self._name_any is not None and self._name_any.match(name):
+            return True
+        if self._path_any is not None and self._path_any.search(rel_path):
+            return True
+        if is_dir:
+            if self._name_dir is not None and self._name_dir.match(name):
+                return True
+            if self._path_dir is not None and self._path_dir.search(rel_path):
+                return True
+        return False
+
+
+def _translate(pattern):
+    """Translate an rsync wildcard pattern to a regular expression."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '*':
+            if pattern[i:i + 2] == '**':
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif char == '?':
+            out.append('[^/]')
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end < 0:
+                out.append(re.escape(char))
+            else:
+                chars = pattern[i + 1:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                out.append('[%s]' % chars.replace('\\', '\\\\'))
+                i = end + 1
+                continue
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return ''.join(out)
+
+
+def load_exclude_rules(path=None):
+    """Read an rsync --exclude-from file (default: etc/rsync_exclude_list.txt)."""
+    path = path or lib.tool_defs.rsync_exclude_file
+    rules = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+            if line.startswith('+ '):
+                logger.debug("Ignoring include rule in %s: %s" % (path, line))
+                continue
+            if line.startswith('- '):
+                line = line[2:]
+            rules.append(ExcludeRule(line))
+    return ExcludeList(rules)
+
+
+class TreeScan:
+    """Totals for a scanned tree. Hardlinked files count once in the byte totals."""
+
+    def __init__(self, root=None):
+        self.root = root
+        self.files = 0
+        self.dirs = 0
+        self.symlinks = 0
+        self.others = 0
+        self.hardlinks = 0        # extra links to a file that was already counted
+        self.excluded = 0
+        self.apparent_bytes = 0   # sum of st_size, as du -b
+        self.allocated_bytes = 0  # sum of st_blocks * 512, as du
+        self.errors = []
+
+    def add(self, other):
+        self.files += other.files
+        self.dirs += other.dirs
+        self.symlinks += other.symlinks
+        self.others += other.others
+        self.hardlinks += other.hardlinks
+        self.excluded += other.excluded
+        self.apparent_bytes += other.apparent_bytes
+        self.allocated_bytes += other.allocated_bytes
+        self.errors.extend(other.errors)
+
+    @property
+    def size(self):
+        """
+        Bytes the tree needs at the destination: the larger of the apparent
+        and allocated totals. rsync writes sparse files out in full, and
+        small files take a whole block.
+        """
+        return max(self.apparent_bytes, self.allocated_bytes)
+
+
+def _scan_directory(path, rel, rules, collect=False):
+    """
+    Scan one directory. Returns (subdirs, totals, linked, entries) where
+    linked lists ((dev, ino), size, allocated) for files with more than one
+    link so the caller can count each inode once, and entries lists
+    (rel_path, stat_result) for every entry kept if collect is set.
+    """
+    totals = TreeScan()
+    subdirs = []
+    linked = []
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                child_rel = "%s/%s" % (rel, entry.name) if rel else entry.name
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError as e:
+                    totals.errors.append("%s: %s" % (entry.path, e))
+                    continue
+                is_dir = stat.S_ISDIR(st.st_mode)
+                if rules and rules.matches(child_rel, is_dir):
+                    totals.excluded += 1
+                    continue
+                if collect:
+                    entries.append((child_rel, st))
+
+                allocated = st.st_blocks * 512
+                if is_dir:
+                    totals.dirs += 1
+                    totals.allocated_bytes += allocated
+                    subdirs.append((entry.path, child_rel))
+                elif stat.S_ISREG(st.st_mode):
+                    totals.files += 1
+                    if st.st_nlink > 1:
+                        linked.append(((st.st_dev, st.st_ino), st.st_size, allocated))
+                    else:
+                        totals.apparent_bytes += st.st_size
+                        totals.allocated_bytes += allocated
+                elif stat.S_ISLNK(st.st_mode):
+                    totals.symlinks += 1
+                    totals.apparent_bytes += st.st_size
+                    totals.allocated_bytes += allocated
+                else:
+                    totals.others += 1
+    except OSError as e:
+        totals.errors.append("%s: %s" % (path, e))
+    return subdirs, totals, linked, entries
+
+
+def scan_tree(root, rules=None, workers=None, on_entries=None):
+    """
+    Scan the tree under root and return a TreeScan.
+
+    Args:
+        root:    Directory to scan (the rsync source).
+        rules:   ExcludeList; defaults to etc/rsync_exclude_list.txt.
+                 Pass an empty list to count everything.
+        workers: Directories scanned at once (default tool_defs.treescan_workers).
+        on_entries: Optional callable given each directory's list of
+                 (rel_path, stat_result), on the calling thread.
+    """
+    if rules is None:
+        rules = load_exclude_rules()
+    elif not isinstance(rules, ExcludeList):
+        rules = ExcludeList(rules)
+    workers = workers or lib.tool_defs.treescan_workers
+
+    result = TreeScan(root)
+    seen_inodes = set()
+    collect = on_entries is not None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan_directory, root, '', rules, collect)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, totals, linked, entries = future.result()
+                result.add(totals)
+                if entries:
+                    on_entries(entries)
+                for key, size, allocated in linked:
+                    if key in seen_inodes:
+                        result.hardlinks += 1
+                        continue
+                    seen_inodes.add(key)
+                    result.apparent_bytes += size
+                    result.allocated_bytes += allocated
+                for subdir, rel in subdirs:
+                    pending.add(pool.submit(_scan_directory, subdir, rel, rules, collect))
+
+    logger.debug("Scanned %s: %d files, %d dirs, %d symlinks, %d excluded, %d extra hardlinks, "
+                 "%d apparent bytes, %d allocated bytes"
+                 % (root, result.files, result.dirs, result.symlinks, result.excluded,
+                    result.hardlinks, result.apparent_bytes, result.allocated_bytes))
+    return result
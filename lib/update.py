@@ -0,0 +1,336 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+In-place updates for cadinstall
+
+A vendor hotfix usually changes a handful of files in a large installed
+tree. The update subcommand patches the installed version instead of
+deleting and reinstalling it:
+
+    1. diff:        the source manifest is compared with the installed tree
+                    through lstat on the write host (the remote helper for
+                    a remote host). As in rsync's quick check, a file has
+                    changed if its type, size or mtime (to the second)
+                    differs, and a symlink if its type or length does
+    2. copy:        one rsync of just the new and changed entries
+    3. delete:      optionally, an rsync that copies nothing removes the
+                    installed entries that are no longer in the source.
+                    Only the user who made a completed install may do
+                    this: a dry run lists what would go, and the user
+                    must type DELETE before anything is copied or removed
+    4. permissions: the install policy is applied to the copied entries only
+    5. metadata:    an update record is appended to .cadinstall.metadata
+"""
+
+import os
+import re
+import getpass
+import logging
+from datetime import datetime
+
+import lib.tool_defs
+import lib.my_globals
+from lib.utils import run_command, run_command_with_output, check_same_host, format_bytes
+from lib.manifest import get_manifest
+from lib.probe_cache import invalidate_probes
+from lib.remote_agent import get_agent, AgentError
+from lib.remote_agent_main import op_lstat_many
+from lib.ssh_pool import rsync_rsh_option
+from lib.transfer import rsync_files_from_command
+from lib.progress import TransferProgress
+from lib.install import shell_owner_group, apply_install_permissions, read_metadata, append_update_record
+
+logger = logging.getLogger('cadinstall')
+
+# Entries compared per round trip to a site's write host
+BATCH_SIZE = 2000
+
+# Entries listed in full before the rest are summarized
+MAX_LISTED = 50
+
+NS_PER_SECOND = 1000000000
+
+
+class UpdatePlan:
+    """What an update of one installed tree has to do."""
+
+    def __init__(self, dest, dest_host):
+        self.dest = dest
+        self.dest_host = dest_host
+        self.checked = 0
+        self.added = []    # source entries missing from the installed tree
+        self.changed = []  # source entries that differ from the installed ones
+        self.removed = []  # installed paths no longer in the source (set by the delete pass)
+
+    def paths(self):
+        """The entries to copy, relative to dest."""
+        return [entry.path for entry in self.added + self.changed]
+
+    def bytes(self):
+        return sum(entry.size for entry in self.added + self.changed if entry.type == 'f')
+
+    def summary(self):
+        summary = "%d added, %d changed (%s)" % (len(self.added), len(self.changed), format_bytes(self.bytes()))
+        if self.removed:
+            summary += ", %d removed" % len(self.removed)
+        return summary
+
+    def log(self):
+        listed = [('new', entry.path) for entry in self.added] + [('changed', entry.path) for entry in self.changed]
+        for change, rel in listed[:MAX_LISTED]:
+            logger.info("  %s: %s/%s" % (change, self.dest, rel))
+        if len(listed) > MAX_LISTED:
+            logger.info("  ... and %d more" % (len(listed) - MAX_LISTED))
+        logger.info("Compared %d entries of %s on %s with the source: %s"
+                    % (self.checked, self.dest, self.dest_host, self.summary()))
+
+
+def entry_changed(entry, found, target=None):
+    """
+    True if the installed entry found ([type, size, dev, ino, mtime_ns,
+    target] from lstat_many with readlink) differs from entry. target is
+    where the source symlink points, if entry is one.
+    """
+    kind, size, _, _, mtime = found[:5]
+    if kind != entry.type:
+        return True
+    if kind == 'f':
+        return size != entry.size or mtime // NS_PER_SECOND != entry.mtime // NS_PER_SECOND
+    if kind == 'l':
+        # A retargeted link can keep its length, so compare the targets too
+        return size != entry.size or (target is not None and found[5] != target)
+    return False
+
+
+def _link_target(src, rel):
+    try:
+        return os.readlink(os.path.join(src, rel))
+    except OSError:
+        return None
+
+
+def plan_update(manifest, dest, dest_host, agent=None):
+    """
+    Compare every entry of manifest with the installed tree dest; symlink
+    targets are compared with the source tree at manifest.root. Returns an
+    UpdatePlan.
+    """
+    plan = UpdatePlan(dest, dest_host)
+
+    def compare(batch):
+        paths = [entry.path for entry in batch]
+        if agent is not None:
+            stats = agent.call('lstat_many', root=dest, paths=paths, readlink=True)
+        else:
+            stats = op_lstat_many(dest, paths, readlink=True)
+        for entry, found in zip(batch, stats):
+            plan.checked += 1
+            target = _link_target(manifest.root, entry.path) if entry.type == 'l' else None
+            if found is None:
+                plan.added.append(entry)
+            elif entry_changed(entry, found, target):
+                plan.changed.append(entry)
+
+    batch = []
+    for entry in manifest.entries():
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            compare(batch)
+            batch = []
+    if batch:
+        compare(batch)
+    return plan
+
+
+def copy_changes(plan, src, owner_group):
+    """rsync the new and changed entries of plan from src. Returns the rsync status."""
+    list_path = "/tmp/.cadinstall.update.%s.%d.%s" % (getpass.getuser(), os.getpid(), plan.dest_host)
+    with open(list_path, 'wb') as f:
+        for rel in plan.paths():
+            f.write(os.fsencode(rel) + b'\0')
+    # Read by rsync running as cadtools
+    os.chmod(list_path, 0o644)
+    progress = TransferProgress(plan.dest, plan.dest_host, plan.bytes(), len(plan.paths()))
+    try:
+        status = run_command(rsync_files_from_command(src, plan.dest, plan.dest_host, owner_group, list_path,
+                                                      progress=True),
+                             on_stdout=progress.rsync_output('rsync'))
+    finally:
+        os.remove(list_path)
+    invalidate_probes(plan.dest_host, plan.dest)
+    if status == 0:
+        progress.finish()
+    return status
+
+
+def delete_command(src, dest, dest_host, dry_run=False):
+    """
+    rsync that deletes the entries of dest that are not in src and copies
+    nothing (--existing with --ignore-existing). Entries the rsync exclude
+    list keeps out of installs, the metadata file and rsync's partial
+    directories are left alone. Without -p/-t the remaining entries are
+    not touched either. With dry_run, or in pretend mode, it is a dry run.
+    """
+    options = ("-rlD --delete --existing --ignore-existing --itemize-changes --exclude-from=%s "
+               "--exclude=/.cadinstall.metadata --exclude=%s"
+               % (lib.tool_defs.rsync_exclude_file, lib.tool_defs.rsync_partial_dir))
+    if dry_run or lib.my_globals.get_pretend():
+        options += " --dry-run"
+    if check_same_host(dest_host) == 0:
+        return "%s %s %s/ %s/" % (lib.tool_defs.rsync, options, src, dest)
+    return "%s %s %s %s/ %s:%s/" % (lib.tool_defs.rsync, options, rsync_rsh_option(dest_host), src, dest_host, dest)
+
+
+def delete_removed(src, dest, dest_host, dry_run=False):
+    """
+    Remove the entries of dest on dest_host that are gone from src. With
+    dry_run only list them. Returns (status, removed paths).
+    """
+    status, output = run_command_with_output(delete_command(src, dest, dest_host, dry_run), log_stdout=False,
+                                             force_run=True)
+    removed = [match.group(1) for match in re.finditer(r'^\*deleting\s+(.*?)/?$', output, re.MULTILINE)]
+    if not dry_run:
+        invalidate_probes(dest_host, dest)
+    return status, removed
+
+
+def _log_removed(removed, dest, verb):
+    for rel in removed[:MAX_LISTED]:
+        logger.info("  %s: %s/%s" % (verb, dest, rel))
+    if len(removed) > MAX_LISTED:
+        logger.info("  ... and %d more" % (len(removed) - MAX_LISTED))
+
+
+def installed_by(metadata):
+    """The user a .cadinstall.metadata file records as the installer, or None."""
+    match = re.search(r'^Installed by:\s*(\S+)', metadata, re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def confirm_delete(removed, dest, dest_host):
+    """Ask the user to type DELETE before removing the listed entries. Returns True if they did."""
+    logger.info("")
+    logger.info("=" * 70)
+    logger.info("WARNING: --delete will permanently remove the %d entries listed above from:" % len(removed))
+    logger.info("  %s on %s" % (dest, dest_host))
+    logger.info("")
+    logger.info("Type DELETE (all caps) to confirm: ")
+    logger.info("=" * 70)
+
+    try:
+        confirmation = input("Confirm removal by typing DELETE: ")
+    except (EOFError, KeyboardInterrupt):
+        logger.error("Update cancelled.")
+        return False
+    if confirmation != "DELETE":
+        logger.error("Confirmation failed. You typed '%s' instead of 'DELETE'." % confirmation)
+        logger.error("Update cancelled. Nothing was changed on %s." % dest_host)
+        return False
+    logger.info("Confirmation accepted.")
+    return True
+
+
+def install_completed(metadata):
+    """True if metadata (a .cadinstall.metadata file) records a finished install."""
+    return bool(re.search(r'^(Install completed on|Installed on):', metadata, re.MULTILINE))
+
+
+def update_install(src, dest, dest_host, group, delete=False):
+    """
+    Patch the installed tree dest on dest_host in place to match src.
+
+    Only new and changed entries are copied and get the install
+    permissions; with delete, entries no longer in src are removed. The
+    install must have completed unless --force is given. delete always
+    needs a completed install made by the current user, and the user's
+    typed confirmation of the listed entries. Returns 0 on success, 1
+    otherwise.
+    """
+    agent = None
+    if check_same_host(dest_host) != 0:
+        agent = get_agent(dest_host)
+        if agent is None:
+            logger.error("Cannot update %s on %s: updates need the remote helper "
+                         "(setuid mode with tool_defs.remote_python set)" % (dest, dest_host))
+            return 1
+
+    try:
+        exists = (agent.call('lstat_many', root=dest, paths=['.']) if agent is not None
+                  else op_lstat_many(dest, ['.']))[0]
+    except AgentError as e:
+        logger.error("Cannot check %s on %s: %s" % (dest, dest_host, e))
+        return 1
+    if not exists or exists[0] != 'd':
+        logger.error("%s is not installed on %s; use the install subcommand" % (dest, dest_host))
+        return 1
+
+    metadata = read_metadata(dest, dest_host)
+    if metadata is None or not install_completed(metadata):
+        problem = "has no readable metadata file" if metadata is None else "was never completed"
+        if delete:
+            # --force does not extend to deleting files
+            logger.error("The install of %s on %s %s. --delete is only allowed on a completed install."
+                         % (dest, dest_host, problem))
+            return 1
+        if not lib.my_globals.get_force():
+            logger.error("The install of %s on %s %s. Finish it with install --resume, "
+                         "or rerun with --force to update it anyway." % (dest, dest_host, problem))
+            return 1
+        logger.warning("The install of %s on %s %s; updating it anyway (--force)" % (dest, dest_host, problem))
+    if delete and installed_by(metadata) != getpass.getuser():
+        logger.error("--delete is only permitted by the user who performed the installation.")
+        logger.error("Current user : %s" % getpass.getuser())
+        logger.error("Installed by : %s" % installed_by(metadata))
+        return 1
+
+    manifest = get_manifest(src)
+    logger.info("Comparing %s with %s on %s ..." % (src, dest, dest_host))
+    try:
+        plan = plan_update(manifest, dest, dest_host, agent)
+    except AgentError as e:
+        logger.error("Could not compare %s on %s with %s: %s" % (dest, dest_host, src, e))
+        return 1
+    plan.log()
+
+    pretend = lib.my_globals.get_pretend()
+    if delete:
+        # List what would be removed and have the user confirm it before
+        # anything on the site changes
+        status, removed = delete_removed(src, dest, dest_host, dry_run=True)
+        if status != 0:
+            logger.error("Could not list the entries deleted from %s on %s" % (src, dest_host))
+            return 1
+        _log_removed(removed, dest, 'would remove')
+        if not removed:
+            delete = False
+        elif pretend:
+            plan.removed = removed
+        elif not confirm_delete(removed, dest, dest_host):
+            return 1
+
+    if plan.paths():
+        if pretend:
+            logger.info("Pretend mode: would copy %d entries (%s) to %s on %s"
+                        % (len(plan.paths()), format_bytes(plan.bytes()), dest, dest_host))
+        elif copy_changes(plan, src, shell_owner_group(lib.tool_defs.cadtools_user, group)) != 0:
+            logger.error("Copying the changes to %s on %s failed" % (dest, dest_host))
+            return 1
+
+    if delete and not pretend:
+        status, plan.removed = delete_removed(src, dest, dest_host)
+        _log_removed(plan.removed, dest, 'removed')
+        if status != 0:
+            logger.error("Removing the entries deleted from %s failed on %s" % (src, dest_host))
+            return 1
+
+    if not plan.paths() and not plan.removed:
+        logger.info("%s on %s is up to date with %s" % (dest, dest_host, src))
+        return 0
+    if pretend:
+        return 0
+
+    apply_install_permissions(dest, dest_host, group, paths=plan.paths())
+    append_update_record(dest, dest_host, metadata or '', src, datetime.now().astimezone(), plan.summary())
+    logger.info("Updated %s on %s: %s" % (dest, dest_host, plan.summary()))
+    return 0
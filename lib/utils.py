@@ -3,54 +3,85 @@
 
 import os
 import pwd
+import re
 import sys
+import shlex
+import asyncio
+import selectors
+import uuid
 import subprocess
 import logging
 import lib.my_globals
 import lib.tool_defs
-from lib.executor import get_execution_mode, get_sudo_path, send_command_to_listener
+from lib.executor import get_execution_mode, get_sudo_path, get_allowed_commands, send_command_to_listener, send_command_to_listener_async
+from lib.ssh_pool import ssh_prefix, rsync_rsh_option
+from lib.remote_agent import get_agent, AgentError
+from lib.probe_cache import current_host, cached_probe
+from lib.manifest import get_manifest
+from lib.treescan import load_exclude_rules
 
 logger = logging.getLogger('cadinstall')
 
-def run_command(command, pretend=False):
-    allowed_commands_file = os.path.realpath(os.path.dirname(os.path.realpath(__file__)) + '/../etc/allowed_commands')
+# Characters that need /bin/sh when they appear outside quotes
+SHELL_METACHARACTERS = set('|&;<>()$`\\*?[]{}~!#\n')
 
-    pretend = lib.my_globals.get_pretend()
+def split_command(command):
+    """
+    Split a command string into an argv list when it can be exec'd directly.
 
-    # Get the execution mode
-    execution_mode = get_execution_mode()
-    
-    # Build an array with every line from the allowed_commands file
-    allowed_commands = []
-    with open(allowed_commands_file, 'r') as f:
-        for line in f:
-            allowed_commands.append(line.rstrip())
+    Returns None if the command relies on the shell (pipes, redirection,
+    globbing, variable expansion, ...) and must run through /bin/sh.
+    """
+    quote = None
+    for char in command:
+        if quote == "'":
+            if char == "'":
+                quote = None
+        elif quote == '"':
+            if char == '"':
+                quote = None
+            elif char in '$`\\':
+                return None
+        elif char in ("'", '"'):
+            quote = char
+        elif char in SHELL_METACHARACTERS:
+            return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    return argv or None
 
-    # If using listener mode, send the command directly to the listener
-    if execution_mode == 'listener':
-        if pretend:
-            if lib.my_globals.get_vv():
-                logger.debug("Because the '-p' switch was thrown, not actually running command: %s" % command)
-            else:
-                logger.debug("Because the '-p' switch was thrown, not actually running command: %s" % command)
-            return 0
-        else:
-            if lib.my_globals.get_vv():
-                logger.debug("Running command via listener: %s" % command)
-            else:
-                logger.debug("Running command: %s" % command)
-            
-            exit_code, _ = send_command_to_listener(command)
-            return exit_code
-    
-    # Otherwise, use setuid mode (original logic)
-    sudo = get_sudo_path()
+
+# An ssh followed by its options, host and a single-quoted remote command as
+# shlex.quote() builds it ('...' pieces joined by "'" for embedded quotes)
+_SSH_REMOTE_COMMAND = re.compile(r"""(/usr/bin/ssh(?: [^\s'"|;&<>]+)+ )((?:'[^']*'|"'")+)""")
+
+
+def _wrap_shell_command(command, sudo, allowed_commands):
+    """Insert the .sudo wrapper in front of allowed commands in a shell command string."""
+    # The remote command of an ssh runs on the other host as cadtools, the
+    # user ssh authenticates as, so set it aside before any rewriting: the
+    # commands in it must not get .sudo (even when they are allowlisted).
+    remote_commands = []
+
+    def set_aside(match):
+        remote_commands.append(match.group(2))
+        return "%sSSH_REMOTE_COMMAND_PLACEHOLDER_%d" % (match.group(1), len(remote_commands) - 1)
+
+    # The ssh inside an rsync --rsh option is started by rsync, which already
+    # runs as cadtools, so keep it out of the .sudo replacement below.
+    rsh_match = re.search(r"--rsh='[^']*'", command)
+    rsh_placeholder = "RSYNC_RSH_PLACEHOLDER"
+    if rsh_match:
+        command = command.replace(rsh_match.group(0), rsh_placeholder)
+
+    command = _SSH_REMOTE_COMMAND.sub(set_aside, command)
     sudo_command = command
 
     # Special handling for remote rsync commands with --rsync-path
     if "--rsync-path=" in command and ":" in command:
         # This is a remote rsync command, handle rsync-path specially
-        import re
         # Extract the rsync-path content
         rsync_path_match = re.search(r"--rsync-path='([^']*)'", command)
         if rsync_path_match:
@@ -78,13 +109,136 @@ def run_command(command, pretend=False):
     elif command.startswith('/usr/bin/ssh '):
         # Only wrap the SSH command itself with .sudo - the remote commands
         # run as cadtools because SSH authenticates as cadtools after setreuid
-        sudo_command = sudo_command.replace('/usr/bin/ssh', sudo + ' /usr/bin/ssh')
+        sudo_command = sudo_command.replace('/usr/bin/ssh', sudo + ' /usr/bin/ssh', 1)
     else:
         # Normal processing for local commands
         for allowed_command in allowed_commands:
             sudo_command = sudo_command.replace(allowed_command, sudo + ' ' + allowed_command)
 
-    is_setuid = (sudo_command != command)
+    if rsh_match:
+        sudo_command = sudo_command.replace(rsh_placeholder, rsh_match.group(0))
+    for index, remote_command in reversed(list(enumerate(remote_commands))):
+        sudo_command = sudo_command.replace("SSH_REMOTE_COMMAND_PLACEHOLDER_%d" % index, remote_command)
+    return sudo_command
+
+
+def prepare_setuid_command(command):
+    """
+    Work out how to start command in setuid mode.
+
+    Commands that do not need the shell are split into argv and exec'd
+    directly; only argv[0] is wrapped with .sudo, and only if it is an
+    allowed command (ssh and rsync start any further commands as cadtools
+    already). Anything else falls back to the shell string rewriting.
+
+    Returns (popen_args, use_shell, sudo_command, is_setuid) where
+    sudo_command is the printable form used for logging.
+    """
+    sudo = get_sudo_path()
+    allowed_commands = get_allowed_commands()
+
+    argv = split_command(command)
+    if argv is not None:
+        is_setuid = argv[0] in allowed_commands
+        if is_setuid:
+            argv = [sudo] + argv
+        return argv, False, ' '.join(shlex.quote(arg) for arg in argv), is_setuid
+
+    sudo_command = _wrap_shell_command(command, sudo, allowed_commands)
+    return sudo_command, True, sudo_command, sudo_command != command
+
+
+# Longest stdout/stderr line held in memory; longer lines are logged in pieces
+MAX_LINE_LENGTH = 64 * 1024
+
+
+# A carriage return ends a line too: progress output (rsync --info=progress2)
+# rewrites one console line with \r
+_LINE_END = re.compile(rb'\r\n|\r|\n')
+
+
+def _feed_lines(pending, chunk, callback):
+    """Append chunk to the pending bytearray and pass every complete line to callback."""
+    pending += chunk
+    while True:
+        match = _LINE_END.search(pending)
+        # A \r at the end may be the start of \r\n
+        if match is None or (match.group() == b'\r' and match.end() == len(pending)):
+            break
+        callback(pending[:match.start()].decode('utf-8', errors='replace').rstrip())
+        del pending[:match.end()]
+    while len(pending) >= MAX_LINE_LENGTH:
+        callback(pending[:MAX_LINE_LENGTH].decode('utf-8', errors='replace'))
+        del pending[:MAX_LINE_LENGTH]
+
+
+def _flush_lines(pending, callback):
+    """Pass a final unterminated line, if any, to callback."""
+    if pending:
+        callback(pending.decode('utf-8', errors='replace').rstrip())
+        del pending[:]
+
+
+def stream_process_output(process, on_stdout, on_stderr):
+    """
+    Drain a process's stdout and stderr at the same time.
+
+    Complete lines are passed to on_stdout / on_stderr in the order they
+    arrive, so a child writing a lot to one pipe can never block on it while
+    the other is being read. At most MAX_LINE_LENGTH bytes of a partial line
+    are buffered per pipe.
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ, (on_stdout, bytearray()))
+    selector.register(process.stderr, selectors.EVENT_READ, (on_stderr, bytearray()))
+
+    while selector.get_map():
+        for key, _ in selector.select():
+            callback, pending = key.data
+            chunk = os.read(key.fd, 65536)
+            if not chunk:
+                selector.unregister(key.fileobj)
+                _flush_lines(pending, callback)
+                continue
+            _feed_lines(pending, chunk, callback)
+    selector.close()
+
+
+def _start_process(popen_args, use_shell):
+    """Popen the prepared command. Returns None (after logging) if it cannot be started."""
+    from subprocess import PIPE, Popen
+    try:
+        return Popen(popen_args, shell=use_shell, stdout=PIPE, stderr=PIPE)
+    except OSError as e:
+        logger.error("Could not run %s: %s" % (popen_args[0] if not use_shell else popen_args, e))
+        return None
+
+
+def run_command(command, pretend=False, on_stdout=None):
+    pretend = lib.my_globals.get_pretend()
+
+    # Get the execution mode
+    execution_mode = get_execution_mode()
+    
+    # If using listener mode, send the command directly to the listener
+    if execution_mode == 'listener':
+        if pretend:
+            if lib.my_globals.get_vv():
+                logger.debug("Because the '-p' switch was thrown, not actually running command: %s" % command)
+            else:
+                logger.debug("Because the '-p' switch was thrown, not actually running command: %s" % command)
+            return 0
+        else:
+            if lib.my_globals.get_vv():
+                logger.debug("Running command via listener: %s" % command)
+            else:
+                logger.debug("Running command: %s" % command)
+            
+            exit_code, _ = send_command_to_listener(command, on_stdout=on_stdout)
+            return exit_code
+    
+    # Otherwise, use setuid mode
+    popen_args, use_shell, sudo_command, is_setuid = prepare_setuid_command(command)
 
     if pretend:
         if lib.my_globals.get_vv():
@@ -102,13 +256,13 @@ def run_command(command, pretend=False):
         else:
             logger.debug("Running command: %s" % command)
 
-        from subprocess import PIPE, Popen
         return_code = 0
-        with Popen(sudo_command, shell=True, stdout=PIPE, stderr=PIPE, bufsize=1) as process:
-            for line in process.stdout:
-                logger.info(line.decode('utf-8').rstrip())
-            for line in process.stderr:
-                logger.error(line.decode('utf-8').rstrip())
+        process = _start_process(popen_args, use_shell)
+        if process is None:
+            return 127
+        with process:
+            # on_stdout takes each line instead of the log (e.g. a TransferProgress)
+            stream_process_output(process, on_stdout or logger.info, logger.error)
 
         process.wait()
         if process.returncode:
@@ -118,7 +272,8 @@ def run_command(command, pretend=False):
     return(return_code)    
 
 
-def run_command_with_output(command, pretend=False, log_stderr=True, log_stdout=True, force_run=False):
+def run_command_with_output(command, pretend=False, log_stderr=True, log_stdout=True, force_run=False,
+                            on_stdout=None):
     """
     Run a command through the setuid binary or listener and return both status and output.
     Similar to run_command() but captures and returns stdout.
@@ -129,20 +284,13 @@ def run_command_with_output(command, pretend=False, log_stderr=True, log_stdout=
         log_stderr: If True, log stderr output as errors (default True)
         log_stdout: If True, log stdout output as info (default True)
         force_run: If True, run the command even in pretend mode (for read-only operations)
+        on_stdout: Called with each stdout line instead of logging it
     """
-    allowed_commands_file = os.path.realpath(os.path.dirname(os.path.realpath(__file__)) + '/../etc/allowed_commands')
-
     pretend = lib.my_globals.get_pretend() and not force_run
 
     # Get the execution mode
     execution_mode = get_execution_mode()
     
-    # Build an array with every line from the allowed_commands file
-    allowed_commands = []
-    with open(allowed_commands_file, 'r') as f:
-        for line in f:
-            allowed_commands.append(line.rstrip())
-
     # If using listener mode, send the command directly to the listener
     if execution_mode == 'listener':
         if pretend:
@@ -157,23 +305,11 @@ def run_command_with_output(command, pretend=False, log_stderr=True, log_stdout=
             else:
                 logger.debug("Running command: %s" % command)
             
-            exit_code, stdout_lines = send_command_to_listener(command)
+            exit_code, stdout_lines = send_command_to_listener(command, on_stdout=on_stdout)
             return exit_code, '\n'.join(stdout_lines)
     
-    # Otherwise, use setuid mode (original logic)
-    sudo = get_sudo_path()
-    sudo_command = command
-
-    # Apply .sudo replacement to allowed commands
-    # For SSH commands, only wrap SSH itself - remote commands run as cadtools
-    # because SSH authenticates as cadtools after setreuid
-    if command.startswith('/usr/bin/ssh '):
-        sudo_command = sudo_command.replace('/usr/bin/ssh', sudo + ' /usr/bin/ssh')
-    else:
-        for allowed_command in allowed_commands:
-            sudo_command = sudo_command.replace(allowed_command, sudo + ' ' + allowed_command)
-
-    is_setuid = (sudo_command != command)
+    # Otherwise, use setuid mode
+    popen_args, use_shell, sudo_command, is_setuid = prepare_setuid_command(command)
 
     if pretend:
         if lib.my_globals.get_vv():
@@ -191,19 +327,25 @@ def run_command_with_output(command, pretend=False, log_stderr=True, log_stdout=
         else:
             logger.debug("Running command: %s" % command)
 
-        from subprocess import PIPE, Popen
         return_code = 0
         stdout_lines = []
         
-        with Popen(sudo_command, shell=True, stdout=PIPE, stderr=PIPE, bufsize=1) as process:
-            for line in process.stdout:
-                line_str = line.decode('utf-8').rstrip()
-                if log_stdout:
-                    logger.info(line_str)
-                stdout_lines.append(line_str)
-            for line in process.stderr:
-                if log_stderr:
-                    logger.error(line.decode('utf-8').rstrip())
+        process = _start_process(popen_args, use_shell)
+        if process is None:
+            return 127, ""
+        def handle_stdout(line_str):
+            if on_stdout is not None:
+                on_stdout(line_str)
+            elif log_stdout:
+                logger.info(line_str)
+            stdout_lines.append(line_str)
+
+        def on_stderr(line_str):
+            if log_stderr:
+                logger.error(line_str)
+
+        with process:
+            stream_process_output(process, handle_stdout, on_stderr)
 
         process.wait()
         if process.returncode:
@@ -213,6 +355,238 @@ def run_command_with_output(command, pretend=False, log_stderr=True, log_stdout=
         return(return_code, '\n'.join(stdout_lines))
 
 
+# Status returned by run_command_async() when a command times out (as timeout(1) does)
+TIMEOUT_STATUS = 124
+
+
+async def _run_process_async(popen_args, use_shell, on_stdout, on_stderr):
+    """Start a prepared command, stream both pipes and return its exit status."""
+    from asyncio.subprocess import PIPE
+    try:
+        if use_shell:
+            process = await asyncio.create_subprocess_shell(popen_args, stdout=PIPE, stderr=PIPE)
+        else:
+            process = await asyncio.create_subprocess_exec(*popen_args, stdout=PIPE, stderr=PIPE)
+    except OSError as e:
+        logger.error("Could not run %s: %s" % (popen_args[0] if not use_shell else popen_args, e))
+        return 127
+
+    async def pump(stream, callback):
+        pending = bytearray()
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            _feed_lines(pending, chunk, callback)
+        _flush_lines(pending, callback)
+
+    try:
+        await asyncio.gather(pump(process.stdout, on_stdout), pump(process.stderr, on_stderr))
+        return await process.wait()
+    finally:
+        # Cancelled or timed out: do not leave the command running
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+async def run_command_async(command, log_stderr=True, log_stdout=True, force_run=False, timeout=None,
+                            on_stdout=None):
+    """
+    Asyncio counterpart of run_command_with_output(), for both execution modes.
+
+    Many of these can be awaited together (see gather_commands()) to overlap
+    remote probes and transfers without managing threads. If the task is
+    cancelled, the command is killed and CancelledError propagates.
+
+    Args:
+        command:    Command to run
+        log_stderr: If True, log stderr output as errors (default True)
+        log_stdout: If True, log stdout output as info (default True)
+        force_run:  If True, run the command even in pretend mode (for read-only operations)
+        timeout:    Seconds to wait before killing the command (None waits forever)
+        on_stdout:  Called with each stdout line instead of logging it
+
+    Returns:
+        (status, output). status is TIMEOUT_STATUS if the command timed out.
+    """
+    pretend = lib.my_globals.get_pretend() and not force_run
+    execution_mode = get_execution_mode()
+    stdout_lines = []
+
+    if pretend:
+        logger.debug("Because the '-p' switch was thrown, not actually running command: %s" % command)
+        return 0, ""
+
+    if execution_mode == 'listener':
+        if lib.my_globals.get_vv():
+            logger.debug("Running command via listener: %s" % command)
+        else:
+            logger.debug("Running command: %s" % command)
+        operation = send_command_to_listener_async(command, log_stdout=log_stdout, log_stderr=log_stderr,
+                                                   on_stdout=on_stdout)
+    else:
+        popen_args, use_shell, sudo_command, is_setuid = prepare_setuid_command(command)
+        if lib.my_globals.get_vv():
+            logger.debug("Running sudo_command: %s" % sudo_command)
+        elif is_setuid:
+            logger.debug("Running command (as %s): %s" % (lib.tool_defs.cadtools_user, command))
+        else:
+            logger.debug("Running command: %s" % command)
+
+        def handle_stdout(line_str):
+            if on_stdout is not None:
+                on_stdout(line_str)
+            elif log_stdout:
+                logger.info(line_str)
+            stdout_lines.append(line_str)
+
+        def on_stderr(line_str):
+            if log_stderr:
+                logger.error(line_str)
+
+        operation = _run_process_async(popen_args, use_shell, handle_stdout, on_stderr)
+
+    try:
+        result = await asyncio.wait_for(operation, timeout)
+    except asyncio.TimeoutError:
+        logger.error("Command timed out after %s seconds: %s" % (timeout, command))
+        return TIMEOUT_STATUS, '\n'.join(stdout_lines)
+
+    if execution_mode == 'listener':
+        return result[0], '\n'.join(result[1])
+    if result:
+        logger.debug("Return code: %s" % result)
+    return result, '\n'.join(stdout_lines)
+
+
+async def gather_commands(commands, limit=None, **kwargs):
+    """
+    Run commands concurrently with run_command_async().
+
+    Args:
+        commands: List of command strings
+        limit:    Maximum number running at once (None for no limit)
+        kwargs:   Passed to run_command_async() (log_stdout, force_run, timeout, ...)
+
+    Returns:
+        A list of (status, output), in the order of commands.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run_one(command):
+        if semaphore is None:
+            return await run_command_async(command, **kwargs)
+        async with semaphore:
+            return await run_command_async(command, **kwargs)
+
+    return await asyncio.gather(*(run_one(command) for command in commands))
+
+
+def run_commands_concurrently(commands, limit=None, **kwargs):
+    """
+    Blocking wrapper around gather_commands() for synchronous callers.
+    Must not be called from a running event loop.
+    """
+    if not commands:
+        return []
+    return asyncio.run(gather_commands(commands, limit=limit, **kwargs))
+
+
+def batch_step(command, ignore_failure=False):
+    """
+    One step for run_batch().
+
+    Args:
+        command:        Command line; must start with an allowed command.
+        ignore_failure: If True, a non-zero exit does not stop the batch
+                        (use for probes whose status is the answer).
+    """
+    return {'command': command, 'ignore_failure': ignore_failure}
+
+
+def run_batch(dest_host, steps, stop_on_failure=True, force_run=False):
+    """
+    Run an ordered list of allowed commands on dest_host in one invocation.
+
+    On a remote host all steps are sent as a single script over one ssh
+    session, so a multi-step operation costs one round trip. Each step's
+    exit status and stdout are recovered from marker lines. On the local
+    host the steps run one after another through run_command_with_output().
+
+    Args:
+        dest_host:       The host to run on (from siteHash).
+        steps:           List of batch_step() dicts (or plain command strings).
+        stop_on_failure: Stop at the first failing step that does not have
+                         ignore_failure set.
+        force_run:       Run even in pretend mode (for read-only batches).
+
+    Returns:
+        A list with one dict per step: {'command', 'status', 'output'}.
+        'status' is None for steps that did not run.
+    """
+    steps = [batch_step(step) if isinstance(step, str) else step for step in steps]
+    results = [{'command': step['command'], 'status': None, 'output': ''} for step in steps]
+
+    allowed_commands = get_allowed_commands()
+    for step in steps:
+        base_command = step['command'].split()[0] if step['command'].split() else ''
+        if base_command not in allowed_commands:
+            logger.error("Command not allowed in a batch: %s" % step['command'])
+            return results
+
+    if lib.my_globals.get_pretend() and not force_run:
+        for step, result in zip(steps, results):
+            logger.debug("Because the '-p' switch was thrown, not actually running command: %s" % step['command'])
+            result['status'] = 0
+        return results
+
+    if check_same_host(dest_host) == 0:
+        for step, result in zip(steps, results):
+            status, output = run_command_with_output(step['command'], log_stdout=False, force_run=force_run)
+            result['status'] = status
+            result['output'] = output
+            if status != 0 and stop_on_failure and not step['ignore_failure']:
+                break
+        return results
+
+    # Markers carry a per-batch token so that step output cannot fake them.
+    token = "@@cadinstall-%s" % uuid.uuid4().hex
+    script = []
+    for index, step in enumerate(steps):
+        script.append("echo '%s begin %d'" % (token, index))
+        script.append(step['command'])
+        script.append("rc=$?")
+        script.append("echo \"%s end %d $rc\"" % (token, index))
+        if stop_on_failure and not step['ignore_failure']:
+            script.append("[ $rc -eq 0 ] || exit 0")
+    command = "%s %s" % (ssh_prefix(dest_host), shlex.quote('\n'.join(script)))
+
+    status, output = run_command_with_output(command, log_stdout=False, force_run=force_run)
+    if status != 0:
+        logger.error("Batch of %d command(s) failed to run on %s (status %d)" % (len(steps), dest_host, status))
+
+    current = None
+    lines = []
+    for line in output.split('\n'):
+        if line.startswith(token + ' '):
+            fields = line.split()
+            if fields[1] == 'begin':
+                current = int(fields[2])
+                lines = []
+            elif fields[1] == 'end' and current is not None:
+                results[current]['status'] = int(fields[3])
+                results[current]['output'] = '\n'.join(lines)
+                current = None
+        elif current is not None:
+            lines.append(line)
+
+    for result in results:
+        if result['status'] is not None:
+            logger.debug("Batch step on %s exited %d: %s" % (dest_host, result['status'], result['command']))
+    return results
+
+
 def check_src(src):
     logger.info("Verifying source directory exists %s and is readable to %s ..." % (src,lib.tool_defs.cadtools_user))
 
@@ -232,6 +606,68 @@ def check_src(src):
     return(0)
     
 
+# find expression that prints one "<problem>\t<path>" line per entry that
+# cadtools could not copy. Symlinks are copied as links, so only broken ones
+# are reported rather than unreadable targets.
+READABILITY_FIND_TESTS = [
+    '(', '!', '-type', 'l', '!', '-readable', '-printf', 'unreadable\\t%p\\n', ')', ',',
+    '(', '-type', 'd', '-readable', '!', '-executable', '-printf', 'untraversable\\t%p\\n', ')', ',',
+    '(', '-xtype', 'l', '-printf', 'broken symlink\\t%p\\n', ')', ',',
+    '(', '!', '-type', 'f', '!', '-type', 'd', '!', '-type', 'l', '-printf', 'special file\\t%p\\n', ')',
+]
+
+
+def find_unreadable_entries(src):
+    """
+    Check the whole source tree the way cadtools will see it when copying.
+
+    One find per top-level directory (plus one for the top-level files) runs
+    as cadtools, all of them at once. Entries excluded from the copy are
+    ignored.
+
+    Returns a list of (problem, path), where problem is 'unreadable',
+    'untraversable', 'broken symlink' or 'special file'. Returns None if the
+    check itself could not be run.
+    """
+    logger.info("Checking that every entry in %s is readable to %s ..." % (src, lib.tool_defs.cadtools_user))
+
+    manifest = get_manifest(src)
+    top_dirs = []
+    top_others = [src]
+    for entry in manifest.entries():
+        if '/' in entry.path:
+            continue
+        if entry.type == 'd':
+            top_dirs.append(os.path.join(src, entry.path))
+        else:
+            top_others.append(os.path.join(src, entry.path))
+
+    tests = ' '.join(shlex.quote(arg) for arg in READABILITY_FIND_TESTS)
+    commands = ["/usr/bin/find %s -maxdepth 0 %s" % (' '.join(shlex.quote(p) for p in top_others), tests)]
+    commands += ["/usr/bin/find %s %s" % (shlex.quote(d), tests) for d in top_dirs]
+
+    results = run_commands_concurrently(commands, limit=lib.tool_defs.treescan_workers,
+                                        log_stderr=False, log_stdout=False, force_run=True)
+
+    rules = load_exclude_rules()
+    problems = []
+    for (status, output), command in zip(results, commands):
+        found = []
+        for line in output.split('\n'):
+            if '\t' not in line:
+                continue
+            problem, path = line.split('\t', 1)
+            rel = os.path.relpath(path, src)
+            if rel != '.' and rules.matches(rel, os.path.isdir(path)):
+                continue
+            found.append((problem, path))
+        if status != 0 and not found and not output.strip():
+            logger.error("Could not check readability with: %s" % command)
+            return None
+        problems.extend(found)
+    return problems
+
+
 def check_dest(dest, host=None):
     """
     Check if the destination directory already exists.
@@ -249,9 +685,12 @@ def check_dest(dest, host=None):
                 exists = 1
         else:
             # Different host - use SSH through setuid binary
-            command = "/usr/bin/ssh %s /usr/bin/ls -ltrd %s" % (host, dest)
-            status, output = run_command_with_output(command, log_stderr=False, force_run=True)
-            if status == 0 and output.strip():
+            def probe():
+                command = "%s /usr/bin/ls -ltrd %s" % (ssh_prefix(host), dest)
+                status, output = run_command_with_output(command, log_stderr=False, force_run=True)
+                return status == 0 and bool(output.strip())
+
+            if cached_probe(host, 'exists', dest, probe):
                 logger.error("Destination directory already exists on %s : %s" % (host, dest))
                 exists = 1
     else:
@@ -266,20 +705,19 @@ def check_same_host(dest_host):
     Check if dest_host is the same as the current host.
     Returns 0 if same host, 1 if different host.
     """
-    import socket
-    current_host = socket.getfqdn()
+    this_host = current_host()
     
     # Normalize both hostnames for comparison
-    current_host_normalized = current_host.lower()
+    current_host_normalized = this_host.lower()
     dest_host_normalized = dest_host.lower()
     
     if current_host_normalized == dest_host_normalized:
         if lib.my_globals.get_vv():
-            logger.info("Current host %s is the same as target host %s" % (current_host, dest_host))
+            logger.info("Current host %s is the same as target host %s" % (this_host, dest_host))
         return 0
     else:
         if lib.my_globals.get_vv():
-            logger.info("Current host %s is different from target host %s" % (current_host, dest_host))
+            logger.info("Current host %s is different from target host %s" % (this_host, dest_host))
         return 1
 
 def check_domain(dest):
@@ -306,64 +744,104 @@ def check_domain(dest):
     return(0)
 
 def get_directory_size(path):
-    """Get the size of a directory in bytes using du command"""
+    """
+    Get the number of bytes installing the directory will take, counting
+    only what rsync will copy. Read from the run's source manifest, which
+    is built on first use (see lib/manifest.py)
+    """
     if not os.path.exists(path):
         logger.error("Source directory does not exist: %s" % path)
         return 0
     
     try:
-        command = "du -sb %s" % path
-        
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        
-        if process.returncode != 0:
-            logger.error("Failed to calculate directory size for %s: %s" % (path, error.decode('utf-8')))
-            return 0
-        
-        # Parse the output - first field is the size in bytes
-        size_bytes = int(output.decode('utf-8').split()[0])
-        return size_bytes
+        scan = get_manifest(path)
     except Exception as e:
         logger.error("Error calculating directory size for %s: %s" % (path, str(e)))
         return 0
 
+    if scan.errors:
+        for error in scan.errors[:10]:
+            logger.warning("Could not scan %s" % error)
+        logger.error("Failed to calculate directory size for %s: %d entries could not be read" % (path, len(scan.errors)))
+        return 0
+
+    return scan.size
+
+# Walks up to the deepest existing directory on the remote host and prints
+# it, whether it is writable, then the df output for it - all in one ssh.
+RESOLVE_SCRIPT = """p=%s
+while [ ! -d "$p" ]; do
+  case "$p" in /|"") break;; esac
+  p="${p%%/*}"
+done
+[ -n "$p" ] || p=/
+echo "$p"
+if [ -w "$p" ]; then echo 1; else echo 0; fi
+/usr/bin/df -B1 -P "$p"
+"""
+
+
+def _resolve_remote(path, host):
+    agent = get_agent(host)
+    if agent is not None:
+        try:
+            return agent.call('resolve', path=path)
+        except AgentError as e:
+            logger.debug("Remote helper probe failed, using individual commands: %s" % e)
+
+    command = "%s %s" % (ssh_prefix(host), shlex.quote(RESOLVE_SCRIPT % shlex.quote(path)))
+    status, output = run_command_with_output(command, log_stderr=False, log_stdout=False, force_run=True)
+    lines = output.strip().split('\n')
+    if len(lines) < 4:
+        logger.error("Failed to resolve %s on %s" % (path, host))
+        return {'path': None, 'writable': False, 'available': 0}
+    fields = lines[-1].split()
+    available = int(fields[3]) if status == 0 and len(fields) >= 4 and fields[3].isdigit() else 0
+    return {'path': lines[0], 'writable': lines[1] == '1', 'available': available}
+
+
+def _resolve_local(path):
+    current = path
+    while current not in ('', '/') and not os.path.isdir(current):
+        current = os.path.dirname(current)
+    current = current or '/'
+    # Writability is checked as the cadtools user, not as the caller
+    write_status, _ = run_command_with_output("/bin/test -w %s" % current, log_stderr=False,
+                                              log_stdout=False, force_run=True)
+    statvfs = os.statvfs(current)
+    return {'path': current, 'writable': write_status == 0,
+            'available': statvfs.f_bavail * statvfs.f_frsize}
+
+
+def resolve_existing_ancestor(path, host):
+    """
+    Find the deepest existing directory at or above path on host.
+
+    Answered with a single remote call (the remote helper, or one ssh
+    script) and cached for the run, so the install permission and disk
+    space prechecks for a path share one round trip.
+
+    Returns:
+        {'path': existing directory (or None if it could not be resolved),
+         'writable': True if cadtools can write to it,
+         'available': free bytes on its filesystem}
+    """
+    if check_same_host(host) == 0:
+        return cached_probe(host, 'ancestor', path, lambda: _resolve_local(path))
+    return cached_probe(host, 'ancestor', path, lambda: _resolve_remote(path, host))
+
+
 def get_available_space(path, host=None):
     """Get available disk space at the given path in bytes"""
     try:
         if host and check_same_host(host) != 0:
-            # Different host - use SSH to check disk space
-            # Check the path itself first, or walk up parent directories until we find one that exists
-            current_path = path
-            while current_path and current_path != '/':
-                command = "/usr/bin/ssh %s /usr/bin/df -B1 %s" % (host, current_path)
-                # Don't log stderr as error while probing for existing directories
-                # Force run even in pretend mode - disk space check is read-only
-                status, output = run_command_with_output(command, log_stderr=False, log_stdout=False, force_run=True)
-                
-                if status == 0:
-                    # Success! Found an existing path
-                    if current_path != path:
-                        logger.info("Using existing parent directory %s for space calculation" % current_path)
-                    
-                    # Parse df output - available space is the 4th column (index 3)
-                    lines = output.strip().split('\n')
-                    if len(lines) >= 2:
-                        fields = lines[1].split()
-                        if len(fields) >= 4:
-                            available_bytes = int(fields[3])
-                            return available_bytes
-                    break
-                else:
-                    # Path doesn't exist, try parent directory silently
-                    parent_path = os.path.dirname(current_path)
-                    if parent_path == current_path:  # Reached root or can't go higher
-                        logger.error("Failed to find accessible directory for space check on %s" % host)
-                        return 0
-                    current_path = parent_path
-            
-            # If we get here, something went wrong
-            return 0
+            resolved = resolve_existing_ancestor(path, host)
+            if resolved['path'] is None:
+                logger.error("Failed to find accessible directory for space check on %s" % host)
+                return 0
+            if resolved['path'] != path:
+                logger.info("Using existing parent directory %s for space calculation" % resolved['path'])
+            return resolved['available']
         else:
             # Local host
             parent_path = os.path.dirname(path) if not os.path.exists(path) else path
@@ -0,0 +1,300 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Install verification for cadinstall
+
+Checks that an installed tree matches its source without rsync -c. Every
+file in the source manifest is hashed with BLAKE2b in a process pool
+(large files through mmap) on the host that holds it: the source here, the
+installed copy on the site's write host through the remote helper. Only
+paths, types, sizes, hashes and symlink targets cross the network.
+
+Hashes are kept in a persistent cache keyed by host, device, inode, size
+and mtime, so a repeat verification only reads files that changed.
+"""
+
+import os
+import dbm
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import lib.tool_defs
+from lib.manifest import get_manifest
+from lib.probe_cache import current_host
+from lib.remote_agent import get_agent, AgentError
+# The remote helper's hashing and lstat are used as is for local files, so
+# both sides of a comparison hash the same way.
+from lib.remote_agent_main import hash_file, op_lstat_many
+
+logger = logging.getLogger('cadinstall')
+
+# Entries compared per round trip to a site's write host
+BATCH_SIZE = 2000
+
+# Problems listed in full before the rest are summarized
+MAX_REPORTED = 50
+
+
+def _hash_one(path):
+    try:
+        return hash_file(path), None
+    except OSError as e:
+        return None, str(e)
+
+
+def hash_paths(paths, workers=None):
+    """Hash local files in a process pool. Returns (hash, error) per path, in order."""
+    if len(paths) < 2:
+        return [_hash_one(path) for path in paths]
+    workers = workers or lib.tool_defs.verify_workers
+    # Fork the workers: re-importing bin/cadinstall.py in a fresh
+    # interpreter would parse the command line again
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        return list(pool.map(_hash_one, paths, chunksize=16))
+
+
+class HashCache:
+    """
+    Persistent map of (host, dev, ino, size, mtime_ns) -> hash in a dbm file.
+
+    Only the cadinstall process touches it; sites verifying at the same time
+    share it through a lock. If the file cannot be opened (e.g. another run
+    holds it) hashes are kept in memory for this run only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or lib.tool_defs.hash_cache_file
+        self._db = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(host, dev, ino, size, mtime):
+        return "%s:%d:%d:%d:%d" % (host.lower(), dev, ino, size, mtime)
+
+    def _open(self):
+        if self._db is None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._db = dbm.open(self.path, 'c')
+            except Exception as e:
+                logger.warning("Hash cache %s is not available, hashing every file: %s" % (self.path, e))
+                self._db = {}
+        return self._db
+
+    def get(self, key):
+        with self._lock:
+            value = self._open().get(key)
+        if isinstance(value, bytes):
+            value = value.decode('ascii')
+        return value
+
+    def put(self, key, digest):
+        with self._lock:
+            self._open()[key] = digest
+
+    def close(self):
+        with self._lock:
+            if self._db is not None and hasattr(self._db, 'close'):
+                self._db.close()
+            self._db = None
+
+
+_hash_cache = None
+_sources = {}  # realpath of src -> Manifest with its hash column filled in
+_source_locks = {}  # realpath of src -> lock held while it is hashed
+_lock = threading.Lock()
+
+
+def get_hash_cache():
+    global _hash_cache
+    with _lock:
+        if _hash_cache is None:
+            _hash_cache = HashCache()
+            atexit.register(_hash_cache.close)
+        return _hash_cache
+
+
+def hash_source(src):
+    """
+    Return this run's manifest of src with every file's hash filled in.
+
+    Files whose hash is cached are not read. Done once per run however
+    many sites are verified: sites verifying at the same time wait for the
+    first one to finish hashing.
+    """
+    key = os.path.realpath(src)
+    with _lock:
+        if key in _sources:
+            return _sources[key]
+        source_lock = _source_locks.setdefault(key, threading.Lock())
+
+    with source_lock:
+        with _lock:
+            if key in _sources:
+                return _sources[key]
+        manifest = _hash_manifest(src)
+        with _lock:
+            _sources[key] = manifest
+    return manifest
+
+
+def _hash_manifest(src):
+    manifest = get_manifest(src)
+    cache = get_hash_cache()
+    host = current_host()
+    hashes = {}
+    todo = []
+    for entry in manifest.files():
+        cache_key = HashCache.key(host, entry.dev, entry.ino, entry.size, entry.mtime)
+        digest = cache.get(cache_key)
+        if digest:
+            hashes[entry.path] = digest
+        else:
+            todo.append((entry.path, cache_key))
+
+    if todo:
+        logger.info("Hashing %d files in %s (%d already cached) ..." % (len(todo), src, len(hashes)))
+        results = hash_paths([os.path.join(src, rel) for rel, _ in todo])
+        for (rel, cache_key), (digest, error) in zip(todo, results):
+            if digest is None:
+                logger.error("Could not hash %s/%s: %s" % (src, rel, error))
+                continue
+            hashes[rel] = digest
+            cache.put(cache_key, digest)
+
+    manifest.write_entries(entry._replace(hash=hashes.get(entry.path)) if entry.type == 'f' else entry
+                           for entry in manifest.entries())
+    return manifest
+
+
+class VerifyReport:
+    """Outcome of comparing one installed tree to its source."""
+
+    def __init__(self, dest, dest_host):
+        self.dest = dest
+        self.dest_host = dest_host
+        self.checked = 0
+        self.hashed = 0
+        self.cached = 0
+        self.problems = []  # (problem, relative path)
+
+    def ok(self):
+        return not self.problems
+
+    def log(self):
+        for problem, rel in self.problems[:MAX_REPORTED]:
+            logger.error("  %s: %s/%s" % (problem, self.dest, rel))
+        if len(self.problems) > MAX_REPORTED:
+            logger.error("  ... and %d more" % (len(self.problems) - MAX_REPORTED))
+        if self.ok():
+            logger.info("Verified %d entries in %s on %s (%d files hashed, %d cached)"
+                        % (self.checked, self.dest, self.dest_host, self.hashed, self.cached))
+        else:
+            logger.error("%d of %d entries in %s on %s do not match the source"
+                         % (len(self.problems), self.checked, self.dest, self.dest_host))
+
+
+def _link_target(src, rel):
+    try:
+        return os.readlink(os.path.join(src, rel))
+    except OSError:
+        return None
+
+
+def _compare_batch(report, batch, src, dest, dest_host, agent, cache):
+    paths = [entry.path for entry in batch]
+    if agent is not None:
+        stats = agent.call('lstat_many', root=dest, paths=paths, readlink=True)
+    else:
+        stats = op_lstat_many(dest, paths, readlink=True)
+
+    to_hash = []  # (entry, cache key)
+    for entry, found in zip(batch, stats):
+        report.checked += 1
+        if found is None:
+            report.problems.append(('missing', entry.path))
+            continue
+        kind, size, dev, ino, mtime, target = found
+        if kind != entry.type:
+            report.problems.append(('wrong type', entry.path))
+        elif kind == 'l':
+            source_target = _link_target(src, entry.path)
+            if source_target is None:
+                report.problems.append(('source unreadable', entry.path))
+            elif target != source_target:
+                report.problems.append(('link target differs', entry.path))
+        elif kind == 'f' and size != entry.size:
+            report.problems.append(('size differs', entry.path))
+        elif kind == 'f':
+            if entry.hash is None:
+                report.problems.append(('source unreadable', entry.path))
+                continue
+            cache_key = HashCache.key(dest_host, dev, ino, size, mtime)
+            digest = cache.get(cache_key)
+            if digest is None:
+                to_hash.append((entry, cache_key))
+                continue
+            report.cached += 1
+            if digest != entry.hash:
+                report.problems.append(('content differs', entry.path))
+
+    if not to_hash:
+        return
+    hash_list = [entry.path for entry, _ in to_hash]
+    if agent is not None:
+        results = agent.call('hash', root=dest, paths=hash_list, workers=lib.tool_defs.verify_workers)
+    else:
+        results = hash_paths([os.path.join(dest, rel) for rel in hash_list])
+    for (entry, cache_key), (digest, error) in zip(to_hash, results):
+        report.hashed += 1
+        if digest is None:
+            report.problems.append(('unreadable (%s)' % error, entry.path))
+            continue
+        cache.put(cache_key, digest)
+        if digest != entry.hash:
+            report.problems.append(('content differs', entry.path))
+
+
+def verify_install(src, dest, dest_host):
+    """
+    Compare the installed tree dest on dest_host with src.
+
+    Every entry rsync would copy must exist with the same type, every file
+    must have the same size and hash, and every symlink the same target.
+    Entries only in dest (such as .cadinstall.metadata) are ignored.
+    Returns 0 if the trees match, 1 otherwise.
+    """
+    from lib.utils import check_same_host
+
+    agent = None
+    if check_same_host(dest_host) != 0:
+        agent = get_agent(dest_host)
+        if agent is None:
+            logger.error("Cannot verify %s on %s: verification needs the remote helper "
+                         "(setuid mode with tool_defs.remote_python set)" % (dest, dest_host))
+            return 1
+
+    manifest = hash_source(src)
+    cache = get_hash_cache()
+    report = VerifyReport(dest, dest_host)
+    logger.info("Verifying %s on %s against %s ..." % (dest, dest_host, src))
+
+    batch = []
+    try:
+        for entry in manifest.entries():
+            batch.append(entry)
+            if len(batch) >= BATCH_SIZE:
+                _compare_batch(report, batch, src, dest, dest_host, agent, cache)
+                batch = []
+        if batch:
+            _compare_batch(report, batch, src, dest, dest_host, agent, cache)
+    except AgentError as e:
+        logger.error("Verification of %s on %s failed: %s" % (dest, dest_host, e))
+        return 1
+
+    report.log()
+    return 0 if report.ok() else 1
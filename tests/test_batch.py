@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import utils
+import lib.my_globals
+
+
+def fake_remote(outputs, exit_after=None):
+    """Build a run_command_with_output stand-in that answers a batch script with marker lines."""
+    def run(command, **kwargs):
+        token = re.search(r'@@cadinstall-[0-9a-f]+', command).group(0)
+        lines = []
+        for index, (status, output) in enumerate(outputs):
+            lines.append("%s begin %d" % (token, index))
+            if output:
+                lines.append(output)
+            lines.append("%s end %d %d" % (token, index, status))
+            if exit_after is not None and index == exit_after:
+                break
+        return 0, '\n'.join(lines)
+    return run
+
+
+class TestRunBatch(unittest.TestCase):
+    """Test cases for batched remote commands"""
+
+    def setUp(self):
+        lib.my_globals.set_pretend(False)
+
+    @patch('lib.utils.logger')
+    @patch('lib.utils.check_same_host', return_value=1)
+    def test_remote_batch_is_one_invocation(self, mock_same_host, mock_logger):
+        with patch('lib.utils.run_command_with_output', side_effect=fake_remote([(0, ''), (1, ''), (0, 'version1')])) as mock_run:
+            results = utils.run_batch('host.example.com', [
+                utils.batch_step('/bin/test -d /tools_vendor/a/b/1'),
+                utils.batch_step('/bin/test -f /tools_vendor/a/b/2', ignore_failure=True),
+                utils.batch_step('/bin/readlink /tools_vendor/a/b/latest'),
+            ])
+
+        self.assertEqual(mock_run.call_count, 1)
+        command = mock_run.call_args[0][0]
+        self.assertTrue(command.startswith('/usr/bin/ssh host.example.com '))
+        self.assertEqual([r['status'] for r in results], [0, 1, 0])
+        self.assertEqual(results[2]['output'], 'version1')
+
+    @patch('lib.utils.logger')
+    @patch('lib.utils.check_same_host', return_value=1)
+    def test_remote_batch_stops_on_failure(self, mock_same_host, mock_logger):
+        with patch('lib.utils.run_command_with_output', side_effect=fake_remote([(2, 'no such dir'), (0, '')], exit_after=0)):
+            results = utils.run_batch('host.example.com', ['/usr/bin/mkdir -p /x', '/usr/bin/ln -sf a /x/b'])
+
+        self.assertEqual(results[0]['status'], 2)
+        self.assertEqual(results[0]['output'], 'no such dir')
+        self.assertIsNone(results[1]['status'])
+
+    @patch('lib.utils.logger')
+    @patch('lib.utils.run_command_with_output')
+    def test_disallowed_command_is_not_run(self, mock_run, mock_logger):
+        results = utils.run_batch('host.example.com', ['/usr/bin/mkdir -p /x', '/bin/sh -c true'])
+
+        mock_run.assert_not_called()
+        self.assertEqual([r['status'] for r in results], [None, None])
+        mock_logger.error.assert_called_once()
+
+    @patch('lib.utils.logger')
+    @patch('lib.utils.run_command_with_output')
+    def test_pretend_does_not_run(self, mock_run, mock_logger):
+        lib.my_globals.set_pretend(True)
+        try:
+            results = utils.run_batch('host.example.com', ['/usr/bin/mkdir -p /x'])
+        finally:
+            lib.my_globals.set_pretend(False)
+
+        mock_run.assert_not_called()
+        self.assertEqual(results[0]['status'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
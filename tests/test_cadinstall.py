@@ -157,28 +157,6 @@ class TestCadinstall(unittest.TestCase):
         self.assertNotIn('g+rx', rsync_options)
         self.assertIn('--chmod=a=rX,u+w,Dg+s', rsync_options)
 
-    def _rsync_command_from_install(self, same_host, group='cadtools'):
-        """Run install_tool with mocks and return the rsync command string."""
-        from lib.install import install_tool
-
-        with patch('lib.install.check_src'), \
-             patch('lib.install.ensure_dest_directory'), \
-             patch('lib.install.apply_install_permissions'), \
-             patch('lib.install.check_same_host', return_value=0 if same_host else 1), \
-             patch('lib.install.run_command', return_value=0) as mock_run:
-            install_tool(
-                'synopsys', 'test', 'test6', '/src', group,
-                'yyz2-nfspublish.yyz2.tenstorrent.com',
-                '/tools_vendor/synopsys/test/test6')
-            return mock_run.call_args[0][0]
-
-    def test_install_rsync_uses_chown_without_groupmap(self):
-        """--chown and --groupmap cannot be combined (rsync 3.1.3)."""
-        for same_host in (True, False):
-            command = self._rsync_command_from_install(same_host)
-            self.assertIn('--chown=cadtools:cadtools', command)
-            self.assertNotIn('--groupmap', command)
-
     def test_shell_owner_group_quotes_spaces(self):
         """--group values with spaces (e.g. domain users) must be quoted."""
         from lib.install import shell_owner_group
@@ -188,36 +166,6 @@ class TestCadinstall(unittest.TestCase):
             shell_owner_group('cadtools', 'domain users'),
             "'cadtools:domain users'")
 
-    def test_install_rsync_quotes_group_with_spaces(self):
-        """--group replaces dest_group and is quoted for the shell."""
-        for same_host in (True, False):
-            command = self._rsync_command_from_install(same_host, group='domain users')
-            self.assertIn("--chown='cadtools:domain users'", command)
-            self.assertNotIn('--chown=cadtools:domain users', command)
-
-    def test_apply_install_permissions_quotes_group_with_spaces(self):
-        """Post-rsync chown must quote groups that contain spaces."""
-        from lib.install import apply_install_permissions
-
-        with patch('lib.install.check_same_host', return_value=0), \
-             patch('lib.install.run_command', return_value=0) as mock_run:
-            apply_install_permissions('/dest', 'localhost', 'domain users')
-            commands = [call[0][0] for call in mock_run.call_args_list]
-            chown_cmds = [cmd for cmd in commands if '/usr/bin/chown' in cmd]
-            self.assertEqual(len(chown_cmds), 1)
-            self.assertIn("/usr/bin/chown -R 'cadtools:domain users' /dest", chown_cmds[0])
-
-        with patch('lib.install.check_same_host', return_value=1), \
-             patch('lib.install.run_command', return_value=0) as mock_run:
-            apply_install_permissions('/dest', 'remote.host', 'domain users')
-            commands = [call[0][0] for call in mock_run.call_args_list]
-            chown_cmds = [cmd for cmd in commands if 'chown' in cmd]
-            self.assertEqual(len(chown_cmds), 1)
-            # Entire remote command is quoted so the group survives ssh.
-            self.assertIn('chown', chown_cmds[0])
-            self.assertIn('domain users', chown_cmds[0])
-            self.assertIn("'", chown_cmds[0])
-
 
 if __name__ == '__main__':
     unittest.main()
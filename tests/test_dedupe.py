@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import dedupe
+
+
+def result(complete=True, skipped=False, linked=0):
+    return {'checked': 10, 'hashed': 10, 'stored': 0, 'linked': linked, 'bytes_saved': linked * 100,
+            'complete': complete, 'skipped': skipped, 'failed': 0, 'errors': []}
+
+
+class TestDedupeSite(unittest.TestCase):
+    """Test cases for working through a site's installs"""
+
+    def setUp(self):
+        self.agent = MagicMock()
+        self.installs = ['/tools_vendor/v/a/1', '/tools_vendor/v/b/1', '/tools_vendor/v/c/1']
+        for target, kwargs in (('lib.dedupe.get_agent', {'return_value': self.agent}),
+                               ('lib.dedupe.logger', {}),
+                               ('lib.my_globals.get_pretend', {'return_value': False}),
+                               ('lib.tool_defs.dest', {'new': '/tools_vendor'})):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _calls(self, op):
+        return [call for call in self.agent.call.call_args_list if call[0][0] == op]
+
+    def test_every_install_then_prune(self):
+        results = [result(skipped=True), result(linked=2), result(linked=3)]
+        self.agent.call.side_effect = lambda op, **kwargs: {
+            'find_installs': lambda: self.installs,
+            'dedupe': lambda: results.pop(0),
+            'dedupe_prune': lambda: [4, 4096],
+        }[op]()
+
+        self.assertEqual(dedupe.dedupe_site('nfs.example.com', '/tools_vendor/v', prune=True), 0)
+        self.assertEqual(self._calls('find_installs')[0][1]['max_depth'], 2)
+        self.assertEqual([call[1]['root'] for call in self._calls('dedupe')], self.installs)
+        self.assertEqual(len(self._calls('dedupe_prune')), 1)
+        summary = [call[0][0] for call in dedupe.logger.info.call_args_list if 'installs on' in call[0][0]]
+        self.assertEqual(summary, ['Deduplicated 2 installs on nfs.example.com: 5 files linked to the store, '
+                                   '0 added to it, 500.00 B saved'])
+
+    def test_time_limit_leaves_the_rest_for_later(self):
+        self.agent.call.side_effect = lambda op, **kwargs: {
+            'find_installs': lambda: self.installs,
+            'dedupe': lambda: result(complete=False),
+        }[op]()
+
+        self.assertEqual(dedupe.dedupe_site('nfs.example.com', '/tools_vendor', time_limit=60, prune=True), 0)
+        self.assertEqual(self._calls('find_installs')[0][1]['max_depth'], 3)
+        self.assertEqual(len(self._calls('dedupe')), 1)
+        self.assertLessEqual(self._calls('dedupe')[0][1]['time_limit'], 60)
+        # The store is only pruned after a full pass
+        self.assertEqual(self._calls('dedupe_prune'), [])
+
+    def test_needs_the_helper(self):
+        with patch('lib.dedupe.get_agent', return_value=None):
+            self.assertEqual(dedupe.dedupe_site('nfs.example.com', '/tools_vendor'), 1)
+            self.assertEqual(dedupe.dedupe_tree('/tools_vendor/v/a/1', 'nfs.example.com'), (1, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
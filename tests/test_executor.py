@@ -333,6 +333,31 @@ class TestExecutor(unittest.TestCase):
             self.assertEqual(stdout_lines, [])
 
 
+class TestAllowedCommands(unittest.TestCase):
+    """Test cases for the cached allowlist"""
+
+    def setUp(self):
+        executor._allowed_commands = None
+        executor._allowed_commands_mtime = None
+
+    def tearDown(self):
+        executor._allowed_commands = None
+        executor._allowed_commands_mtime = None
+
+    @patch('lib.executor.logger')
+    def test_allowlist_is_cached_until_mtime_changes(self, mock_logger):
+        stat_result = MagicMock(st_mtime=100.0)
+        with patch('lib.executor.os.stat', return_value=stat_result), \
+             patch('builtins.open', mock_open(read_data="/usr/bin/rsync\n/usr/bin/ssh\n\n")) as mocked:
+            self.assertEqual(executor.get_allowed_commands(), ('/usr/bin/rsync', '/usr/bin/ssh'))
+            self.assertEqual(executor.get_allowed_commands(), ('/usr/bin/rsync', '/usr/bin/ssh'))
+            self.assertEqual(mocked.call_count, 1)
+
+            stat_result.st_mtime = 200.0
+            executor.get_allowed_commands()
+            self.assertEqual(mocked.call_count, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
 
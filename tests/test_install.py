@@ -0,0 +1,132 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.install import install_tool, find_previous_version, apply_install_permissions, add_replication_stages
+from lib.replication import ORIGIN, plan_replication
+from lib.scheduler import StageScheduler
+
+
+class TestInstall(unittest.TestCase):
+    """Test cases for the install commands built in lib/install.py"""
+
+    def _rsync_command_from_install(self, same_host, group='cadtools'):
+        """Run install_tool with mocks and return the rsync command string."""
+        with patch('lib.install.check_src'), \
+             patch('lib.install.ensure_dest_directory'), \
+             patch('lib.install.apply_install_permissions'), \
+             patch('lib.install.check_same_host', return_value=0 if same_host else 1), \
+             patch('lib.install.transfer_rsync_options', return_value='--whole-file'), \
+             patch('lib.install.run_command', return_value=0) as mock_run:
+            install_tool(
+                'synopsys', 'test', 'test6', '/src', group,
+                'yyz2-nfspublish.yyz2.tenstorrent.com',
+                '/tools_vendor/synopsys/test/test6')
+            return mock_run.call_args[0][0]
+
+    def test_install_rsync_uses_chown_without_groupmap(self):
+        """--chown and --groupmap cannot be combined (rsync 3.1.3)."""
+        for same_host in (True, False):
+            command = self._rsync_command_from_install(same_host)
+            self.assertIn('--chown=cadtools:cadtools', command)
+            self.assertNotIn('--groupmap', command)
+
+    def test_install_rsync_quotes_group_with_spaces(self):
+        """--group replaces dest_group and is quoted for the shell."""
+        for same_host in (True, False):
+            command = self._rsync_command_from_install(same_host, group='domain users')
+            self.assertIn("--chown='cadtools:domain users'", command)
+            self.assertNotIn('--chown=cadtools:domain users', command)
+
+    def test_find_previous_version(self):
+        """--link-previous links to the most recently completed other version."""
+        output = ("1700000300.5 /tools_vendor/synopsys/vcs/2023.12-SP1\n"
+                  "1700000200.0 /tools_vendor/synopsys/vcs/2023.12\n"
+                  "1700000100.0 /tools_vendor/synopsys/vcs/2023.03\n")
+        with patch('lib.install.check_same_host', return_value=0), \
+             patch('lib.install.run_command_with_output', return_value=(0, output)) as mock_run:
+            previous = find_previous_version('/tools_vendor/synopsys/vcs/2023.12-SP1/', 'localhost')
+            self.assertEqual(previous, '/tools_vendor/synopsys/vcs/2023.12')
+            command = mock_run.call_args[0][0]
+            self.assertIn('/usr/bin/find /tools_vendor/synopsys/vcs -mindepth 2 -maxdepth 2', command)
+            self.assertIn("-exec /bin/grep -q '^Install completed on' {} \\;", command)
+
+        with patch('lib.install.check_same_host', return_value=0), \
+             patch('lib.install.run_command_with_output', return_value=(1, '')):
+            self.assertIsNone(find_previous_version('/tools_vendor/synopsys/vcs/2024.03', 'localhost'))
+
+    def test_install_links_to_previous_version(self):
+        """The single rsync gets --link-dest and --stats, and the tar stream is skipped."""
+        with patch('lib.install.check_src'), \
+             patch('lib.install.ensure_dest_directory'), \
+             patch('lib.install.apply_install_permissions'), \
+             patch('lib.install.check_same_host', return_value=0), \
+             patch('lib.install.transfer_rsync_options', return_value='--whole-file'), \
+             patch('lib.install.find_previous_version', return_value='/tools_vendor/synopsys/test/test5'), \
+             patch('lib.install.use_tar_stream', return_value=True), \
+             patch('lib.install.use_sharded_transfer', return_value=False), \
+             patch('lib.install.log_link_savings') as mock_savings, \
+             patch('lib.install.run_command_with_output', return_value=(0, 'Total file size: 10 bytes')) as mock_run:
+            install_tool('synopsys', 'test', 'test6', '/src', 'cadtools', 'localhost',
+                         '/tools_vendor/synopsys/test/test6', link_previous=True)
+        command = mock_run.call_args[0][0]
+        self.assertIn('--link-dest=/tools_vendor/synopsys/test/test5 --stats', command)
+        self.assertEqual(mock_savings.call_args[0][0]['total_bytes'], 10)
+
+    def test_apply_install_permissions_quotes_group_with_spaces(self):
+        """Post-rsync chown must quote groups that contain spaces."""
+        with patch('lib.install.get_agent', return_value=None), \
+             patch('lib.install.check_same_host', return_value=0), \
+             patch('lib.install.run_command_with_output', return_value=(0, '')) as mock_run:
+            apply_install_permissions('/dest', 'localhost', 'domain users')
+            # One walk of the tree, not one per chmod/chown
+            self.assertEqual(mock_run.call_count, 1)
+            command = mock_run.call_args[0][0]
+            self.assertTrue(command.startswith('/usr/bin/find /dest '))
+            self.assertIn("-group 'domain users'", command)
+            self.assertIn("/usr/bin/chown -h 'cadtools:domain users' {} +", command)
+
+        with patch('lib.install.get_agent', return_value=None), \
+             patch('lib.install.check_same_host', return_value=1), \
+             patch('lib.install.run_command_with_output', return_value=(0, '')) as mock_run:
+            apply_install_permissions('/dest', 'remote.host', 'domain users')
+            self.assertEqual(mock_run.call_count, 1)
+            command = mock_run.call_args[0][0]
+            # Entire remote command is quoted so the group survives ssh.
+            self.assertIn('remote.host', command)
+            self.assertIn('chown', command)
+            self.assertIn('domain users', command)
+            self.assertIn("'", command)
+
+
+    @patch('lib.install.logger')
+    def test_replication_stages_keep_sources_at_fanout(self, mock_logger):
+        """Each copy depends on its seed's copy and on the copy whose slot it reuses."""
+        bandwidth = {(ORIGIN, 'aus'): 4.0, (ORIGIN, 'yyz'): 1.0, (ORIGIN, 'sjc'): 0.5,
+                     ('aus', 'yyz'): 2.0, ('aus', 'sjc'): 2.0}
+        plan = plan_replication(['aus', 'yyz', 'sjc'], bandwidth, fanout=1)
+        self.assertEqual(plan, [('aus', ORIGIN, None), ('yyz', 'aus', None), ('sjc', 'aus', 'yyz')])
+
+        hosts = {'aus': 'aus-host', 'yyz': 'yyz-host', 'sjc': 'sjc-host'}
+        sched = StageScheduler()
+        stages = add_replication_stages(sched, plan, hosts, 'synopsys', 'vcs', '2024.03', '/src', 'cadtools',
+                                        '/tools_vendor/synopsys/vcs/2024.03', skip_modules=True)
+        copy = dict((site, [s for s in site_stages if s.name == 'copy'][0])
+                    for site, site_stages in stages.items())
+
+        self.assertEqual(copy['aus'].after, [])
+        self.assertEqual(copy['yyz'].deps, [stages['yyz'][0], copy['aus']])
+        self.assertEqual(copy['yyz'].after, [])
+        # aus serves one copy at a time: sjc waits for yyz's copy to finish
+        self.assertEqual(copy['sjc'].deps, [stages['sjc'][0], copy['aus']])
+        self.assertEqual(copy['sjc'].after, [copy['yyz']])
+
+
+if __name__ == '__main__':
+    unittest.main()
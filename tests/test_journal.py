@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import install
+from lib.journal import InstallJournal
+from lib.scheduler import StageScheduler
+
+DEST = '/tools_vendor/v/t/1'
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for target, kwargs in (('lib.tool_defs.journal_dir', {'new': self.tmp.name}),
+                               ('lib.my_globals.get_pretend', {'return_value': False})):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestInstallJournal(JournalTestCase):
+    """Test cases for recording install progress"""
+
+    def test_progress_survives_reload(self):
+        journal = InstallJournal(DEST, 'yyz', '/src')
+        started = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+        journal.set_started_on(started)
+        journal.mark_stage('metadata')
+        journal.mark_shard(2)
+        journal.mark_range('big:10:0', 0)
+        journal.mark_range('big:10:0', 5)
+        journal.mark_file('done:3:0')
+        self.assertEqual(os.listdir(self.tmp.name), ['tools_vendor__v__t__1.yyz.json'])
+
+        loaded = InstallJournal.load(DEST, 'yyz')
+        self.assertEqual(loaded.src, '/src')
+        self.assertEqual(loaded.started_on, started)
+        self.assertTrue(loaded.stage_done('metadata'))
+        self.assertFalse(loaded.complete())
+        self.assertTrue(loaded.shard_done(2))
+        self.assertEqual(loaded.ranges_done('big:10:0'), {0, 5})
+        self.assertTrue(loaded.file_done('done:3:0'))
+        self.assertIsNone(InstallJournal.load(DEST, 'aus'))
+
+        # A new plan forgets the shards copied under the old one
+        loaded.save_plan([8, 800, 4, None], [[0, 8, 800]], [])
+        self.assertFalse(loaded.shard_done(2))
+        self.assertIsNone(loaded.saved_plan([9, 900, 4, None]))
+        with open(loaded.plan_prefix + '.0', 'w'):
+            pass
+        loaded.remove()
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_pretend_writes_nothing(self):
+        with patch('lib.my_globals.get_pretend', return_value=True):
+            InstallJournal(DEST, 'yyz', '/src').mark_stage('metadata')
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+class TestResumedStages(JournalTestCase):
+    """Test cases for skipping the stages a previous run finished"""
+
+    @patch('lib.scheduler.logger')
+    @patch('lib.install.logger')
+    @patch('lib.install.install_module_files', return_value=0)
+    @patch('lib.install.install_tool', return_value=0)
+    @patch('lib.install.write_metadata')
+    def test_finished_stages_are_skipped(self, mock_metadata, mock_install, mock_modules, mock_logger,
+                                         mock_sched_logger):
+        journal = InstallJournal(DEST, 'yyz', '/src')
+        started = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+        journal.set_started_on(started)
+        journal.mark_stage('metadata')
+        journal.mark_stage('copy')
+
+        scheduler = StageScheduler()
+        install.add_site_install_stages(scheduler, 'yyz', 'host', 'v', 't', '1', '/src', 'cadtools', DEST,
+                                        journal=journal)
+        self.assertTrue(scheduler.run())
+
+        mock_install.assert_not_called()
+        mock_modules.assert_called_once()
+        # Only the completion is written, with the start time of the first run
+        mock_metadata.assert_called_once()
+        self.assertEqual(mock_metadata.call_args[0][2], started)
+        self.assertTrue(InstallJournal.load(DEST, 'yyz').complete())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import manifest
+
+
+class TestManifest(unittest.TestCase):
+    """Test cases for the source manifest"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        os.makedirs(os.path.join(self.src, 'bin'))
+        with open(os.path.join(self.src, 'bin', 'tool'), 'wb') as f:
+            f.write(b'x' * 1234)
+        with open(os.path.join(self.src, 'odd\tname\nhere'), 'w') as f:
+            f.write('abc')
+        with open(os.path.join(self.src, 'bin', 'tool.swp'), 'w') as f:
+            f.write('excluded')
+        os.symlink('bin/tool', os.path.join(self.src, 'tool'))
+        self.path = os.path.join(self.tmp.name, 'manifest.gz')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @patch('lib.manifest.logger')
+    def test_build_and_load(self, mock_logger):
+        built = manifest.build_manifest(self.src, self.path, workers=2)
+        entries = dict((entry.path, entry) for entry in built.entries())
+
+        self.assertEqual(set(entries), {'bin', 'bin/tool', 'odd\tname\nhere', 'tool'})
+        self.assertEqual(entries['bin/tool'].type, 'f')
+        self.assertEqual(entries['bin/tool'].size, 1234)
+        self.assertEqual(entries['bin'].type, 'd')
+        self.assertEqual(entries['tool'].type, 'l')
+        self.assertIsNone(entries['bin/tool'].hash)
+
+        loaded = manifest.load_manifest(self.path)
+        self.assertEqual(loaded.root, self.src)
+        self.assertEqual(loaded.size, built.size)
+        self.assertEqual(loaded.totals.files, 2)
+        self.assertEqual(loaded.totals.excluded, 1)
+        self.assertEqual(list(loaded.entries()), list(built.entries()))
+
+    @patch('lib.manifest.logger')
+    def test_rewrite_with_hashes(self, mock_logger):
+        built = manifest.build_manifest(self.src, self.path, workers=2)
+        hashed = [entry._replace(hash='ab' * 8) if entry.type == 'f' else entry for entry in built.entries()]
+        built.write_entries(hashed)
+        self.assertEqual(set(entry.hash for entry in manifest.load_manifest(self.path).files()), {'ab' * 8})
+
+    @patch('lib.manifest.logger')
+    def test_built_once_per_run(self, mock_logger):
+        try:
+            with patch('lib.manifest.scan_tree', wraps=manifest.scan_tree) as mock_scan:
+                first = manifest.get_manifest(self.src)
+                second = manifest.get_manifest(self.src + '/')
+            self.assertIs(first, second)
+            self.assertEqual(mock_scan.call_count, 1)
+        finally:
+            manifest.remove_manifests()
+        self.assertFalse(os.path.exists(first.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import precheck
+
+GB = 1024 * 1024 * 1024
+SITES = {'aus': 'aus-host.example.com', 'yyz': 'yyz-host.example.com'}
+
+
+class TestInstallPrechecks(unittest.TestCase):
+    """Test cases for the concurrent install prechecks"""
+
+    def _run(self, available, exists=(), unwritable=(), skip_modules=False, unreadable=(), check_seeding=False):
+        with patch.dict('lib.precheck.siteHash', SITES, clear=True), \
+             patch('lib.precheck.logger'), \
+             patch('lib.precheck.get_directory_size', return_value=GB), \
+             patch('lib.precheck.find_unreadable_entries', return_value=unreadable), \
+             patch('lib.precheck.get_available_space', side_effect=lambda path, host: available[host]), \
+             patch('lib.precheck.check_dest', side_effect=lambda path, host: 1 if host in exists else 0), \
+             patch('lib.precheck.check_install_permissions', side_effect=lambda path, host: host not in unwritable), \
+             patch('lib.precheck.check_module_permissions', return_value=True) as mock_modules:
+            report = precheck.run_install_prechecks(
+                '/src', ['aus', 'yyz'], 'synopsys', 'vcs', '2023.12', '/tools_vendor',
+                skip_modules=skip_modules, check_seeding=check_seeding)
+            return report, mock_modules
+
+    def test_all_checks_pass(self):
+        report, _ = self._run({SITES['aus']: 10 * GB, SITES['yyz']: 10 * GB})
+        self.assertTrue(report.ok())
+        self.assertEqual(report.passed_sites(), ['aus', 'yyz'])
+        self.assertEqual(set(report.results['aus']),
+                         {'destination', 'install permissions', 'module permissions', 'disk space'})
+
+    def test_failures_are_collected_per_site(self):
+        """Every failing check is reported, not just the first one"""
+        report, _ = self._run({SITES['aus']: 10 * GB, SITES['yyz']: 100},
+                              exists=(SITES['yyz'],))
+        self.assertFalse(report.ok())
+        self.assertEqual(report.failed_sites(), ['yyz'])
+        self.assertEqual(set(check for check, _ in report.failures('yyz')), {'destination', 'disk space'})
+
+    def test_skip_modules(self):
+        report, mock_modules = self._run({SITES['aus']: 10 * GB, SITES['yyz']: 10 * GB}, skip_modules=True)
+        mock_modules.assert_not_called()
+        self.assertNotIn('module permissions', report.results['yyz'])
+
+    def test_missing_seed_trust_does_not_fail_sites(self):
+        """Sites whose hosts cannot ssh to each other still pass; they are just not paired"""
+        with patch('lib.precheck.check_seed_links', return_value=(set(), [('aus', 'yyz'), ('yyz', 'aus')])):
+            report, _ = self._run({SITES['aus']: 10 * GB, SITES['yyz']: 10 * GB}, check_seeding=True)
+        self.assertTrue(report.ok())
+        self.assertEqual(report.seed_links, set())
+        self.assertEqual(report.unreachable_links, [('aus', 'yyz'), ('yyz', 'aus')])
+
+        report, _ = self._run({SITES['aus']: 10 * GB, SITES['yyz']: 10 * GB})
+        self.assertIsNone(report.seed_links)
+
+    def test_unreadable_source_is_critical(self):
+        problems = [('unreadable', '/src/lib/secret.so'), ('broken symlink', '/src/bin/old')]
+        report, _ = self._run({SITES['aus']: 10 * GB, SITES['yyz']: 10 * GB}, unreadable=problems)
+        self.assertFalse(report.ok())
+        self.assertEqual(report.source_problems, problems)
+        self.assertEqual(report.failed_sites(), [])
+
+    def test_unknown_source_size_is_critical(self):
+        with patch.dict('lib.precheck.siteHash', SITES, clear=True), \
+             patch('lib.precheck.logger'), \
+             patch('lib.precheck.get_directory_size', return_value=0), \
+             patch('lib.precheck.find_unreadable_entries', return_value=[]), \
+             patch('lib.precheck.get_available_space', return_value=GB), \
+             patch('lib.precheck.check_dest', return_value=0), \
+             patch('lib.precheck.check_install_permissions', return_value=True), \
+             patch('lib.precheck.check_module_permissions', return_value=True):
+            report = precheck.run_install_prechecks(
+                '/src', ['aus', 'yyz'], 'synopsys', 'vcs', '2023.12', '/tools_vendor')
+        self.assertFalse(report.ok())
+        self.assertTrue(report.errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
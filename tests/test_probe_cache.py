@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import probe_cache
+from lib import utils
+
+
+class TestProbeCache(unittest.TestCase):
+    """Test cases for the run-scoped probe cache"""
+
+    def setUp(self):
+        probe_cache.clear_probe_cache()
+
+    def tearDown(self):
+        probe_cache.clear_probe_cache()
+
+    @patch('lib.probe_cache.socket.getfqdn', return_value='build01.example.com')
+    def test_host_lookup_once(self, mock_getfqdn):
+        self.assertEqual(utils.check_same_host('BUILD01.example.com'), 0)
+        self.assertEqual(utils.check_same_host('site.example.com'), 1)
+        self.assertEqual(mock_getfqdn.call_count, 1)
+
+    def test_probe_runs_once(self):
+        probe = MagicMock(return_value=('/tools_vendor', True))
+        for _ in range(3):
+            result = probe_cache.cached_probe('Site.example.com', 'parent', '/tools_vendor/a/b/1', probe)
+        self.assertEqual(result, ('/tools_vendor', True))
+        self.assertEqual(probe.call_count, 1)
+
+    def test_invalidation(self):
+        probe = MagicMock(return_value=True)
+        paths = ['/tools_vendor/a', '/tools_vendor/a/b/1', '/tools_vendor/ab', '/modules/a']
+        for path in paths:
+            probe_cache.cached_probe('site', 'exists', path, probe)
+        probe_cache.cached_probe('site', 'ancestor', '/modules/a', probe)
+        probe_cache.cached_probe('other', 'exists', '/tools_vendor/a/b', probe)
+
+        probe_cache.invalidate_probes('site', '/tools_vendor/a/b')
+
+        remaining = set(probe_cache._probes)
+        self.assertEqual(remaining, {('site', 'exists', '/tools_vendor/ab'),
+                                     ('site', 'exists', '/modules/a'),
+                                     ('other', 'exists', '/tools_vendor/a/b')})
+
+
+class TestResolveExistingAncestor(unittest.TestCase):
+    """Test cases for the one round trip ancestor resolver"""
+
+    def setUp(self):
+        probe_cache.clear_probe_cache()
+
+    def tearDown(self):
+        probe_cache.clear_probe_cache()
+
+    @patch('lib.utils.get_agent', return_value=None)
+    @patch('lib.utils.check_same_host', return_value=1)
+    def test_space_and_permissions_share_one_call(self, mock_same_host, mock_agent):
+        output = ("/tools_vendor/synopsys\n1\n"
+                  "Filesystem 1-blocks Used Available Capacity Mounted on\n"
+                  "nfs:/tools 1000000 400000 600000 40% /tools_vendor\n")
+        with patch('lib.utils.run_command_with_output', return_value=(0, output)) as mock_run, \
+             patch('lib.utils.logger'):
+            from lib.install import find_existing_parent
+            path = '/tools_vendor/synopsys/vcs/2023.12'
+            self.assertEqual(utils.get_available_space(path, 'site.example.com'), 600000)
+            self.assertEqual(find_existing_parent(path, 'site.example.com'), ('/tools_vendor/synopsys', True))
+
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertTrue(mock_run.call_args[0][0].startswith('/usr/bin/ssh site.example.com '))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import progress
+from lib import install
+
+GB = 1024 ** 3
+
+
+class TestTransferProgress(unittest.TestCase):
+    """Test cases for transfer throughput and ETA reporting"""
+
+    def setUp(self):
+        patcher = patch('lib.progress.logger')
+        self.mock_logger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse_progress2(self):
+        line = "  1,234,567  45%   12.34MB/s    0:01:23 (xfr#12, to-chk=100/2000)"
+        self.assertEqual(progress.parse_progress2(line), (1234567, 45, 12))
+        self.assertEqual(progress.parse_progress2("      32,768   0%    0.00kB/s    0:00:00  "), (32768, 0, 0))
+        self.assertIsNone(progress.parse_progress2("bin/tool"))
+        self.assertIsNone(progress.parse_progress2("sent 1,234 bytes  received 56 bytes  2,580.00 bytes/sec"))
+
+    @patch('lib.progress.rsync_version')
+    def test_progress2_needs_rsync_3_1(self, mock_version):
+        mock_version.return_value = (3, 0, 9)
+        self.assertEqual(progress.progress_rsync_options('yyz-host'), '')
+        mock_version.return_value = (3, 2, 7)
+        self.assertEqual(progress.progress_rsync_options('yyz-host'), '--info=progress2')
+        mock_version.return_value = None
+        self.assertEqual(progress.progress_rsync_options(), '')
+
+    @patch('lib.progress.time.monotonic', return_value=1000.0)
+    def test_snapshot_rates_and_eta(self, mock_time):
+        tracker = progress.TransferProgress('/tools_vendor/v/t/1', 'yyz', 4 * GB, 400, interval=0)
+        output = tracker.rsync_output(('shard', 0))
+        output("bin/tool")
+        output("  1,073,741,824  50%   12.34MB/s    0:01:23 (xfr#100, to-chk=100/200)")
+        tracker.add(('file', 'big'), GB)
+        self.assertEqual(tracker.totals(), (2 * GB, 100))
+        # Per-file lines only reach the log file
+        self.mock_logger.debug.assert_called_once_with("bin/tool")
+
+        self.assertEqual(tracker.snapshot(now=1100.0),
+                         "Progress to yyz: 2.00 GB of 4.00 GB (50%), 100 of 400 files, "
+                         "20.48 MB/s, 1 files/s, ETA 0:01:40")
+        # Rates cover the time since the previous snapshot
+        tracker.complete(('shard', 0), GB, 150)
+        self.assertIn("150 of 400 files, 0.00 B/s, 5 files/s, ETA 0:01:50", tracker.snapshot(now=1110.0))
+
+    @patch('lib.progress.time.monotonic')
+    def test_snapshots_are_throttled(self, mock_time):
+        mock_time.return_value = 1000.0
+        tracker = progress.TransferProgress('/d', 'yyz', 100, 10, interval=30)
+        for now in (1010.0, 1031.0, 1040.0, 1062.0):
+            mock_time.return_value = now
+            tracker.add('rsync', 1, 1)
+        self.assertEqual(self.mock_logger.info.call_count, 2)
+
+    @patch('lib.progress.time.monotonic', return_value=1000.0)
+    def test_finish_summary_goes_to_metadata(self, mock_time):
+        tracker = progress.TransferProgress('/tools_vendor/v/t/2', 'aus', interval=0)
+        tracker.complete('tar', 3 * GB, 300)
+        mock_time.return_value = 1060.0
+        summary = tracker.finish()
+        self.assertEqual(summary, "3.00 GB, 300 files in 0:01:00 (51.20 MB/s, 5 files/s)")
+        self.assertEqual(progress.transfer_summary('/tools_vendor/v/t/2', 'aus'), summary)
+        self.assertIsNone(progress.transfer_summary('/tools_vendor/v/t/2', 'yyz'))
+
+        now = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+        lines = install._build_metadata_lines('someone', now, now, summary)
+        self.assertIn("Transfer: %s\n" % summary, lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+import hashlib
+import pwd
+import grp
+import stat
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import remote_agent
+from lib.remote_agent import RemoteAgent, AgentError, BOOTSTRAP
+
+
+class LocalAgent(RemoteAgent):
+    """Runs the helper with this python instead of over ssh"""
+
+    def _command(self):
+        return [sys.executable, '-u', '-c', BOOTSTRAP]
+
+
+class TestRemoteAgent(unittest.TestCase):
+    """Test cases for the remote helper agent and its protocol"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.agent = LocalAgent('localhost')
+        with patch('lib.remote_agent.logger'):
+            self.agent.start()
+
+    def tearDown(self):
+        self.agent.close()
+        self.tmp.cleanup()
+
+    def test_stat_and_access(self):
+        self.assertIsNone(self.agent.call('stat', path=os.path.join(self.root, 'missing')))
+        info = self.agent.call('stat', path=self.root)
+        self.assertEqual(info['type'], 'dir')
+        self.assertTrue(self.agent.call('access', path=self.root, mode='w'))
+        self.assertIn('available', self.agent.call('statvfs', path=self.root))
+
+    def test_mkdir_symlink_and_walk(self):
+        module_dir = os.path.join(self.root, 'synopsys', 'vcs')
+        module_file = os.path.join(module_dir, '2023.12')
+        self.agent.call('mkdir', path=module_dir, mode=0o755, parents=True)
+        self.agent.call('symlink', target='commonModuleFile', path=module_file, replace=True)
+        # Replacing an existing link must not fail.
+        self.agent.call('symlink', target='commonModuleFile', path=module_file, replace=True)
+
+        self.assertEqual(os.readlink(module_file), 'commonModuleFile')
+        entries = dict((e['path'], e['type']) for e in self.agent.call('walk', path=self.root))
+        self.assertEqual(entries, {
+            'synopsys': 'dir',
+            os.path.join('synopsys', 'vcs'): 'dir',
+            os.path.join('synopsys', 'vcs', '2023.12'): 'link',
+        })
+
+    def test_resolve(self):
+        resolved = self.agent.call('resolve', path=os.path.join(self.root, 'synopsys', 'vcs', '2023.12'))
+        self.assertEqual(resolved['path'], self.root)
+        self.assertTrue(resolved['writable'])
+        self.assertGreater(resolved['available'], 0)
+
+    def test_lstat_many_and_hash(self):
+        for name, data in (('a', b'one'), ('b', b'two')):
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(data)
+        os.mkdir(os.path.join(self.root, 'dir'))
+
+        stats = self.agent.call('lstat_many', root=self.root, paths=['a', 'dir', 'missing'])
+        self.assertEqual(stats[0][:2], ['f', 3])
+        self.assertEqual(stats[1][0], 'd')
+        self.assertIsNone(stats[2])
+        os.symlink('a', os.path.join(self.root, 'link'))
+        stats = self.agent.call('lstat_many', root=self.root, paths=['link', 'a'], readlink=True)
+        self.assertEqual((stats[0][0], stats[0][5]), ('l', 'a'))
+        self.assertIsNone(stats[1][5])
+
+        hashes = self.agent.call('hash', root=self.root, paths=['a', 'b', 'missing'], workers=2)
+        self.assertEqual(hashes[0], [hashlib.blake2b(b'one', digest_size=32).hexdigest(), None])
+        self.assertNotEqual(hashes[0][0], hashes[1][0])
+        self.assertIsNone(hashes[2][0])
+        self.assertIsNotNone(hashes[2][1])
+
+    def test_fixperms_only_changes_what_differs(self):
+        owner = pwd.getpwuid(os.getuid()).pw_name
+        group = grp.getgrgid(os.getgid()).gr_name
+        os.mkdir(os.path.join(self.root, 'sub'), 0o775)
+        for name, mode in (('data', 0o664), ('tool', 0o775), ('ok', 0o644)):
+            path = os.path.join(self.root, 'sub', name)
+            with open(path, 'w') as f:
+                f.write(name)
+            os.chmod(path, mode)
+        os.chmod(os.path.join(self.root, 'sub'), 0o775)
+
+        root = os.path.join(self.root, 'sub')
+        result = self.agent.call('fixperms', path=root, owner=owner, group=group, dir_mode=0o2755)
+        self.assertEqual((result['checked'], result['changed'], result['errors']), (4, 3, []))
+        self.assertEqual(stat.S_IMODE(os.stat(root).st_mode), 0o2755)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(root, 'data')).st_mode), 0o644)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(root, 'tool')).st_mode), 0o755)
+
+        result = self.agent.call('fixperms', path=root, owner=owner, group=group, dir_mode=0o2755)
+        self.assertEqual(result['changed'], 0)
+
+        # Only the listed entries are checked
+        for name in ('data', 'ok'):
+            os.chmod(os.path.join(root, name), 0o664)
+        result = self.agent.call('fixperms', path=root, owner=owner, group=group, dir_mode=0o2755,
+                                 paths=['data', 'gone'])
+        self.assertEqual((result['checked'], result['changed'], result['failed']), (1, 1, 1))
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(root, 'data')).st_mode), 0o644)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(root, 'ok')).st_mode), 0o664)
+
+    def test_dedupe_links_identical_files(self):
+        store = os.path.join(self.root, '.cadinstall.store')
+        runtime = os.urandom(4096)
+        for tool in ('a', 'b'):
+            install = os.path.join(self.root, 'vendor', tool, '1')
+            os.makedirs(os.path.join(install, 'jre'))
+            for name, data, mode in (('jre/libjvm.so', runtime, 0o755), ('own', tool.encode() * 100, 0o644),
+                                     ('libjvm.copy', runtime, 0o644)):
+                with open(os.path.join(install, name), 'wb') as f:
+                    f.write(data)
+                os.chmod(os.path.join(install, name), mode)
+                # As copied by rsync from sources with the same mtimes
+                os.utime(os.path.join(install, name), ns=(0, 1700000000123456789))
+            with open(os.path.join(install, '.cadinstall.metadata'), 'w') as f:
+                f.write('Installed by: someone\nInstall completed on: now\n')
+        os.makedirs(os.path.join(self.root, 'vendor', 'c', '2'))
+
+        installs = self.agent.call('find_installs', root=self.root, max_depth=3, skip=[store])
+        self.assertEqual(installs, [os.path.join(self.root, 'vendor', tool, '1') for tool in ('a', 'b')])
+
+        first = self.agent.call('dedupe', root=installs[0], store=store, min_bytes=1)
+        self.assertEqual((first['checked'], first['stored'], first['linked'], first['errors']), (3, 3, 0, []))
+        second = self.agent.call('dedupe', root=installs[1], store=store, min_bytes=1)
+        self.assertEqual((second['checked'], second['stored'], second['linked']), (3, 1, 2))
+        self.assertEqual(second['bytes_saved'], 2 * 4096)
+
+        a, b = (os.path.join(path, 'jre', 'libjvm.so') for path in installs)
+        self.assertEqual(os.stat(a).st_ino, os.stat(b).st_ino)
+        self.assertEqual(stat.S_IMODE(os.stat(b).st_mode), 0o755)
+        # Same contents with another mode is a separate store entry
+        self.assertNotEqual(os.stat(a).st_ino, os.stat(os.path.join(installs[1], 'libjvm.copy')).st_ino)
+
+        # So is another mtime: linking never changes a file's mtime
+        install = os.path.join(self.root, 'vendor', 'd', '1')
+        os.makedirs(install)
+        newer = os.path.join(install, 'libjvm.so')
+        with open(newer, 'wb') as f:
+            f.write(runtime)
+        os.chmod(newer, 0o755)
+        os.utime(newer, ns=(0, 1717200000000000000))
+        third = self.agent.call('dedupe', root=install, store=store, min_bytes=1)
+        self.assertEqual((third['stored'], third['linked']), (1, 0))
+        self.assertEqual(os.stat(newer).st_mtime_ns, 1717200000000000000)
+        self.assertNotEqual(os.stat(newer).st_ino, os.stat(a).st_ino)
+
+        # Done installs are skipped; nothing is hashed again when forced
+        self.assertTrue(self.agent.call('dedupe', root=installs[1], store=store, min_bytes=1)['skipped'])
+        again = self.agent.call('dedupe', root=installs[1], store=store, min_bytes=1, force=True)
+        self.assertEqual((again['hashed'], again['linked'], again['stored']), (0, 0, 0))
+
+        # Entries only linked from a removed install are pruned
+        for dirpath, _, filenames in os.walk(installs[0]):
+            for name in filenames:
+                os.unlink(os.path.join(dirpath, name))
+        self.assertEqual(self.agent.call('dedupe_prune', store=store), [1, 100])
+
+    def test_errors_are_reported(self):
+        with self.assertRaises(AgentError):
+            self.agent.call('statvfs', path=os.path.join(self.root, 'missing'))
+        with self.assertRaises(AgentError):
+            self.agent.call('no_such_op')
+        # The agent keeps serving after an error.
+        self.assertTrue(self.agent.call('access', path=self.root, mode='r'))
+
+    @patch('lib.remote_agent.get_execution_mode', return_value='listener')
+    def test_no_agent_in_listener_mode(self, mock_mode):
+        self.assertIsNone(remote_agent.get_agent('remote.example.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import replication
+from lib.replication import ORIGIN, plan_replication
+
+
+class TestReplicationPlanner(unittest.TestCase):
+    """Test cases for the site-to-site seeding planner"""
+
+    def test_single_site_copies_from_origin(self):
+        self.assertEqual(plan_replication(['yyz'], {}), [('yyz', ORIGIN, None)])
+
+    def test_fastest_link_is_chosen_as_source(self):
+        """A site is seeded from the peer with the best link, not list order"""
+        bandwidth = {
+            (ORIGIN, 'aus'): 100.0,
+            (ORIGIN, 'yyz'): 10.0,
+            ('aus', 'yyz'): 1000.0,
+        }
+        plan = plan_replication(['yyz', 'aus'], bandwidth, fanout=2)
+        self.assertEqual(plan, [('aus', ORIGIN, None), ('yyz', 'aus', None)])
+
+    def test_fan_out_grows_logarithmically(self):
+        """With fanout 1 and equal links the number of sources doubles each round"""
+        sites = ['s%d' % i for i in range(7)]
+        bandwidth = {}
+        for a in [ORIGIN] + sites:
+            for b in sites:
+                if a != b:
+                    bandwidth[(a, b)] = 1.0
+        plan = plan_replication(sites, bandwidth, fanout=1)
+
+        depth = {ORIGIN: 0}
+        for site, source, _ in plan:
+            depth[site] = depth[source] + 1
+        # 7 sites with doubling sources finish in 3 rounds, not 7.
+        self.assertEqual(max(depth.values()), 3)
+
+    def test_reused_slot_waits_for_its_holder(self):
+        """A copy that reuses a source's slot names the copy that held it"""
+        bandwidth = {(ORIGIN, 'aus'): 2.0, (ORIGIN, 'yyz'): 1.0, (ORIGIN, 'sjc'): 1.0}
+        plan = plan_replication(['aus', 'yyz', 'sjc'], bandwidth, fanout=1, can_seed=False)
+        self.assertEqual(plan, [('aus', ORIGIN, None), ('yyz', ORIGIN, 'aus'), ('sjc', ORIGIN, 'yyz')])
+
+    def test_no_seeding_when_sites_cannot_be_sources(self):
+        plan = plan_replication(['aus', 'yyz'], {('aus', 'yyz'): 1e9}, fanout=1, can_seed=False)
+        self.assertEqual([source for _, source, _ in plan], [ORIGIN, ORIGIN])
+
+    def test_zero_fanout_copies_everything_from_origin(self):
+        plan = plan_replication(['aus', 'yyz', 'sjc'], {('aus', 'yyz'): 1e9}, fanout=0)
+        self.assertEqual([(source, after) for _, source, after in plan], [(ORIGIN, None)] * 3)
+
+    @patch('lib.replication.logger')
+    @patch('lib.replication.run_command_with_output', return_value=(0, ''))
+    def test_same_host_sites_are_not_probed(self, mock_run, mock_logger):
+        """Two sites served by one host get an infinite link without probing"""
+        replication._bandwidth_cache.clear()
+        hosts = {'a': 'h1.example.com', 'b': 'h1.example.com'}
+        with patch('lib.replication.measure_link_bandwidth', return_value=5.0) as mock_measure:
+            table = replication.measure_site_bandwidth(['a', 'b'], hosts)
+        self.assertEqual(table[('a', 'b')], float('inf'))
+        probed = [call[0] for call in mock_measure.call_args_list]
+        self.assertEqual(len(probed), 2)  # origin -> a, origin -> b
+
+    @patch('lib.replication.ssh_prefix', side_effect=lambda host: '/usr/bin/ssh ' + host)
+    def test_probes_push_towards_the_target(self, mock_prefix):
+        """Every probe sends data in the direction the install copy will"""
+        self.assertEqual(replication._probe_command(None, 'aus-host', 1024),
+                         "/usr/bin/head -c 1024 /dev/zero | /usr/bin/ssh aus-host '/bin/cat > /dev/null'")
+        self.assertEqual(replication._probe_command('aus-host', 'yyz-host', 1024),
+                         "/usr/bin/ssh aus-host '/usr/bin/head -c 1024 /dev/zero | "
+                         "/usr/bin/ssh yyz-host \"/bin/cat > /dev/null\"'")
+
+    def test_unreachable_pairs_copy_from_origin(self):
+        """Sites without ssh trust between them are not paired, whatever the bandwidth"""
+        bandwidth = {(ORIGIN, 'aus'): 100.0, (ORIGIN, 'yyz'): 10.0, ('aus', 'yyz'): 1000.0}
+        plan = plan_replication(['yyz', 'aus'], bandwidth, fanout=2, links={('yyz', 'aus')})
+        self.assertEqual(plan, [('aus', ORIGIN, None), ('yyz', ORIGIN, None)])
+
+    def test_check_seed_links(self):
+        """Each host pair is checked once; same-host sites need no check"""
+        hosts = {'aus': 'aus-host', 'yyz': 'yyz-host', 'yyz2': 'YYZ-host'}
+
+        def fake_run(command, **kwargs):
+            return (255 if 'aus-host' in command.split("'")[0] else 0), ''
+
+        with patch('lib.replication.run_command_with_output', side_effect=fake_run) as mock_run:
+            links, unreachable = replication.check_seed_links(['aus', 'yyz', 'yyz2'], hosts)
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertIn('-o BatchMode=yes', mock_run.call_args[0][0])
+        self.assertEqual(links, {('yyz', 'aus'), ('yyz2', 'aus'), ('yyz', 'yyz2'), ('yyz2', 'yyz')})
+        self.assertEqual(sorted(unreachable), [('aus', 'yyz'), ('aus', 'yyz2')])
+
+        with patch('lib.replication.measure_link_bandwidth', return_value=5.0) as mock_measure:
+            table = replication.measure_site_bandwidth(['aus', 'yyz'], hosts, links=links)
+        self.assertNotIn(('aus', 'yyz'), table)
+        self.assertEqual(mock_measure.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import json
+import asyncio
+import subprocess
+import threading
+import socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import utils
+from lib import executor
+
+
+class TestCommandEngine(unittest.TestCase):
+    """Test cases for argv execution in setuid mode"""
+
+    def setUp(self):
+        executor._execution_mode = 'setuid'
+        executor._sudo_path = '/opt/cadinstall/bin/.sudo'
+
+    def tearDown(self):
+        executor._execution_mode = None
+        executor._sudo_path = None
+
+    def test_split_plain_command(self):
+        self.assertEqual(utils.split_command("/usr/bin/chmod -R 755 /tools_vendor/a"),
+                         ['/usr/bin/chmod', '-R', '755', '/tools_vendor/a'])
+        self.assertEqual(utils.split_command("/usr/bin/ssh host '/bin/test -d /x && /bin/test -L /y'"),
+                         ['/usr/bin/ssh', 'host', '/bin/test -d /x && /bin/test -L /y'])
+
+    def test_split_needs_shell(self):
+        for command in ["/usr/bin/find /x | /usr/bin/wc -l",
+                        "/usr/bin/du -sb /x 2>/dev/null",
+                        "/usr/bin/ls /x/*",
+                        "/bin/test -d /x && /usr/bin/rm -rf /x",
+                        '/usr/bin/mkdir "$HOME/x"']:
+            self.assertIsNone(utils.split_command(command), command)
+
+    def test_argv_wraps_only_first_allowed_command(self):
+        popen_args, use_shell, _, is_setuid = utils.prepare_setuid_command(
+            "/usr/bin/ssh host /usr/bin/mkdir -p /tools_vendor/a")
+        self.assertFalse(use_shell)
+        self.assertTrue(is_setuid)
+        self.assertEqual(popen_args, ['/opt/cadinstall/bin/.sudo', '/usr/bin/ssh', 'host',
+                                      '/usr/bin/mkdir', '-p', '/tools_vendor/a'])
+
+    def test_argv_not_allowed_runs_as_user(self):
+        popen_args, use_shell, _, is_setuid = utils.prepare_setuid_command("/usr/bin/dnsdomainname")
+        self.assertFalse(use_shell)
+        self.assertFalse(is_setuid)
+        self.assertEqual(popen_args, ['/usr/bin/dnsdomainname'])
+
+    def test_ssh_remote_command_is_not_wrapped(self):
+        """Allowed commands inside the quoted remote command of an ssh already run as cadtools"""
+        with patch('lib.utils.get_allowed_commands', return_value=['/usr/bin/dd', '/usr/bin/ssh', '/usr/bin/rsync']):
+            popen_args, use_shell, _, is_setuid = utils.prepare_setuid_command(
+                "/usr/bin/dd if=/src/a bs=4M | /usr/bin/ssh -o ControlPath=none -c aes128-gcm@openssh.com host "
+                "'/usr/bin/dd of='\"'\"'/dest/it'\"'\"'s'\"'\"' seek=0'")
+            self.assertTrue(use_shell)
+            self.assertEqual(popen_args,
+                             "/opt/cadinstall/bin/.sudo /usr/bin/dd if=/src/a bs=4M | "
+                             "/opt/cadinstall/bin/.sudo /usr/bin/ssh -o ControlPath=none -c aes128-gcm@openssh.com host "
+                             "'/usr/bin/dd of='\"'\"'/dest/it'\"'\"'s'\"'\"' seek=0'")
+
+            # The ssh of an rsync --rsh option is left alone too
+            popen_args, _, _, _ = utils.prepare_setuid_command(
+                "/usr/bin/rsync -a --rsh='/usr/bin/ssh -c aes128' /src/ host:/dest/ && /usr/bin/ssh host '/usr/bin/dd'")
+            self.assertEqual(popen_args,
+                             "/opt/cadinstall/bin/.sudo /usr/bin/rsync -a --rsh='/usr/bin/ssh -c aes128' /src/ host:/dest/ "
+                             "&& /opt/cadinstall/bin/.sudo /usr/bin/ssh host '/usr/bin/dd'")
+
+    def test_shell_fallback_keeps_rewriting(self):
+        popen_args, use_shell, _, is_setuid = utils.prepare_setuid_command(
+            "/bin/test -d /x && /usr/bin/rm -rf /x")
+        self.assertTrue(use_shell)
+        self.assertTrue(is_setuid)
+        self.assertEqual(popen_args, "/opt/cadinstall/bin/.sudo /bin/test -d /x && "
+                                     "/opt/cadinstall/bin/.sudo /usr/bin/rm -rf /x")
+
+    @patch('lib.utils.logger')
+    @patch('subprocess.Popen', side_effect=FileNotFoundError(2, 'No such file or directory'))
+    def test_missing_executable(self, mock_popen, mock_logger):
+        self.assertEqual(utils.run_command("/usr/bin/does-not-exist"), 127)
+        mock_logger.error.assert_called_once()
+
+
+class TestStreamProcessOutput(unittest.TestCase):
+    """Test cases for draining stdout and stderr together"""
+
+    def run_child(self, script):
+        stdout, stderr = [], []
+        process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with process:
+            utils.stream_process_output(process, stdout.append, stderr.append)
+        return process.returncode, stdout, stderr
+
+    def test_large_stderr_does_not_stall(self):
+        """A child filling the stderr pipe before writing stdout must not block"""
+        script = ("import sys\n"
+                  "for i in range(20000): sys.stderr.write('err %d\\n' % i)\n"
+                  "sys.stderr.flush()\n"
+                  "print('done')\n")
+        returncode, stdout, stderr = self.run_child(script)
+        self.assertEqual(returncode, 0)
+        self.assertEqual(stdout, ['done'])
+        self.assertEqual(len(stderr), 20000)
+        self.assertEqual(stderr[-1], 'err 19999')
+
+    def test_long_line_is_split(self):
+        script = "import sys; sys.stdout.write('x' * %d)" % (utils.MAX_LINE_LENGTH * 2 + 10)
+        returncode, stdout, stderr = self.run_child(script)
+        self.assertEqual([len(line) for line in stdout], [utils.MAX_LINE_LENGTH, utils.MAX_LINE_LENGTH, 10])
+        self.assertEqual(stderr, [])
+
+    def test_carriage_returns_end_lines(self):
+        """rsync --info=progress2 rewrites its progress line with \\r"""
+        script = "import sys; sys.stdout.write('10%\\r20%\\r\\r\\nfile\\n'); sys.stdout.flush()"
+        returncode, stdout, stderr = self.run_child(script)
+        self.assertEqual(stdout, ['10%', '20%', '', 'file'])
+
+
+class TestRunCommandAsync(unittest.TestCase):
+    """Test cases for the asyncio execution API"""
+
+    def setUp(self):
+        executor._execution_mode = 'setuid'
+        executor._sudo_path = '/opt/cadinstall/bin/.sudo'
+
+    def tearDown(self):
+        executor._execution_mode = None
+        executor._sudo_path = None
+        executor._listener_config = None
+
+    def python_command(self, code):
+        return "%s -c %s" % (sys.executable, utils.shlex.quote(code))
+
+    @patch('lib.utils.logger')
+    def test_gather_keeps_order(self, mock_logger):
+        commands = [self.python_command("import time; time.sleep(%s); print(%d)" % (0.2 - i * 0.05, i)) for i in range(4)]
+        results = utils.run_commands_concurrently(commands, log_stdout=False)
+        self.assertEqual(results, [(0, str(i)) for i in range(4)])
+
+    @patch('lib.utils.logger')
+    def test_timeout_kills_command(self, mock_logger):
+        command = self.python_command("import time; print('started', flush=True); time.sleep(30)")
+        status, output = asyncio.run(utils.run_command_async(command, log_stdout=False, timeout=0.5))
+        self.assertEqual(status, utils.TIMEOUT_STATUS)
+        self.assertEqual(output, 'started')
+
+    @patch('lib.utils.logger')
+    def test_cancel_propagates(self, mock_logger):
+        async def main():
+            task = asyncio.ensure_future(utils.run_command_async(self.python_command("import time; time.sleep(30)")))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+
+    @patch('lib.executor.logger')
+    @patch('lib.utils.logger')
+    def test_listener_mode(self, mock_utils_logger, mock_executor_logger):
+        async def handle(reader, writer):
+            request = json.loads(await reader.readline())
+            for message in [{'type': 'stdout', 'data': request['command']},
+                            {'type': 'stderr', 'data': 'warning'},
+                            {'type': 'exit_code', 'data': 3}]:
+                writer.write(json.dumps(message).encode('utf-8') + b'\n')
+            await writer.drain()
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            executor._execution_mode = 'listener'
+            executor._listener_config = {'host': '127.0.0.1', 'port': server.sockets[0].getsockname()[1]}
+            async with server:
+                return await utils.run_command_async('/usr/bin/ls /tools_vendor')
+
+        self.assertEqual(asyncio.run(main()), (3, '/usr/bin/ls /tools_vendor'))
+        mock_executor_logger.error.assert_called_with('warning')
+
+
+    @patch('lib.executor.current_host', return_value='localhost')
+    @patch('lib.executor.logger')
+    @patch('lib.utils.logger')
+    def test_listener_stdout_reaches_on_stdout(self, mock_utils_logger, mock_executor_logger, mock_host):
+        """Progress lines from the listener go to on_stdout in every run helper"""
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.rfile.readline()
+                for message in [{'type': 'stdout', 'data': '  1,024  50%'},
+                                {'type': 'stdout', 'data': '  2,048 100%'},
+                                {'type': 'exit_code', 'data': 0}]:
+                    self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.addCleanup(server.server_close)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        executor._execution_mode = 'listener'
+        executor._listener_config = {'host': '127.0.0.1', 'port': server.server_address[1]}
+
+        lines = []
+        self.assertEqual(utils.run_command('/usr/bin/rsync -a /a /b', on_stdout=lines.append), 0)
+        self.assertEqual(utils.run_command_with_output('/usr/bin/rsync -a /a /b', on_stdout=lines.append),
+                         (0, '  1,024  50%\n  2,048 100%'))
+        asyncio.run(utils.run_command_async('/usr/bin/rsync -a /a /b', on_stdout=lines.append))
+        self.assertEqual(lines, ['  1,024  50%', '  2,048 100%'] * 3)
+        mock_executor_logger.info.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import scheduler
+from lib.scheduler import StageScheduler
+
+
+class TestStageScheduler(unittest.TestCase):
+    """Test cases for the install stage scheduler"""
+
+    @patch('lib.scheduler.logger')
+    def test_dependencies_run_in_order(self, mock_logger):
+        """A stage only starts after every stage it depends on has finished"""
+        order = []
+        sched = StageScheduler(site_concurrency=2)
+        first = sched.add_stage('yyz', 'first', order.append, 'first')
+        second = sched.add_stage('yyz', 'second', order.append, 'second', deps=[first])
+        sched.add_stage('yyz', 'third', order.append, 'third', deps=[second])
+
+        self.assertTrue(sched.run())
+        self.assertEqual(order, ['first', 'second', 'third'])
+
+    @patch('lib.scheduler.logger')
+    def test_sites_run_concurrently(self, mock_logger):
+        """Independent sites overlap instead of running one after another"""
+        barrier = threading.Barrier(2, timeout=5)
+
+        def copy():
+            barrier.wait()
+
+        sched = StageScheduler(site_concurrency=1)
+        sched.add_stage('aus', 'copy', copy)
+        sched.add_stage('yyz', 'copy', copy)
+
+        # Both stages must be in flight at once or the barrier times out.
+        self.assertTrue(sched.run())
+
+    @patch('lib.scheduler.logger')
+    def test_site_concurrency_limit(self, mock_logger):
+        """No more than site_concurrency stages run at once for one site"""
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+        sched = StageScheduler(site_concurrency=2)
+        for i in range(5):
+            sched.add_stage('yyz', 'stage%d' % i, work)
+
+        self.assertTrue(sched.run())
+        self.assertLessEqual(max(peak), 2)
+
+    @patch('lib.scheduler.logger')
+    def test_failure_skips_dependents_only(self, mock_logger):
+        """A failed stage (including sys.exit) skips its dependents, not other sites"""
+        def fail():
+            sys.exit(1)
+
+        ran = []
+        sched = StageScheduler()
+        copy = sched.add_stage('aus', 'copy', fail)
+        sched.add_stage('aus', 'modules', ran.append, 'aus', deps=[copy])
+        sched.add_stage('yyz', 'copy', ran.append, 'yyz')
+
+        self.assertFalse(sched.run())
+        self.assertEqual(ran, ['yyz'])
+        self.assertEqual(sched.failed_sites(), ['aus'])
+        self.assertEqual(sched.stages[1].state, scheduler.SKIPPED)
+
+    @patch('lib.scheduler.logger')
+    def test_after_waits_for_failed_stages_too(self, mock_logger):
+        """A stage ordered after another runs once it finishes, even if it failed"""
+        order = []
+
+        def fail():
+            order.append('aus')
+            return 1
+
+        sched = StageScheduler()
+        copy = sched.add_stage('aus', 'copy', fail)
+        sched.add_stage('yyz', 'copy', order.append, 'yyz', after=[copy])
+        self.assertFalse(sched.run())
+        self.assertEqual(order, ['aus', 'yyz'])
+        self.assertEqual(sched.failed_sites(), ['aus'])
+
+    @patch('lib.scheduler.logger')
+    def test_nonzero_status_is_failure(self, mock_logger):
+        """Helpers that return a non-zero status mark the stage failed"""
+        sched = StageScheduler()
+        sched.add_stage('yyz', 'modules', lambda: 1)
+        self.assertFalse(sched.run())
+        self.assertEqual(sched.stages[0].state, scheduler.FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import ssh_pool
+from lib import executor
+from lib import utils
+
+
+class TestSshPool(unittest.TestCase):
+    """Test cases for pooled ssh connections"""
+
+    def tearDown(self):
+        ssh_pool._control_dir = None
+        ssh_pool._masters.clear()
+        executor._execution_mode = None
+        executor._sudo_path = None
+
+    def test_prefix_without_pool(self):
+        self.assertEqual(ssh_pool.ssh_prefix('host.example.com'), '/usr/bin/ssh host.example.com')
+        self.assertEqual(ssh_pool.rsync_rsh_option(), '')
+
+    def test_prefix_with_pool(self):
+        ssh_pool._control_dir = '/tmp/cadinstall.ssh.test.1'
+        prefix = ssh_pool.ssh_prefix('host.example.com')
+        self.assertTrue(prefix.startswith('/usr/bin/ssh -o ControlMaster=auto'))
+        self.assertIn('ControlPath=/tmp/cadinstall.ssh.test.1/%C', prefix)
+        self.assertTrue(prefix.endswith(' host.example.com'))
+        self.assertIn("--rsh='/usr/bin/ssh -o ControlMaster=auto", ssh_pool.rsync_rsh_option())
+
+    @patch('lib.utils.logger')
+    @patch('lib.utils.stream_process_output')
+    @patch('subprocess.Popen')
+    def test_rsh_is_not_sudo_wrapped(self, mock_popen, mock_stream, mock_logger):
+        """The ssh started by rsync already runs as cadtools and must not be rewritten"""
+        executor._execution_mode = 'setuid'
+        executor._sudo_path = '/opt/cadinstall/bin/.sudo'
+        ssh_pool._control_dir = '/tmp/cadinstall.ssh.test.1'
+        mock_popen.return_value.returncode = 0
+
+        command = "/usr/bin/rsync -av %s src/ host:dest/" % ssh_pool.rsync_rsh_option()
+        utils.run_command(command)
+
+        argv = mock_popen.call_args[0][0]
+        self.assertEqual(argv[:2], ['/opt/cadinstall/bin/.sudo', '/usr/bin/rsync'])
+        rsh = [arg for arg in argv if arg.startswith('--rsh=')]
+        self.assertEqual(len(rsh), 1)
+        self.assertTrue(rsh[0].startswith('--rsh=/usr/bin/ssh -o ControlMaster=auto'))
+        self.assertEqual(sum(arg.count('.sudo') for arg in argv), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
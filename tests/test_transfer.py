@@ -0,0 +1,329 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import re
+import shlex
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import transfer
+from lib.manifest import ManifestEntry
+from lib.transfer_profiles import TransferProfile
+from lib.journal import InstallJournal
+
+
+def entry(path, kind='f', size=0):
+    return ManifestEntry(path=path, type=kind, size=size, blocks=0, mode=0o644, mtime=0,
+                         dev=1, ino=hash(path), nlink=1, hash=None)
+
+
+class FakeManifest:
+    def __init__(self, entries):
+        self._entries = entries
+        self.totals = SimpleNamespace(files=len([e for e in entries if e.type == 'f']),
+                                      apparent_bytes=sum(e.size for e in entries))
+
+    def entries(self):
+        return iter(self._entries)
+
+    def files(self):
+        return (e for e in self._entries if e.type == 'f')
+
+
+def read_list(path):
+    with open(path, 'rb') as f:
+        return [os.fsdecode(name) for name in f.read().split(b'\0') if name]
+
+
+class TestShardPlanning(unittest.TestCase):
+    """Test cases for splitting a manifest into transfer shards"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.prefix = os.path.join(self.tmp.name, 'files')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_every_entry_lands_in_one_shard(self):
+        big = transfer.LARGE_FILE_BYTES
+        entries = [entry('lib', 'd'), entry('lib/sub', 'd'), entry('link', 'l', 3)]
+        entries += [entry('lib/huge%d' % i, size=big * (i + 1)) for i in range(4)]
+        entries += [entry('lib/sub/small%d' % i, size=1000) for i in range(200)]
+
+        with patch('lib.tool_defs.transfer_file_cost', 1024):
+            dirs_path, shards, ranged = transfer.plan_shards(FakeManifest(entries), 4, self.prefix)
+
+        self.assertEqual(read_list(dirs_path), ['.', 'lib', 'lib/sub'])
+        listed = [name for shard in shards for name in read_list(shard.list_path)]
+        self.assertEqual(sorted(listed), sorted(e.path for e in entries if e.type != 'd'))
+        # Each huge file goes to its own shard
+        for shard in shards:
+            self.assertEqual(len([n for n in read_list(shard.list_path) if 'huge' in n]), 1)
+        self.assertEqual(sum(shard.files for shard in shards), 205)
+        self.assertEqual(ranged, [])
+
+    def test_big_files_are_left_for_range_transfer(self):
+        big = transfer.LARGE_FILE_BYTES
+        entries = [entry('small', size=10), entry('medium', size=big), entry('huge', size=big * 10)]
+        dirs_path, shards, ranged = transfer.plan_shards(FakeManifest(entries), 2, self.prefix,
+                                                         ranged_min_bytes=big * 4)
+        self.assertEqual([e.path for e in ranged], ['huge'])
+        listed = [name for shard in shards for name in read_list(shard.list_path)]
+        self.assertEqual(sorted(listed), ['medium', 'small'])
+
+    def test_small_tree_does_not_use_empty_shards(self):
+        dirs_path, shards, ranged = transfer.plan_shards(FakeManifest([entry('a', size=10)]), 8, self.prefix)
+        self.assertEqual(len(shards), 1)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ['files.0', 'files.dirs'])
+
+
+class TestShardedTransfer(unittest.TestCase):
+    """Test cases for running the shards"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        entries = [entry('d', 'd')] + [entry('d/f%d' % i, size=100) for i in range(8)]
+        self.manifest = FakeManifest(entries)
+        for target, value in (('lib.transfer._list_prefix', os.path.join(self.tmp.name, 'files')),
+                              ('lib.transfer.range_transfer_available', False),
+                              ('lib.transfer.transfer_rsync_options', '--whole-file')):
+            patcher = patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @patch('lib.transfer.logger')
+    @patch('lib.transfer.check_same_host', return_value=1)
+    @patch('lib.transfer.run_command', return_value=0)
+    def test_only_failed_shards_are_retried(self, mock_run, mock_same_host, mock_logger):
+        calls = []
+
+        async def fake_run(command, **kwargs):
+            calls.append(command)
+            # The shard holding d/f0 fails once
+            if 'files.0' in command and calls.count(command) == 1:
+                return 23, ''
+            return 0, ''
+
+        with patch('lib.transfer.run_command_async', side_effect=fake_run):
+            status = transfer.sharded_transfer(self.manifest, '/src', '/dest', 'host.example.com',
+                                               'cadtools:cadtools', shards=4)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(len(calls), 5)
+        self.assertIn('--files-from=%s' % os.path.join(self.tmp.name, 'files.0'), calls[0])
+        self.assertIn(' --whole-file ', calls[0])
+        self.assertIn(' /src/ host.example.com:/dest/', calls[0])
+        # Skeleton before and after the shards
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertIn('files.dirs', mock_run.call_args[0][0])
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    @patch('lib.transfer.check_same_host', return_value=0)
+    @patch('lib.transfer.run_command', return_value=0)
+    def test_link_dest_is_given_to_every_shard(self, mock_run, mock_same_host):
+        calls = []
+
+        async def fake_run(command, **kwargs):
+            calls.append(command)
+            return 0, "Number of files: 4 (reg: 4)\nNumber of regular files transferred: 1\n" \
+                      "Total file size: 400 bytes\nTotal transferred file size: 100 bytes\n" \
+                      "Literal data: 10 bytes\nMatched data: 90 bytes\n"
+
+        with patch('lib.transfer.run_command_async', side_effect=fake_run), \
+             patch('lib.transfer.logger') as mock_logger:
+            status = transfer.sharded_transfer(self.manifest, '/src', '/dest', 'localhost', 'cadtools:cadtools',
+                                               shards=2, link_dest='/prev')
+
+        self.assertEqual(status, 0)
+        self.assertEqual(len(calls), 2)
+        for command in calls:
+            self.assertIn(' --link-dest=/prev --stats ', command)
+        messages = [call[0][0] for call in mock_logger.info.call_args_list]
+        self.assertIn('Linked 6 unchanged files (600.00 B) to /prev on localhost; 180.00 B of changed files '
+                      'reused, 20.00 B sent', messages)
+
+    def test_parse_rsync_stats(self):
+        output = ("sent 1,234 bytes  received 56 bytes\n"
+                  "Number of files: 12,345 (reg: 10,000, dir: 2,000, link: 345)\n"
+                  "Number of created files: 10\n"
+                  "Number of regular files transferred: 1,200\n"
+                  "Total file size: 9,876,543,210 bytes\n"
+                  "Total transferred file size: 1,000,000 bytes\n"
+                  "Literal data: 250,000 bytes\n"
+                  "Matched data: 750,000 bytes\n")
+        self.assertEqual(transfer.parse_rsync_stats(output), {
+            'files': 10000, 'files_transferred': 1200, 'total_bytes': 9876543210,
+            'transferred_bytes': 1000000, 'literal_bytes': 250000, 'matched_bytes': 750000})
+        self.assertEqual(transfer.parse_rsync_stats("Number of files transferred: 3")['files_transferred'], 3)
+        self.assertEqual(transfer.parse_rsync_stats('')['total_bytes'], 0)
+
+    @patch('lib.transfer.logger')
+    @patch('lib.transfer.check_same_host', return_value=0)
+    @patch('lib.transfer.run_command', return_value=0)
+    def test_persistent_failure_is_reported(self, mock_run, mock_same_host, mock_logger):
+        async def fake_run(command, **kwargs):
+            return (23, '') if 'files.1' in command else (0, '')
+
+        with patch('lib.transfer.run_command_async', side_effect=fake_run) as mock_async, \
+             patch('lib.tool_defs.transfer_retries', 2):
+            status = transfer.sharded_transfer(self.manifest, '/src', '/dest', 'localhost',
+                                               'cadtools:cadtools', shards=2)
+
+        self.assertEqual(status, 23)
+        self.assertEqual(mock_async.call_count, 2 + 2)
+        # The closing skeleton pass is not run after a failure
+        self.assertEqual(mock_run.call_count, 1)
+
+    @patch('lib.transfer.logger')
+    @patch('lib.transfer.check_same_host', return_value=0)
+    @patch('lib.transfer.run_command', return_value=0)
+    def test_resume_sends_only_missing_shards(self, mock_run, mock_same_host, mock_logger):
+        journal_dir = os.path.join(self.tmp.name, 'journals')
+        fail = ['files.1']
+
+        async def fake_run(command, **kwargs):
+            return (23, '') if any(name in command for name in fail) else (0, '')
+
+        def run():
+            journal = InstallJournal.load('/dest', 'yyz') or InstallJournal('/dest', 'yyz', '/src')
+            with patch('lib.transfer.run_command_async', side_effect=fake_run) as mock_async, \
+                 patch('lib.tool_defs.transfer_retries', 1):
+                status = transfer.sharded_transfer(self.manifest, '/src', '/dest', 'localhost',
+                                                   'cadtools:cadtools', shards=4, journal=journal)
+            return status, journal, [call[0][0] for call in mock_async.call_args_list]
+
+        with patch('lib.tool_defs.journal_dir', journal_dir), \
+             patch('lib.my_globals.get_pretend', return_value=False):
+            status, journal, calls = run()
+            self.assertEqual(status, 23)
+            self.assertEqual(len(calls), 4 + 1)
+            self.assertEqual(sorted(journal.data['shards']), [0, 2, 3])
+
+            fail.clear()
+            status, journal, calls = run()
+            self.assertEqual(status, 0)
+            self.assertEqual(len(calls), 1)
+            self.assertIn('--files-from=%s.1 ' % journal.plan_prefix, calls[0])
+            journal.remove()
+        self.assertEqual(os.listdir(journal_dir), [])
+
+
+class TestRangeTransfer(unittest.TestCase):
+    """Test cases for copying one big file in byte ranges"""
+
+    def test_split_ranges(self):
+        self.assertEqual(transfer.split_ranges(100, 4, 10), [(0, 25), (25, 25), (50, 25), (75, 25)])
+        self.assertEqual(transfer.split_ranges(100, 8, 40), [(0, 50), (50, 50)])
+        self.assertEqual(transfer.split_ranges(101, 2, 1), [(0, 51), (51, 50)])
+        self.assertEqual(transfer.split_ranges(5, 8, 64), [(0, 5)])
+
+    def test_dd_commands(self):
+        with patch('lib.transfer.check_same_host', return_value=0):
+            local = transfer.dd_range_command('/src/a b', '/dest/.a b.cadinstall.part', 'localhost', 100, 50)
+        self.assertTrue(local.startswith("/usr/bin/dd if='/src/a b' of='/dest/.a b.cadinstall.part' "))
+        self.assertIn('skip=100 seek=100 count=50', local)
+        self.assertNotIn('|', local)
+
+        with patch('lib.transfer.check_same_host', return_value=1), \
+             patch('lib.transfer.transfer_ssh_prefix', return_value='/usr/bin/ssh host.example.com'):
+            remote = transfer.dd_range_command('/src/a', '/dest/.a.cadinstall.part', 'host.example.com', 100, 50)
+        read, write = remote.split(' | ')
+        self.assertIn('skip=100 count=50', read)
+        self.assertTrue(write.startswith("/usr/bin/ssh host.example.com '/usr/bin/dd of=/dest/.a.cadinstall.part "))
+        self.assertIn('seek=100', write)
+
+    @patch('lib.transfer.logger')
+    @patch('lib.transfer.check_same_host', return_value=0)
+    def test_copy_ranges_checks_hash_before_moving(self, mock_same_host, mock_logger):
+        size = transfer.LARGE_FILE_BYTES * 3
+        big = entry('lib/big.db', size=size)._replace(mode=0o755, mtime=1700000000123456789)
+        commands = []
+
+        async def fake_run(command, **kwargs):
+            commands.append(command)
+            return 0, ''
+
+        def run(digests):
+            commands.clear()
+            with patch('lib.transfer.run_command_async', side_effect=fake_run), \
+                 patch('lib.transfer._source_hash', return_value='abc'), \
+                 patch('lib.transfer.hash_paths', return_value=[(digests, None)]), \
+                 patch('lib.transfer.run_batch', return_value=[{'status': 0}] * 3) as mock_batch, \
+                 patch('lib.tool_defs.range_transfer_streams', 8):
+                status = asyncio.run(transfer._copy_ranges(big, '/src', '/dest', 'localhost', asyncio.Semaphore(4)))
+            return status, [step['command'] for step in mock_batch.call_args[0][1]]
+
+        status, steps = run('abc')
+        self.assertEqual(status, 0)
+        self.assertEqual(len(commands), 3)
+        self.assertEqual(steps, [
+            "/usr/bin/chmod 755 /dest/lib/.big.db.cadinstall.part",
+            "/usr/bin/touch -m -d @1700000000.123456789 /dest/lib/.big.db.cadinstall.part",
+            "/usr/bin/mv -f /dest/lib/.big.db.cadinstall.part /dest/lib/big.db",
+        ])
+
+        status, steps = run('different')
+        self.assertEqual(status, 1)
+        self.assertEqual(steps, ["/usr/bin/rm -f /dest/lib/.big.db.cadinstall.part"])
+
+
+class TestTarStream(unittest.TestCase):
+    """Test cases for the tar stream backend"""
+
+    def test_chosen_for_small_file_trees(self):
+        small = FakeManifest([])
+        small.totals = type('Totals', (), {'files': 50000, 'apparent_bytes': 50000 * 4096})()
+        self.assertTrue(transfer.use_tar_stream(small))
+        small.totals.apparent_bytes = 50000 * 10 * 1024 * 1024
+        self.assertFalse(transfer.use_tar_stream(small))
+        small.totals.files = 10
+        small.totals.apparent_bytes = 10
+        self.assertFalse(transfer.use_tar_stream(small))
+
+    def test_remote_command_compresses(self):
+        with patch('lib.transfer.check_same_host', return_value=1), \
+             patch('lib.transfer.transfer_ssh_prefix', return_value='/usr/bin/ssh host.example.com'), \
+             patch('lib.transfer.get_transfer_profile',
+                   return_value=TransferProfile('wan', {'compress': 'zstd', 'compress_level': 3})):
+            command = transfer.tar_stream_command('/src', '/dest', 'host.example.com', '/tmp/list')
+        create, extract = command.split(' | ')
+        self.assertEqual(create, "/usr/bin/tar -C /src --null --no-recursion -T /tmp/list "
+                                 "--mode=a=rX,u+w -I 'zstd -T0 -3' -cf -")
+        self.assertEqual(shlex.split(extract), ['/usr/bin/ssh', 'host.example.com',
+                                                "/usr/bin/tar -C /dest -I 'zstd -T0 -3' -xpf -"])
+
+    @patch('lib.transfer.logger')
+    @patch('lib.transfer.check_same_host', return_value=1)
+    @patch('lib.transfer.ssh_prefix', return_value='/usr/bin/ssh host.example.com')
+    @patch('lib.transfer.transfer_ssh_prefix', return_value='/usr/bin/ssh host.example.com')
+    @patch('lib.transfer.get_transfer_profile', return_value=TransferProfile('lan', {}))
+    def test_missing_entries_fail_the_transfer(self, mock_profile, mock_transfer_ssh, mock_ssh, mock_same_host,
+                                               mock_logger):
+        manifest = FakeManifest([entry('d', 'd'), entry('d/a'), entry('-b')])
+        manifest.totals = type('Totals', (), {'apparent_bytes': 0})()
+        with patch('lib.transfer.run_command', return_value=0) as mock_run, \
+             patch('lib.transfer.run_command_with_output', return_value=(0, 'xx')):
+            status = transfer.tar_stream_transfer(manifest, '/src', '/dest', 'host.example.com')
+
+        self.assertEqual(status, 1)
+        list_path = re.search(r'-T (\S+)', mock_run.call_args[0][0]).group(1)
+        self.assertFalse(os.path.exists(list_path))
+
+        with patch('lib.transfer.run_command', return_value=0), \
+             patch('lib.transfer.run_command_with_output', return_value=(0, 'xx\nx')):
+            self.assertEqual(transfer.tar_stream_transfer(manifest, '/src', '/dest', 'host.example.com'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import transfer_profiles
+from lib import ssh_pool
+from lib import probe_cache
+
+
+class TestTransferProfiles(unittest.TestCase):
+    """Test cases for choosing and applying per-site transfer profiles"""
+
+    def setUp(self):
+        transfer_profiles._selected.clear()
+        probe_cache.clear_probe_cache()
+        for target, value in (('lib.transfer_profiles.current_host', 'build01.aus2.example.com'),
+                              ('lib.transfer_profiles.logger', None)):
+            patcher = patch(target, return_value=value) if value else patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        transfer_profiles._selected.clear()
+        probe_cache.clear_probe_cache()
+        ssh_pool._control_dir = None
+
+    @patch('lib.tool_defs.siteHash', {'aus': 'nfs.aus2.example.com', 'yyz': 'nfs.yyz2.example.com',
+                                      'sjc': 'nfs.sjc1.example.com'})
+    @patch('lib.tool_defs.siteTransferProfile', {'sjc': 'lan'})
+    def test_selection(self):
+        choose = lambda host: transfer_profiles.get_transfer_profile(host).name
+        self.assertEqual(choose('BUILD01.aus2.example.com'), 'local')
+        self.assertEqual(choose('nfs.aus2.example.com'), 'lan')
+        self.assertEqual(choose('nfs.yyz2.example.com'), 'wan')
+        # Configured per site
+        self.assertEqual(choose('nfs.sjc1.example.com'), 'lan')
+        logged = [call[0][0] for call in transfer_profiles.logger.info.call_args_list]
+        self.assertIn('Transfer profile for sjc: lan (configured) - no compression, whole files', logged)
+        # Chosen and logged once per host
+        choose('nfs.yyz2.example.com')
+        self.assertEqual(len(logged), 4)
+
+    def test_rsync_options(self):
+        wan = transfer_profiles.TransferProfile('wan', {'compress': 'zstd', 'compress_level': 3,
+                                                        'whole_file': False, 'block_size': 131072})
+        with patch('lib.tool_defs.rsync_skip_compress', 'gz/zst'):
+            self.assertEqual(wan.rsync_options(), "--no-whole-file --compress --compress-choice=zstd "
+                                                  "--compress-level=3 --skip-compress=gz/zst --block-size=131072")
+            self.assertEqual(wan.rsync_options(zstd_supported=False), "--no-whole-file --compress "
+                                                                      "--compress-level=3 --skip-compress=gz/zst "
+                                                                      "--block-size=131072")
+        self.assertEqual(transfer_profiles.TransferProfile('lan', {}).rsync_options(), "--whole-file")
+        self.assertEqual(wan.tar_compress(), 'zstd -T0 -3')
+        with self.assertRaises(ValueError):
+            transfer_profiles.TransferProfile('bad', {'compression': 'zstd'})
+
+    @patch('lib.tool_defs.siteTransferProfile', {})
+    def test_old_rsync_falls_back_to_zlib(self):
+        versions = {None: (3, 2, 7), 'nfs.yyz2.example.com': (3, 1, 3)}
+        with patch('lib.transfer_profiles.rsync_version', side_effect=lambda host=None: versions[host]):
+            options = transfer_profiles.transfer_rsync_options('nfs.yyz2.example.com')
+            self.assertNotIn('--compress-choice', options)
+            self.assertIn('--compress ', options)
+            versions['nfs.yyz2.example.com'] = (3, 2, 3)
+            self.assertIn('--compress-choice=zstd', transfer_profiles.transfer_rsync_options('nfs.yyz2.example.com'))
+        self.assertEqual(transfer_profiles.parse_rsync_version(
+            "rsync  version 3.2.7  protocol version 31\nCopyright (C) 1996-2022"), (3, 2, 7))
+        self.assertIsNone(transfer_profiles.parse_rsync_version("bash: rsync: command not found"))
+
+    @patch('lib.tool_defs.siteTransferProfile', {})
+    def test_cipher_uses_its_own_connection(self):
+        ssh_pool._control_dir = '/tmp/cadinstall.ssh.test.1'
+        with patch.dict('lib.tool_defs.transferProfiles', {'wan': {'cipher': 'aes128-gcm@openssh.com'}}):
+            self.assertEqual(ssh_pool.rsync_rsh_option('nfs.yyz2.example.com'),
+                             "--rsh='/usr/bin/ssh -o ControlPath=none -c aes128-gcm@openssh.com'")
+            self.assertEqual(ssh_pool.transfer_ssh_prefix('nfs.yyz2.example.com'),
+                             '/usr/bin/ssh -o ControlPath=none -c aes128-gcm@openssh.com nfs.yyz2.example.com')
+        # Without a cipher transfers share the pooled master
+        self.assertEqual(ssh_pool.transfer_ssh_prefix('nfs.aus2.example.com'),
+                         ssh_pool.ssh_prefix('nfs.aus2.example.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.treescan import ExcludeRule, ExcludeList, load_exclude_rules, scan_tree
+
+
+class TestExcludeRules(unittest.TestCase):
+    """Test cases for rsync-style exclude matching"""
+
+    def test_name_patterns(self):
+        rules = ExcludeList([ExcludeRule('*.swp'), ExcludeRule('.git'), ExcludeRule('.nfs*')])
+        self.assertTrue(rules.matches('a/b/file.swp', False))
+        self.assertTrue(rules.matches('.git', True))
+        self.assertTrue(rules.matches('sub/.nfs0001', False))
+        self.assertFalse(rules.matches('a/b/file.swpx', False))
+        self.assertFalse(rules.matches('a/.github', True))
+
+    def test_anchored_and_directory_patterns(self):
+        rules = ExcludeList([ExcludeRule('/build'), ExcludeRule('cache/'), ExcludeRule('doc/*.pdf')])
+        self.assertTrue(rules.matches('build', True))
+        self.assertFalse(rules.matches('src/build', True))
+        self.assertTrue(rules.matches('x/cache', True))
+        self.assertFalse(rules.matches('x/cache', False))
+        self.assertTrue(rules.matches('pkg/doc/manual.pdf', False))
+        self.assertFalse(rules.matches('pkg/doc/sub/manual.pdf', False))
+        self.assertTrue(ExcludeRule('doc/**.pdf').matches('doc/sub/manual.pdf', False))
+
+    def test_repo_exclude_list_loads(self):
+        rules = load_exclude_rules()
+        self.assertTrue(rules.matches('tool/__pycache__', True))
+        self.assertTrue(rules.matches('tool/notes.txt~', False))
+
+
+class TestScanTree(unittest.TestCase):
+    """Test cases for the parallel tree scanner"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, rel, size):
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_counts_and_hardlinks(self):
+        first = self.write('bin/tool', 1000)
+        os.link(first, os.path.join(self.root, 'bin', 'tool-alias'))
+        self.write('lib/deep/a/b/c/libx.so', 300)
+        os.symlink('tool', os.path.join(self.root, 'bin', 'link'))
+
+        scan = scan_tree(self.root, rules=[], workers=4)
+        self.assertEqual(scan.files, 3)
+        self.assertEqual(scan.hardlinks, 1)
+        self.assertEqual(scan.symlinks, 1)
+        self.assertEqual(scan.dirs, 6)
+        self.assertEqual(scan.apparent_bytes, 1000 + 300 + len('tool'))
+        self.assertGreater(scan.allocated_bytes, 0)
+        self.assertEqual(scan.size, max(scan.apparent_bytes, scan.allocated_bytes))
+        self.assertEqual(scan.errors, [])
+
+    def test_excluded_entries_are_skipped(self):
+        self.write('src/main.c', 100)
+        self.write('src/main.c.swp', 5000)
+        self.write('.git/objects/pack', 7000)
+
+        scan = scan_tree(self.root, workers=2)
+        self.assertEqual(scan.files, 1)
+        self.assertEqual(scan.apparent_bytes, 100)
+        self.assertEqual(scan.excluded, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
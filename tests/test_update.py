@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import getpass
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import update
+from lib.manifest import build_manifest
+
+COMPLETED = "Installed by: someone\nInstall started on: x\nInstall completed on: y\n"
+MINE = COMPLETED.replace('someone', getpass.getuser())
+
+
+def write(path, data, mtime=1700000000):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+class TestUpdate(unittest.TestCase):
+    """Test cases for patching an installed tree in place"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.src = os.path.join(self.tmp.name, 'src')
+        self.dest = os.path.join(self.tmp.name, 'dest')
+        for root in (self.src, self.dest):
+            write(os.path.join(root, 'bin/same'), 'same')
+            write(os.path.join(root, 'lib/touched'), 'abcd', mtime=1700000000 if root == self.dest else 1700000500)
+            os.symlink('bin/same', os.path.join(root, 'link'))
+        write(os.path.join(self.src, 'bin/grown'), 'longer')
+        write(os.path.join(self.dest, 'bin/grown'), 'short')
+        write(os.path.join(self.src, 'new/file'), 'new')
+        # Sub-second differences are not changes, as in rsync's quick check
+        os.utime(os.path.join(self.dest, 'bin/same'), ns=(0, 1700000000 * 10**9 + 5))
+        with patch('lib.manifest.logger'):
+            self.manifest = build_manifest(self.src, os.path.join(self.tmp.name, 'manifest.gz'))
+        for target, kwargs in (('lib.update.logger', {}),
+                               ('lib.update.check_same_host', {'return_value': 0}),
+                               ('lib.update.get_manifest', {'return_value': self.manifest}),
+                               ('lib.my_globals.get_pretend', {'return_value': False})):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_plan_finds_new_and_changed_entries(self):
+        plan = update.plan_update(self.manifest, self.dest, 'localhost')
+        self.assertEqual(plan.checked, 8)
+        self.assertEqual(sorted(entry.path for entry in plan.added), ['new', 'new/file'])
+        self.assertEqual(sorted(entry.path for entry in plan.changed), ['bin/grown', 'lib/touched'])
+        self.assertEqual(plan.bytes(), 3 + 6 + 4)
+
+    def test_retargeted_symlink_is_changed(self):
+        """A symlink pointing elsewhere is a change even if the target length is the same"""
+        os.remove(os.path.join(self.dest, 'link'))
+        os.symlink('bin/gone', os.path.join(self.dest, 'link'))
+        plan = update.plan_update(self.manifest, self.dest, 'localhost')
+        self.assertIn('link', [entry.path for entry in plan.changed])
+
+    def test_delete_keeps_metadata_and_reports_removed(self):
+        command = update.delete_command(self.src, self.dest, 'localhost')
+        self.assertIn(' --delete --existing --ignore-existing ', command)
+        self.assertIn(' --exclude=/.cadinstall.metadata ', command)
+        self.assertNotIn('--dry-run', command)
+        with patch('lib.my_globals.get_pretend', return_value=True):
+            self.assertIn(' --dry-run ', update.delete_command(self.src, self.dest, 'localhost'))
+
+        output = "*deleting   old/lib.so\n*deleting   old/\n.d..t...... bin/\n"
+        with patch('lib.update.run_command_with_output', return_value=(0, output)):
+            status, removed = update.delete_removed(self.src, self.dest, 'localhost')
+        self.assertEqual((status, removed), (0, ['old/lib.so', 'old']))
+
+    @patch('lib.update.append_update_record')
+    @patch('lib.update.apply_install_permissions')
+    @patch('lib.update.run_command', return_value=0)
+    def test_only_changes_are_copied_and_recorded(self, mock_run, mock_perms, mock_record):
+        with patch('lib.update.read_metadata', return_value=COMPLETED):
+            status = update.update_install(self.src, self.dest, 'localhost', 'cadtools')
+
+        self.assertEqual(status, 0)
+        self.assertIn(' --files-from=', mock_run.call_args[0][0])
+        paths = sorted(mock_perms.call_args[1]['paths'])
+        self.assertEqual(paths, ['bin/grown', 'lib/touched', 'new', 'new/file'])
+        metadata, src, _, summary = mock_record.call_args[0][2:]
+        self.assertEqual((metadata, src), (COMPLETED, self.src))
+        self.assertEqual(summary, "2 added, 2 changed (13.00 B)")
+
+    @patch('lib.update.run_command', return_value=0)
+    def test_unfinished_install_needs_force(self, mock_run):
+        with patch('lib.update.read_metadata', return_value="Installed by: someone\nInstall started on: x\n"):
+            self.assertEqual(update.update_install(self.src, self.dest, 'localhost', 'cadtools'), 1)
+            mock_run.assert_not_called()
+            with patch('lib.my_globals.get_force', return_value=True), \
+                 patch('lib.update.apply_install_permissions'), \
+                 patch('lib.update.append_update_record'):
+                self.assertEqual(update.update_install(self.src, self.dest, 'localhost', 'cadtools'), 0)
+        self.assertEqual(update.update_install(self.src, os.path.join(self.tmp.name, 'missing'),
+                                               'localhost', 'cadtools'), 1)
+
+    @patch('lib.update.delete_removed')
+    @patch('lib.update.run_command', return_value=0)
+    def test_delete_needs_a_completed_install_of_this_user(self, mock_run, mock_delete):
+        for metadata in ("Installed by: %s\nInstall started on: x\n" % getpass.getuser(), COMPLETED):
+            with patch('lib.update.read_metadata', return_value=metadata), \
+                 patch('lib.my_globals.get_force', return_value=True):
+                self.assertEqual(update.update_install(self.src, self.dest, 'localhost', 'cadtools', delete=True), 1)
+        mock_run.assert_not_called()
+        mock_delete.assert_not_called()
+
+    @patch('lib.update.append_update_record')
+    @patch('lib.update.apply_install_permissions')
+    @patch('lib.update.run_command', return_value=0)
+    @patch('lib.update.read_metadata', return_value=MINE)
+    def test_delete_is_listed_and_confirmed_first(self, mock_metadata, mock_run, mock_perms, mock_record):
+        listed = (0, ['old/lib.so', 'old'])
+        with patch('lib.update.delete_removed', return_value=listed) as mock_delete, \
+             patch('builtins.input', return_value='delete'):
+            self.assertEqual(update.update_install(self.src, self.dest, 'localhost', 'cadtools', delete=True), 1)
+        # Declined: only the dry run ran, and nothing was copied
+        self.assertEqual(mock_delete.call_args_list, [((self.src, self.dest, 'localhost'), {'dry_run': True})])
+        mock_run.assert_not_called()
+
+        with patch('lib.update.delete_removed', return_value=listed) as mock_delete, \
+             patch('builtins.input', return_value='DELETE'):
+            self.assertEqual(update.update_install(self.src, self.dest, 'localhost', 'cadtools', delete=True), 0)
+        self.assertEqual(mock_delete.call_args_list, [((self.src, self.dest, 'localhost'), {'dry_run': True}),
+                                                      ((self.src, self.dest, 'localhost'),)])
+        mock_run.assert_called_once()
+        self.assertEqual(mock_record.call_args[0][5], "2 added, 2 changed (13.00 B), 2 removed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: © 2025 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import verify
+from lib import manifest
+from lib.remote_agent_main import MMAP_THRESHOLD
+
+
+class TestVerifyInstall(unittest.TestCase):
+    """Test cases for verifying an installed tree against its source"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        self.dest = os.path.join(self.tmp.name, 'dest')
+        os.makedirs(os.path.join(self.src, 'lib'))
+        with open(os.path.join(self.src, 'lib', 'big.so'), 'wb') as f:
+            f.write(os.urandom(MMAP_THRESHOLD + 1))
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(self.src, name), 'w') as f:
+                f.write(name * 10)
+        os.symlink('a', os.path.join(self.src, 'link'))
+        shutil.copytree(self.src, self.dest, symlinks=True)
+        with open(os.path.join(self.dest, '.cadinstall.metadata'), 'w') as f:
+            f.write('Installed by: someone\n')
+
+        verify._sources.clear()
+        verify._hash_cache = verify.HashCache(os.path.join(self.tmp.name, 'cache', 'hashes'))
+        patcher = patch('lib.utils.check_same_host', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        verify._hash_cache.close()
+        verify._hash_cache = None
+        verify._sources.clear()
+        manifest.remove_manifests()
+        self.tmp.cleanup()
+
+    def _verify(self):
+        with patch('lib.verify.logger') as mock_logger, patch('lib.manifest.logger'):
+            status = verify.verify_install(self.src, self.dest, 'localhost')
+        return status, mock_logger
+
+    def test_matching_tree(self):
+        status, mock_logger = self._verify()
+        self.assertEqual(status, 0)
+        mock_logger.error.assert_not_called()
+        hashed = [e for e in manifest.get_manifest(self.src).files() if e.hash]
+        self.assertEqual(len(hashed), 4)
+
+    def test_differences_are_reported(self):
+        with open(os.path.join(self.dest, 'a'), 'w') as f:
+            f.write('x' * 10)
+        os.remove(os.path.join(self.dest, 'b'))
+        with open(os.path.join(self.dest, 'c'), 'w') as f:
+            f.write('short')
+
+        status, mock_logger = self._verify()
+        self.assertEqual(status, 1)
+        messages = ' '.join(call[0][0] for call in mock_logger.error.call_args_list)
+        self.assertIn('content differs: %s/a' % self.dest, messages)
+        self.assertIn('missing: %s/b' % self.dest, messages)
+        self.assertIn('size differs: %s/c' % self.dest, messages)
+
+    def test_changed_link_target_is_reported(self):
+        os.remove(os.path.join(self.dest, 'link'))
+        os.symlink('b', os.path.join(self.dest, 'link'))
+
+        status, mock_logger = self._verify()
+        self.assertEqual(status, 1)
+        messages = ' '.join(call[0][0] for call in mock_logger.error.call_args_list)
+        self.assertIn('link target differs: %s/link' % self.dest, messages)
+
+    def test_concurrent_sites_hash_the_source_once(self):
+        calls = []
+        real_hash_paths = verify.hash_paths
+        started = threading.Event()
+
+        def slow_hash_paths(paths, workers=None):
+            calls.append(paths)
+            started.set()
+            # Let the second site reach hash_source while this one hashes
+            threading.Event().wait(0.2)
+            return real_hash_paths(paths, workers)
+
+        results = []
+        with patch('lib.verify.hash_paths', side_effect=slow_hash_paths), \
+             patch('lib.verify.logger'), patch('lib.manifest.logger'):
+            threads = [threading.Thread(target=lambda: results.append(verify.hash_source(self.src)))
+                       for _ in range(2)]
+            threads[0].start()
+            started.wait(5)
+            threads[1].start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertIs(results[0], results[1])
+
+    def test_repeat_verification_uses_cache(self):
+        self.assertEqual(self._verify()[0], 0)
+        # A new run: fresh manifest, hashes read back from the cache file
+        verify._hash_cache.close()
+        verify._sources.clear()
+        manifest.remove_manifests()
+
+        with patch('lib.verify.hash_paths', side_effect=AssertionError('hashed again')):
+            status, mock_logger = self._verify()
+        self.assertEqual(status, 0)
+        self.assertIn('0 files hashed, 4 cached', mock_logger.info.call_args[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()